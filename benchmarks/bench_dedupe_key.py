@@ -0,0 +1,54 @@
+"""
+Time the organizer's de-duplication keys against printer.format_entry.
+
+    python benchmarks/bench_dedupe_key.py [entry-count]
+
+"""
+import sys
+import time
+import datetime
+
+from beancount.core import data, amount
+from beancount.core.number import D
+from beancount.parser import printer
+
+from coolbeans.tools.fingerprint import entry_dedupe_key
+
+
+def make_entries(count: int) -> list:
+    entries = []
+    for i in range(count):
+        units = amount.Amount(D(i % 997) + D('0.99'), 'USD')
+        entries.append(data.Transaction(
+            meta=data.new_metadata('/bench/ledger.bean', i),
+            date=datetime.date(2020, 1, 1) + datetime.timedelta(days=i % 365),
+            flag='*',
+            payee=f"Merchant {i % 5000}",
+            narration=f"MERCHANT {i % 5000:05d} STORE {i % 7000}",
+            tags=data.EMPTY_SET,
+            links=data.EMPTY_SET,
+            postings=[
+                data.Posting('Liabilities:CreditCard:Chase', -units, None, None, None, None),
+                data.Posting(f'Expenses:Category{i % 50}', units, None, None, None, None),
+            ],
+        ))
+    return entries
+
+
+def time_keys(name: str, key, entries: list):
+    start = time.perf_counter()
+    keys = {key(entry) for entry in entries}
+    elapsed = time.perf_counter() - start
+    print(f"{name:>16}: {len(entries)} entries, {len(keys)} distinct in {elapsed:.2f}s")
+    return elapsed
+
+
+def main(count: int = 100000):
+    entries = make_entries(count)
+    rendered = time_keys('format_entry', printer.format_entry, entries)
+    structural = time_keys('entry_dedupe_key', entry_dedupe_key, entries)
+    print(f"{rendered / structural:.0f}x faster")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:2]))
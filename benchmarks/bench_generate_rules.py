@@ -0,0 +1,98 @@
+"""
+Time rule generation for a large batch of pending entries, against the
+previous generate_new_rules which grouped on the exact narration, kept the
+amounts in a list and sorted the proposals after every candidate.
+
+    python benchmarks/bench_generate_rules.py [entry-count]
+
+"""
+import sys
+import time
+import random
+import datetime
+
+from beancount.core import data
+from beancount.core.amount import Amount
+from beancount.core.number import D
+
+from coolbeans.rules.generate import propose_rules
+
+
+MERCHANTS = [
+    "AMZN Mktp US*{id}", "UBER   *TRIP {id}", "SQ *BLUE BOTTLE {n}", "CHECK {n}",
+    "POS DEBIT {n} SAFEWAY #{n}", "PAYPAL *{word} {id}", "TST* PIZZERIA {n}",
+]
+
+
+def make_entries(count: int, seed: int = 0) -> list:
+    rand = random.Random(seed)
+    letters = "ABCDEFGHJKLMNPQRSTUVWXYZ0123456789"
+    entries = []
+    for i in range(count):
+        narration = rand.choice(MERCHANTS).format(
+            id="".join(rand.choice(letters) for _ in range(9)) + str(i % 10),
+            n=rand.randrange(100000),
+            word=rand.choice(["NETFLIX", "SPOTIFY", "STEAM", f"SHOP{i % 5000}"]),
+        )
+        number = D(rand.randrange(100, 50000)) / 100
+        postings = [
+            data.Posting("Liabilities:CreditCard", Amount(-number, "USD"), None, None, "*", {}),
+            data.Posting("Expenses:FIXME", Amount(number, "USD"), None, None, "!", {}),
+        ]
+        entries.append(data.Transaction(
+            {'filename': 'bench', 'lineno': i}, datetime.date(2020, 1, 1), "!",
+            None, narration, data.EMPTY_SET, data.EMPTY_SET, postings,
+        ))
+    return entries
+
+
+def legacy_generate(entries) -> list:
+    bad_by_name = {}
+    for entry in entries:
+        if entry.flag == "!" and entry.narration:
+            n = entry.narration.lower()
+            if n in bad_by_name:
+                possible = bad_by_name[n]
+                possible['count'] += 1
+            else:
+                possible = bad_by_name[n] = {'count': 1, 'entry': entry, 'amounts': []}
+            for posting in entry.postings:
+                amt = float(abs(posting.units.number))
+                if amt not in possible['amounts']:
+                    possible['amounts'] += [amt]
+
+    new_rules = []
+    for n, possible in bad_by_name.items():
+        account = ""
+        for posting in possible['entry'].postings:
+            if posting.flag == "*":
+                account = posting.account
+        new_rules.append({
+            'match-narration': n,
+            'match-account': account,
+            'comment': {'count': possible['count'], 'amounts': possible['amounts']}
+        })
+        new_rules.sort(key=lambda item: (item['comment']['count'], item['match-narration']))
+    return new_rules
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main(count: int = 100000):
+    entries = make_entries(count)
+
+    rules, seconds = timed(propose_rules, entries)
+    print(f"propose_rules    {count} entries -> {len(rules):6} rules in {seconds:8.2f}s")
+
+    # The old code is quadratic, only give it a slice
+    legacy_count = min(count, 5000)
+    rules, seconds = timed(legacy_generate, entries[:legacy_count])
+    print(f"legacy           {legacy_count} entries -> {len(rules):6} rules in {seconds:8.2f}s")
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:]))
@@ -0,0 +1,152 @@
+"""
+Compare Rule.modify_entry with the previous implementation, which called
+entry._replace once per SetRule and rebuilt the postings for every posting
+level SetRule and again for the final '!' -> '*' step.
+
+    python benchmarks/bench_modify_entry.py
+
+"""
+import timeit
+import logging
+import collections
+import tracemalloc
+
+from beancount.core import data
+from beancount.parser import parser
+
+from coolbeans.rule import Rule
+
+
+logger = logging.getLogger(__name__)
+
+
+RULE = {
+    'match-narration': r"(?P<payee>amzn mktp us)\*(?P<meta_order_id>.*)",
+    'set-posting-account': 'Expenses:Shopping',
+    'set-posting-meta-category': 'online',
+    'set-transaction-meta-source': 'rules',
+    'set-narration': 'Amazon Order',
+    'set-tags': 'shopping',
+}
+
+ENTRY = parser.parse_one("""
+2020-04-08 ! "AMZN Mktp US*L08746BB3"
+  match-key: "2020040824692160098100992944500"
+  * Liabilities:CreditCard:Chase:Amazon  -39.98 USD
+  ! Expenses:FIXME                        20.00 USD
+  ! Expenses:FIXME                        19.98 USD
+""")
+
+
+def legacy_modify_entry(rule, entry, match_values, flag_to_done=True):
+    for sr in rule.set_rules:
+
+        if sr.directive == 'transaction':
+            if sr.meta_key:
+                meta = dict(entry.meta)
+                meta[sr.meta_key] = sr.value
+                entry = entry._replace(meta=meta)
+            else:
+                value = sr.value
+                if sr.parameter in ('links', 'tags'):
+                    current = set(getattr(entry, sr.parameter, set()) or set())
+                    current.add(value)
+                    value = current
+
+                entry = entry._replace(**{sr.parameter: value})
+
+        elif sr.directive == 'posting':
+            postings = []
+            for posting in entry.postings:
+                if posting.flag == '!':
+                    if sr.meta_key:
+                        meta = dict(posting.meta)
+                        meta[sr.meta_key] = sr.value
+                        posting = posting._replace(meta=meta)
+                    elif sr.value is not None:
+                        posting = posting._replace(**{sr.parameter: sr.value})
+                    logger.debug(f"New POSTING: {posting}")
+                postings.append(posting)
+
+            entry = entry._replace(postings=postings)
+
+        for field, value in match_values.items():
+            if field == "payee" and not entry.payee:
+                entry = entry._replace(payee=value.title())
+            if field.startswith('meta_'):
+                entry.meta[field[5:]] = value
+
+    if flag_to_done:
+        postings = []
+        for posting in entry.postings:
+            if posting.flag == '!':
+                posting = posting._replace(flag='')
+            postings.append(posting)
+        entry = entry._replace(postings=postings, flag='*')
+
+    return entry
+
+
+def allocations(func, count=1000):
+    """Allocated blocks still alive after count calls"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        results = [func() for _ in range(count)]
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    stats = after.compare_to(before, 'filename')
+    return sum(stat.count_diff for stat in stats) / count, results
+
+
+def rebuilds(func, entry) -> collections.Counter:
+    """How many Transaction/Posting namedtuples a single call on entry creates"""
+    counter = collections.Counter()
+    originals = {cls: cls._replace for cls in (data.Transaction, data.Posting)}
+
+    def counting(cls):
+        def _replace(self, **kwds):
+            counter[cls.__name__] += 1
+            return originals[cls](self, **kwds)
+        return _replace
+
+    try:
+        for cls in originals:
+            cls._replace = counting(cls)
+        func(entry)
+    finally:
+        for cls, original in originals.items():
+            cls._replace = original
+    return counter
+
+
+def main():
+    rule = Rule(RULE)
+    match_values = rule.check(ENTRY)
+    assert match_values is not None
+
+    def fresh_entry():
+        return ENTRY._replace(meta=dict(ENTRY.meta))
+
+    new = rule.modify_entry(fresh_entry(), match_values)
+    old = legacy_modify_entry(rule, fresh_entry(), match_values)
+    assert new == old, (new, old)
+
+    for name, modify in (
+            ('legacy', lambda entry: legacy_modify_entry(rule, entry, match_values)),
+            ('modify_entry', lambda entry: rule.modify_entry(entry, match_values))):
+        def func():
+            return modify(fresh_entry())
+        blocks, _ = allocations(func)
+        # The fresh copy of the entry is made before counting
+        counter = rebuilds(modify, fresh_entry())
+        seconds = min(timeit.repeat(func, number=10000, repeat=3))
+        print(
+            f"{name:14} {counter['Transaction']:3} Transactions {counter['Posting']:3} Postings "
+            f"{blocks:6.1f} live blocks/call  {seconds * 100:6.2f}us/call"
+        )
+
+
+if __name__ == "__main__":
+    main()
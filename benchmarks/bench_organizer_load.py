@@ -0,0 +1,55 @@
+"""
+Time loading a ledger and a dozen staged files for cool-organizer, one file
+at a time (the default) and in a process pool.
+
+    python benchmarks/bench_organizer_load.py [staged-files] [entries-per-file]
+
+"""
+import os
+import sys
+import time
+import pathlib
+import tempfile
+
+from coolbeans.organizer import BeanOrganizer
+
+
+ACCOUNTS = ['Liabilities:CreditCard:Chase', 'Assets:Banking:Checking', 'Expenses:FIXME', 'Expenses:Food']
+
+
+def write_file(path: pathlib.Path, count: int, seed: int):
+    lines = [f"2019-01-01 open {name}\n" for name in ACCOUNTS]
+    for i in range(count):
+        day = 1 + i * 28 // count
+        amount = f"{(i * 7 + seed) % 997}.99"
+        lines.append(
+            f'\n2020-{1 + seed % 12:02d}-{day:02d} ! "MERCHANT {(i + seed) % 5000:05d} STORE {i}"\n'
+            f'  match-key: "{seed:04d}{i:08d}"\n'
+            f'  Liabilities:CreditCard:Chase  -{amount} USD\n'
+            f'  Expenses:FIXME                 {amount} USD\n'
+        )
+    path.write_text("".join(lines))
+
+
+def main(file_count: int = 12, count: int = 5000):
+    with tempfile.TemporaryDirectory() as tmp:
+        root = pathlib.Path(tmp)
+        bean_file = root.joinpath("main.bean")
+        write_file(bean_file, count, 0)
+        staged = []
+        for seed in range(1, file_count + 1):
+            path = root.joinpath(f"staged-{seed}.bean")
+            write_file(path, count, seed)
+            staged.append(str(path))
+
+        organizer = BeanOrganizer.__new__(BeanOrganizer)
+        for workers in (1, os.cpu_count(), file_count):
+            start = time.perf_counter()
+            loaded = organizer.load_files(bean_file, staged, workers=workers)
+            elapsed = time.perf_counter() - start
+            print(f"{len(loaded)} files, {sum(map(len, loaded))} entries, "
+                  f"workers={workers}: {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:3]))
@@ -0,0 +1,108 @@
+"""
+Time merging a staged file into a ledger with BeanOrganizer.
+
+Half of the staged entries are the booked ('*') version of a pending ledger
+entry with the same match-key, so they replace it.  The other half are new.
+Then the merged entries are sorted and written out, and for comparison
+sorted again as one list.
+
+    python benchmarks/bench_organizer_merge.py [staged-count] [ledger-count]
+
+"""
+import gc
+import sys
+import time
+import pathlib
+import tempfile
+import datetime
+
+from beancount.core import data, amount
+from beancount.core.number import D
+
+from coolbeans.organizer import BeanOrganizer
+
+
+LEDGER = '/bench/ledger.bean'
+STAGED = '/bench/staged.bean'
+
+
+def make_entry(filename: str, lineno: int, key: int, flag: str, day: int) -> data.Transaction:
+    meta = data.new_metadata(filename, lineno)
+    meta['match-key'] = f"{key:012d}"
+    units = amount.Amount(D(key % 997) + D('0.99'), 'USD')
+    return data.Transaction(
+        meta=meta,
+        date=datetime.date(2020, 1, 1) + datetime.timedelta(days=day),
+        flag=flag,
+        payee=None,
+        narration=f"MERCHANT {key % 5000:05d} STORE {key}",
+        tags=data.EMPTY_SET,
+        links=data.EMPTY_SET,
+        postings=[
+            data.Posting(f'Liabilities:CreditCard:Card{key % 20}', -units, None, None, None, None),
+            data.Posting('Expenses:FIXME', units, None, None, '!' if flag == '!' else None, None),
+        ],
+    )
+
+
+class InMemoryOrganizer(BeanOrganizer):
+    """Skips the loader, the files are generated"""
+    files = {}
+
+    def load_beanfile(self, file_name, stop_on_error=False):
+        return self.files[str(file_name)]
+
+
+def main(staged_count: int = 100000, ledger_count: int = 200000):
+    # Both files are in date order, like a year file and a fresh import
+    ledger = [make_entry(LEDGER, i, i, '!', i * 365 // ledger_count) for i in range(ledger_count)]
+    staged = []
+    for i in range(staged_count):
+        # Every other staged entry books a pending ledger entry
+        key = i * 2 if i % 2 == 0 and i * 2 < ledger_count else ledger_count + i
+        staged.append(make_entry(STAGED, i, key, '*', i * 365 // staged_count))
+    InMemoryOrganizer.files = {LEDGER: ledger, STAGED: staged}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        organizer = InMemoryOrganizer(
+            bean_file=pathlib.Path(LEDGER),
+            input_files=[STAGED],
+            output=pathlib.Path(tmp).joinpath('out.bean'),
+            split_type='date',
+            do_filter=False,
+            between=(None, None),
+            # The files are in memory, there's nothing to load in parallel
+            workers=1,
+        )
+        elapsed = time.perf_counter() - start
+
+        booked = sum(1 for entry in organizer.entries if entry.flag == '*')
+        print(f"Merged {staged_count} staged into {ledger_count} entries in {elapsed:.2f}s")
+        print(f"{len(organizer.entries)} entries, {booked} booked")
+
+        start = time.perf_counter()
+        merged = sum(1 for _ in organizer.sorted_entries())
+        print(f"Sorted {merged} entries by source and merged in {time.perf_counter() - start:.2f}s")
+
+        start = time.perf_counter()
+        entries = organizer.entries.to_list()
+        entries.sort(key=organizer.ranked_sort_key(entries))
+        print(f"Sorted {merged} entries as one list in {time.perf_counter() - start:.2f}s")
+        del entries
+
+        for method in ('date', 'account'):
+            organizer.sort_method = method
+            gc.collect()
+            start = time.perf_counter()
+            sum(1 for _ in organizer.sorted_entries())
+            print(f"Sorted by {method} in {time.perf_counter() - start:.2f}s")
+        organizer.sort_method = 'date'
+
+        start = time.perf_counter()
+        organizer.save_entries()
+        print(f"Saved in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:3]))
@@ -0,0 +1,67 @@
+"""
+Time the rule conflict analysis on generated rules and entries.
+
+    python benchmarks/bench_rule_conflicts.py [rule-count] [entry-count]
+
+"""
+import sys
+import time
+import random
+import datetime
+
+from beancount.core import data
+from beancount.core.amount import Amount
+from beancount.core.number import D
+
+from coolbeans.rule import Rule
+from coolbeans.rules.conflicts import analyze
+
+
+def make_rules(count: int) -> list:
+    rules = []
+    for i in range(count):
+        rule = {
+            'match-narration': f"MERCHANT {i:05d}.*",
+            'set-posting-account': f"Expenses:Category{i % 50}",
+        }
+        if i % 10 == 0:
+            rule['match-account'] = f"Liabilities:Card{i % 3}"
+        rules.append(Rule(rule))
+    # A few rules without a literal prefix, checked against everything
+    for i in range(count // 100):
+        rules.append(Rule({'match-narration': f".*STORE {i:03d}", 'set-tags': 'store'}))
+    return rules
+
+
+def make_entries(count: int, rule_count: int, seed: int = 0) -> list:
+    rand = random.Random(seed)
+    entries = []
+    for i in range(count):
+        narration = f"MERCHANT {rand.randrange(rule_count * 2):05d} STORE {rand.randrange(200):03d}"
+        number = D(rand.randrange(100, 50000)) / 100
+        postings = [
+            data.Posting(f"Liabilities:Card{i % 3}", Amount(-number, "USD"), None, None, None, {}),
+            data.Posting("Expenses:Food", Amount(number, "USD"), None, None, None, {}),
+        ]
+        entries.append(data.Transaction(
+            {'filename': 'bench', 'lineno': i}, datetime.date(2020, 1, 1), "*",
+            None, narration, data.EMPTY_SET, data.EMPTY_SET, postings,
+        ))
+    return entries
+
+
+def main(rule_count: int = 5000, entry_count: int = 50000):
+    rules = make_rules(rule_count)
+    entries = make_entries(entry_count, rule_count)
+
+    start = time.perf_counter()
+    analysis, _ = analyze(rules, entries)
+    seconds = time.perf_counter() - start
+
+    print(f"{len(rules)} rules x {len(entries)} entries in {seconds:.2f}s")
+    print(f"{analysis.checks} checks instead of {len(rules) * len(entries)}")
+    print(f"{len(analysis.dead)} dead, {len(analysis.subsets)} subsets, {len(analysis.conflicts)} conflicts")
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:]))
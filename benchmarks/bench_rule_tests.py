@@ -0,0 +1,51 @@
+"""
+Time cool-match --test on a generated rules file with embedded test cases.
+
+    python benchmarks/bench_rule_tests.py [rule-count] [workers]
+
+"""
+import sys
+import time
+import pathlib
+import tempfile
+
+import yaml
+
+from coolbeans.rules.cache import RulesCache
+from coolbeans.rules.testing import run_tests
+
+
+def make_rules(count: int) -> list:
+    rules = []
+    for i in range(count):
+        rules.append({
+            'match-narration': [f"(?P<payee>MERCHANT {i:05d}).*", f"POS {i:05d} .*"],
+            'match-account': "Liabilities:CreditCard:.*",
+            'set-posting-account': f"Expenses:Category{i % 50}",
+            'test-narration': [f"MERCHANT {i:05d} STORE 12", f"POS {i:05d} SOMEWHERE"],
+            'test': {'narration': f"merchant {i:05d}", 'account': "Liabilities:CreditCard:Chase"},
+        })
+    return rules
+
+
+def main(count: int = 5000, workers: int = 1):
+    with tempfile.TemporaryDirectory() as tmp:
+        rules_file = pathlib.Path(tmp).joinpath("rules.yaml")
+        rules_file.write_text(yaml.safe_dump(make_rules(count)))
+        cache = RulesCache(pathlib.Path(tmp).joinpath("cache"))
+        cache.load(rules_file)
+
+        start = time.perf_counter()
+        rules = RulesCache(pathlib.Path(tmp).joinpath("cache")).load(rules_file)
+        loaded = time.perf_counter()
+        report = run_tests(rules, workers=workers)
+        done = time.perf_counter()
+
+    assert report.ok, report.failures[:5]
+    print(f"{count} rules, {report.cases} cases, {workers} workers")
+    print(f"load (cached)  {(loaded - start) * 1000:8.1f}ms")
+    print(f"run_tests      {(done - loaded) * 1000:8.1f}ms")
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:]))
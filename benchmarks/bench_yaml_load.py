@@ -0,0 +1,76 @@
+"""
+Load times for a generated 5,000 rule rules.yaml:
+
+* yaml.full_load, the pure Python loader we used to use
+* utils.yaml_load, libyaml when PyYAML was built with it
+* the JSON mirror kept by RulesCache
+* RulesCache.load, cold (no cache), from the mirror and from the pickle
+
+    python benchmarks/bench_yaml_load.py [rule-count]
+
+"""
+import sys
+import json
+import timeit
+import pathlib
+import tempfile
+
+import yaml
+
+from coolbeans.utils import yaml_load, YamlLoader
+from coolbeans.rules.cache import RulesCache
+
+
+def make_rules(count: int) -> list:
+    rules = []
+    for i in range(count):
+        rule = {
+            'match-narration': [f"(?P<payee>MERCHANT {i:05d}).*", f"POS {i:05d} .*"],
+            'match-account': "Liabilities:CreditCard:.*",
+            'set-posting-account': f"Expenses:Category{i % 50}",
+        }
+        if i % 3 == 0:
+            rule['set-transaction'] = {'tags': f"tag{i % 7}"}
+        rules.append(rule)
+    return rules
+
+
+def best(func, number=3) -> float:
+    return min(timeit.repeat(func, number=1, repeat=number))
+
+
+def main(count: int = 5000):
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = pathlib.Path(tmp)
+        rules_file = directory.joinpath("rules.yaml")
+        rules_file.write_text(yaml.safe_dump(make_rules(count)))
+        content = rules_file.read_bytes()
+
+        cache = RulesCache(directory.joinpath("cache"))
+        cache.load(rules_file)
+        mirror_file = cache.mirror_file(rules_file.absolute())
+        pickle_file = cache.cache_file(rules_file.absolute())
+        mirror = mirror_file.read_bytes()
+
+        assert yaml.full_load(content) == yaml_load(content) == json.loads(mirror)['rules']
+
+        def mirror_load():
+            pickle_file.unlink()
+            RulesCache(directory.joinpath("cache")).load(rules_file)
+
+        timings = [
+            ("yaml.full_load", best(lambda: yaml.full_load(content))),
+            (f"yaml_load ({YamlLoader.__name__})", best(lambda: yaml_load(content))),
+            ("json mirror", best(lambda: json.loads(mirror))),
+            ("RulesCache cold", best(lambda: RulesCache("off").load(rules_file))),
+            ("RulesCache mirror", best(mirror_load)),
+            ("RulesCache pickle", best(lambda: RulesCache(directory.joinpath("cache")).load(rules_file))),
+        ]
+
+    print(f"{count} rules, {len(content) / 1024:.0f}KiB of YAML")
+    for name, seconds in timings:
+        print(f"{name:28} {seconds * 1000:9.1f}ms")
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:]))
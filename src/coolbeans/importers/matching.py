@@ -0,0 +1,141 @@
+"""
+Apply the matcher rules once, at import time.
+
+The coolbeans.matcher plugin re-matches every pending (!) entry on every load
+of the ledger, for as long as the entry stays pending.  Matching the entries
+as they are extracted writes them out already categorized instead, and the
+plugin never has to look at them again.
+
+Wrap an importer in the bean-extract config:
+
+    from coolbeans.importers import ofx
+    from coolbeans.importers.matching import MatchingImporter
+
+    CONFIG = [
+        MatchingImporter(ofx.Importer(...), rules_files=['rules.yaml']),
+    ]
+
+or match the output of every importer with an extract hook:
+
+    from beancount.ingest.extract import find_duplicate_entries
+    from coolbeans.importers.matching import match_hook
+
+    HOOKS = [find_duplicate_entries, match_hook(['rules.yaml'])]
+
+"""
+import logging
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from beancount.core import data
+from beancount.ingest import importer
+
+from coolbeans.rule import Rule
+from coolbeans.rules.cache import RulesCache
+from coolbeans.rules.index import RuleIndex
+
+
+logger = logging.getLogger(__name__)
+
+
+def load_index(rules_files: Iterable[str] = (), rules: Iterable[Rule] = (), cache: RulesCache = None) -> RuleIndex:
+    """A RuleIndex over the Rules in rules_files, followed by rules"""
+    cache = cache or RulesCache()
+    all_rules = []
+    for file in rules_files:
+        all_rules.extend(cache.load(file))
+    all_rules.extend(rules)
+    return RuleIndex(all_rules)
+
+
+def match_entries(index: RuleIndex, entries: data.Entries, existing_entries: data.Entries = None) -> Tuple[data.Entries, int]:
+    """Match the pending entries, returns the entries and how many matched"""
+    if existing_entries:
+        index.set_accounts(e.account for e in existing_entries if isinstance(e, data.Open))
+
+    pending = [entry for entry in entries if getattr(entry, 'flag', None) == '!']
+    if not pending:
+        return list(entries), 0
+
+    results = iter(index.apply_many(pending))
+    matched = 0
+    output = []
+    for entry in entries:
+        if getattr(entry, 'flag', None) == '!':
+            entry, modified = next(results)
+            matched += modified
+        output.append(entry)
+    return output, matched
+
+
+class MatchingImporter(importer.ImporterProtocol):
+    """Wraps an importer, matching the entries its extract() returns"""
+
+    def __init__(
+            self,
+            wrapped: importer.ImporterProtocol,
+            rules_files: Iterable[str] = (),
+            rules: Iterable[Rule] = (),
+            cache: Optional[RulesCache] = None):
+        """
+        Args:
+            wrapped: the importer doing the actual work
+            rules_files: rules.yaml files, as for the rules-file setting
+            rules: any extra Rules, applied after those in rules_files
+            cache: the RulesCache to load rules_files with
+        """
+        self.wrapped = wrapped
+        self.rules_files = list(rules_files)
+        self.rules = list(rules)
+        self.cache = cache
+        self._index = None
+
+    @property
+    def index(self) -> RuleIndex:
+        # Loaded on first use, bean-identify never needs the rules
+        if self._index is None:
+            self._index = load_index(self.rules_files, self.rules, self.cache)
+        return self._index
+
+    def name(self):
+        return self.wrapped.name()
+
+    def identify(self, file):
+        return self.wrapped.identify(file)
+
+    def file_account(self, file):
+        return self.wrapped.file_account(file)
+
+    def file_name(self, file):
+        return self.wrapped.file_name(file)
+
+    def file_date(self, file):
+        return self.wrapped.file_date(file)
+
+    def extract(self, file, existing_entries=None):
+        entries = self.wrapped.extract(file, existing_entries=existing_entries) or []
+        entries, matched = match_entries(self.index, entries, existing_entries)
+        logger.info(f"{self.name()}: matched {matched} of {len(entries)} entries in {file.name}")
+        return entries
+
+    def __getattr__(self, name):
+        # Anything else, like FLAG or importer specific helpers
+        if name == 'wrapped':
+            raise AttributeError(name)
+        return getattr(self.wrapped, name)
+
+
+def match_hook(rules_files: Iterable[str] = (), rules: Iterable[Rule] = (), cache: RulesCache = None) -> Callable:
+    """An extract hook matching the output of every importer"""
+    index_holder: List[RuleIndex] = []
+
+    def hook(new_entries_list, existing_entries):
+        if not index_holder:
+            index_holder.append(load_index(rules_files, rules, cache))
+        result = []
+        for filename, entries in new_entries_list:
+            entries, matched = match_entries(index_holder[0], entries, existing_entries)
+            logger.info(f"Matched {matched} of {len(entries)} entries in {filename}")
+            result.append((filename, entries))
+        return result
+
+    return hook
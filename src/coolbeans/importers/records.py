@@ -22,12 +22,13 @@ from beancount.ingest import importer, cache
 
 # 3rdparty imports
 import slugify
-import yaml
 import json
 
 # Beancount imports
 from beancount.core import data
 
+from coolbeans.utils import yaml_load
+
 
 STRIP_SYMOLS = '₱$'
 DEFAULT_CURRENCY = "USD"
@@ -74,7 +75,7 @@ class Importer(importer.ImporterProtocol):
         fil = pathlib.Path(name)
         with fil.open("r") as stream:
             if fil.suffix == '.yaml':
-                content = yaml.full_load(stream)
+                content = yaml_load(stream)
             elif fil.suffix == '.json':
                 content = json.load(stream)
                 # Need to convert from_date and until_date
@@ -50,13 +50,14 @@ are often in short-hand.  The compiled rules are instances of Rule.
 # stdlib imports
 import pathlib
 import sys
+import time
 import re, yaml
 import pprint
 import logging
 import argparse
 import typing
 from typing import Dict, List, Iterator, Optional
-from dataclasses import dataclass, field
+from dataclasses import dataclass
 
 # Beancount Imports
 from beancount.core import data
@@ -67,13 +68,31 @@ from beancount.ingest.extract import print_extracted_entries
 from beancount.parser.printer import format_entry, print_entries, print_errors
 
 # Local imports
-from coolbeans.utils import safe_plugin
-from coolbeans.rule import Rule, MATCH_CHECK
+from coolbeans.utils import safe_plugin, get_setting, get_bool_setting
+from coolbeans.rule import Rule, EntryView
+from coolbeans.rules.index import RuleIndex, INDEX_CACHE
+from coolbeans.rules.cache import RulesCache
+from coolbeans.rules.analyzer import RegexAnalyzer
+from coolbeans.rules.generate import propose_rules
+from coolbeans.rules.stream import match_files, DEFAULT_CHUNK_SIZE
+from coolbeans.tools.output import render_entries, write_if_changed
+from coolbeans.rules.testing import run_tests
+from coolbeans.rules.conflicts import analyze
+from coolbeans.rules.incremental import INCREMENTAL_MATCHER
+from coolbeans.rules.registry import RULE_REGISTRY, meta_rule_dict
+from coolbeans.rules.stats import MatchStatistics, MatchProfiler
+from coolbeans.rules.parallel import ParallelMatcher, DEFAULT_THRESHOLD
+from coolbeans.rules.ordering import RuleHistory, adaptive_order, ORDERINGS
 
 
 logger = logging.getLogger(__name__)
 
 
+# Shared by every run, so the output-file is rendered the same way each time
+OUTPUT_DCONTEXT = DisplayContext()
+OUTPUT_DCONTEXT.set_commas(True)
+
+
 __plugins__ = (
     'apply_coolbean_settings_plugin',
     'match_directives_plugin',
@@ -103,12 +122,23 @@ apply_coolbean_settings_plugin = safe_plugin(apply_coolbean_settings)
 
 def match_directives(entries, options_map, *args):
     """Modify any entries that Match existing Rules"""
-    MATCH_CHECK.clear()
     rules = []
 
     # Make sure to have run the apply_coolbeans_settings_plugin
     settings = options_map['coolbeans']
 
+    cache = RulesCache(settings.get('rules-cache', [None])[0])
+
+    # Time every regex against our own narrations, a bad one can hang a reload
+    analyzer = None
+    budget_ms = get_setting('regex-budget-ms', settings)
+    if budget_ms is not None:
+        analyzer = RegexAnalyzer(
+            (getattr(entry, 'narration', None) for entry in entries),
+            budget=float(budget_ms) / 1000,
+            reject=get_bool_setting('regex-reject', settings),
+        )
+
     # Load a rules.yaml type file
     if 'rules-file' in settings:
         # We support multiple Rules Files
@@ -118,14 +148,54 @@ def match_directives(entries, options_map, *args):
                 logger.warning(f"Unable to find Rules File {file}")
                 continue
 
-            # Read the YAML file
-            with file.open("r") as stream:
-                new_rules = yaml.full_load(stream)
+            rules.extend(cache.load(file, analyzer=analyzer))
+
+    # Then the custom "matcher" "rule" directives and match-* meta templates
+    registry = RULE_REGISTRY
+    registry.set_file_rules(rules)
+    registry.update(entries, analyzer=analyzer)
+    rules = registry.rules
+
+    # Off by default, this costs a timer call per rule check
+    stats = None
+    near_miss_size = int(get_setting('match-near-misses', settings) or 0)
+    near_miss_rate = int(get_setting('match-near-miss-rate', settings) or 1)
+    profile_format = str(get_setting('match-profile', settings) or '').lower()
+    if profile_format in ('false', 'no', 'off'):
+        profile_format = ''
+    if profile_format:
+        stats = MatchProfiler(len(rules), near_miss_size=near_miss_size, near_miss_rate=near_miss_rate)
+    elif get_bool_setting('match-statistics', settings):
+        stats = MatchStatistics(len(rules), near_miss_size=near_miss_size, near_miss_rate=near_miss_rate)
+
+    version = cache.version() + ":" + registry.version()
+    if analyzer is not None and analyzer.rejected:
+        # Rejections depend on timing, so they're part of the rule set's version
+        version += ":" + ",".join(sorted(analyzer.rejected))
+
+    # The same rules as the last reload keep the same index
+    accounts = [entry.account for entry in entries if isinstance(entry, data.Open)]
+    index = INDEX_CACHE.get(version, rules, stats=stats, accounts=accounts)
+    logger.info(
+        f"Indexed {len(index)} rules, {len(index.always)} without a literal to look for, "
+        f"{len(index.account_shards)} sharded on {len(accounts)} accounts"
+    )
+
+    # Re-use the results of previous runs for unchanged entries.  Replayed
+    # results never reach stats, so statistics need every entry checked
+    matcher = index
+    if get_bool_setting('match-incremental', settings) and stats is None:
+        matcher = INCREMENTAL_MATCHER
+        matcher.begin(index, version)
+
+    # Big batches are spread over a process pool
+    workers = get_setting('match-workers', settings)
+    parallel = ParallelMatcher(
+        index,
+        workers=int(workers) if workers is not None else None,
+        threshold=int(get_setting('match-parallel-threshold', settings) or DEFAULT_THRESHOLD),
+    )
 
-            for rule in new_rules:
-                rules.append(
-                    Rule(rule)
-                )
     output_file = settings.get('output-file', ['matched.bean'])[0]
     output_file = pathlib.Path(output_file)
 
@@ -134,25 +204,19 @@ def match_directives(entries, options_map, *args):
     no_match_entries = []
     possible_rules = {}
 
+    # We're only interested in Pending Entries
+    pending = [entry for entry in entries if getattr(entry, 'flag', None) == '!']
+
     # Now, see what we can actually Match:
+    results = iter(matcher.apply_many(pending, match_many=parallel.match_many))
     for entry in entries:
 
-        # We're only interested in Pending Entries
         if getattr(entry, 'flag', None) != '!':
             # Pass through to new_entries
             new_entries.append(entry)
             continue
 
-        # Check against all the Rules:
-        modified = False
-        for rule in rules:
-            match_values = rule.check(entry)
-            if entry.narration.lower().startswith('airbnb') and match_values:
-                logger.info(f"{entry.narration.lower()}: {rule.match_requirements}: {match_values}")
-            if match_values is None:
-                continue
-            entry = rule.modify_entry(entry, match_values)
-            modified = True
+        entry, modified = next(results)
 
         # Always pass it to our output stream
         new_entries.append(entry)
@@ -162,159 +226,62 @@ def match_directives(entries, options_map, *args):
         else:
             no_match_entries.append(entry)
 
-    # We update the "suggestions" file
-
-    dcontext = DisplayContext()
-    dcontext.set_commas(True)
-    with output_file.open("w") as outstream:
+    if matcher is INCREMENTAL_MATCHER:
+        matcher.finish()
+
+    if stats is not None:
+        for line in stats.summary():
+            logger.info(line)
+        for near_miss in stats.near_misses or ():
+            logger.info(f"near miss: {near_miss}")
+        if profile_format:
+            stats.write_report(rules, output_file, format=profile_format)
+
+    # We update the "suggestions" file, if there's anything new in it
+    try:
+        content = render_entries(mod_entries, dcontext=OUTPUT_DCONTEXT)
+    except Exception:
+        logger.exception('while printing entries.  ')
         try:
-            print_entries(
-                mod_entries,
-                file=outstream,
-                dcontext=dcontext
+            for entry in mod_entries:
+                print_entries([entry], file=sys.stderr)
+        except Exception:
+            logger.exception(f"{entry}")
+            raise
+    else:
+        result = write_if_changed(output_file, content)
+        if result.changed:
+            logger.info(
+                f"cached: wrote {len(mod_entries)} entries to {output_file}, "
+                f"{result.added} added, {result.removed} removed"
             )
-            logger.info(f"cached: wrote {len(mod_entries)} entries to {output_file}")
-        except Exception as exc:
-            logger.exception('while printing entries.  ')
-            try:
-                for entry in mod_entries:
-                    print_entries([entry], file=sys.stderr)
-            except Exception:
-                logger.exception(f"{entry}")
-                raise
+        else:
+            logger.info(f"cached: {output_file} unchanged, {len(mod_entries)} entries")
 
     return new_entries, []
 
 
-@dataclass
-class PossibleRule:
-    count: int = field(default=0)
-    entry: Optional[data.Transaction] = field(default=None)
-    narration: str = field(default="")
-    match_account: str = field(default="")
-    rule_account: str = field(default="")
-    tags: str = field(default="")
-    links: str = field(default="")
-    payee: str = field(default="")
-    amounts: list = field(default_factory=list)
-
-
 def generate_new_rules(entries, options_map):
     """
     A Helper function to dig through a list of entries and generate a rules
     file. This is just a helper so you don't have to start with an empty file.
+
+    Pending entries are clustered on their narration with any IDs masked, see
+    rules.generate, and we propose one rule per cluster.
     """
 
     # Make sure to have run the apply_coolbeans_settings_plugin
     settings = options_map['coolbeans']
     rules_out_files: list = settings.get('gen-rules-file', [])
     if not rules_out_files:
-        return
+        return entries, []
     rules_out = pathlib.Path(rules_out_files[0])
 
-    # Generate a list of the good, bad and the ugly
-    good_entries: List[data.Transaction] = []
-    bad_entries: List[data.Transaction] = []
-
-    good_by_name: Dict[str, data.Transaction] = {}
-    bad_by_name: Dict[str, PossibleRule] = {}
-
-    for entry in entries:
-        if not isinstance(entry, data.Transaction):
-            continue
-        # The Good
-        if entry.flag == "*" and entry.narration:
-            good_entries.append(entry)
-            n = entry.narration.lower()
-            if n not in good_by_name:
-                good_by_name[n] = entry
-
-        # The Bad
-        elif entry.flag == "!" and entry.narration:
-            bad_entries.append(entry)
-            n = entry.narration.lower()
-            if n in bad_by_name:
-                possible = bad_by_name[n]
-                possible.count += 1
-            else:
-                possible = PossibleRule(
-                    entry=entry,
-                    narration=n,
-                )
-                bad_by_name[n] = possible
-
-            for posting in entry.postings:
-                amt = float(abs(posting.units.number))
-                if amt not in possible.amounts:
-                    possible.amounts += [amt]
-
-
-    # Find Candidates for Rules (our bad entries)
-    new_rules = []
-    for n, possible in bad_by_name.items():
-        # Need to list the matching accounts etc.
-        account = ""
-        for posting in possible.entry.postings:
-
-            # Check for the amounts for our new-rules
-            amt = float(abs(posting.units.number))
-            if amt not in possible.amounts:
-                possible.amounts += [amt]
-
-            if posting.flag == "*":
-                account = posting.account
-        rule = {
-            'match-narration': n,
-            'match-account': account,
-            'comment': {'count': possible.count, 'amounts':possible.amounts}
-        }
-        new_rules.append(rule)
-        new_rules.sort(key=lambda item: (item['comment']['count'], item['match-narration']))
-
-    #for entry in bad_entries:
-    #    # Keep a count of matches for this entry:
-    #    narration = entry.narration.lower().strip()
-
-    #    if narration not in good_by_name:
-    #        # Best Posting Account
-    #        account = ""
-    #        for posting in entry.postings:
-    #            if posting.flag == "*":
-    #                account = posting.account
-
-    #        narrations[narration] = dict(
-    #            count=0,
-    #            value=entry.narration,
-    #            account=account
-    #        )
-
-    ## Now generate rules for interesting transactions:
-    #rules = []
-    #for narration, details in narrations.items():
-    #    # Perhaps make this a configurable
-    #    if details['count'] <= 1:
-    #        continue
-    #    possible_entry = entry_by_name.get(details['value'], None)
-    #    new_rule = {
-    #        'match-narration': narration,
-    #        'match-account': details['account'],
-    #        'test': [details['value']]
-    #    }
-    #    if possible_entry:
-    #        if possible_entry:
-    #            target_account = None
-    #            for posting in possible_entry.postings:
-    #                if posting.account != details['account']:
-    #                    target_account = posting.account
-    #            if target_account:
-    #                new_rule['set-posting-account'] = target_account
-    #            if possible_entry.payee:
-    #                new_rule['set-payee'] = possible_entry.payee
-    #            if possible_entry.tags:
-    #                new_rule['set-transaction-tags'] = repr(possible_entry.tags)
+    new_rules = propose_rules(entries)
 
     with rules_out.open("w") as stream:
         yaml.dump(new_rules, stream)
+    logger.info(f"Proposed {len(new_rules)} rules in {rules_out}")
 
     return entries, []
 
@@ -332,21 +299,9 @@ def generate_new_rules_file(entries, options_map):
 
 def rule_from_meta(entry: data.Transaction) -> Rule:
     """We use the Entry as a template to the Rule
-    Copy the Narration, Payee, Tags, Expense Account etc.
+    Copy the Payee, Tag, Account and any match-/set- meta, see rules.registry
     """
-    rs = {}
-    if entry.tags:
-        rs['set-tags'] = entry.tags
-    if entry.payee:
-        rs['set-payee'] = entry.payee
-
-    for posting in entry.postings:
-        if posting.account.startswith('Expenses'):
-            rs['set-posting-account'] = posting.account
-
-    for k, v in entry.meta.items():
-        if k.startswith('match-') or k.startswith('set-'):
-            rs[k] = v
+    rs = meta_rule_dict(entry)
     r = Rule(rs)
 
     logger.info(f"Created a Fancy Rule: {rs} -> {repr(r)}")
@@ -364,8 +319,19 @@ class Matcher:
     """Most of this code is dead."""
     rules: List[Rule] = None
 
-    def __init__(self, rules=None):
+    def __init__(self, rules=None, ordering: str = 'file', history_file=None):
+        """
+        Args:
+            rules: list of rule dicts
+            ordering: 'file' tries the rules in order.  'adaptive' tries
+                commuting rules by descending hit rate, see rules.ordering
+            history_file: JSON file to keep the hit rates in between runs
+        """
+        assert ordering in ORDERINGS, f"Unknown ordering {ordering}. Try {ORDERINGS}"
         self.rules = []
+        self.ordering = ordering
+        self.history = RuleHistory(history_file) if ordering == 'adaptive' else None
+        self._ordered = None
 
         if rules:
             self.add_rules(rules)
@@ -373,6 +339,23 @@ class Matcher:
     def add_rules(self, rules: List[dict]):
         for rule_dict in rules:
             self.rules.append(Rule(rule_dict))
+        self._ordered = None
+
+    def ordered_rules(self) -> List[typing.Tuple[Rule, Optional[str]]]:
+        """The rules, in the order match() tries them, with their signature"""
+        if self._ordered is None:
+            if self.history is None:
+                self._ordered = [(rule, None) for rule in self.rules]
+            else:
+                self._ordered = [
+                    (rule, rule.signature) for rule in adaptive_order(self.rules, self.history)
+                ]
+        return self._ordered
+
+    def save_history(self):
+        """Persist the hit rates, the next Matcher will use the new order"""
+        if self.history is not None:
+            self.history.save()
 
     def get_entry_values(self, entry, attribute) -> List[str]:
         """Give an beancount entry, fish for this attribute.  Return a list
@@ -391,8 +374,11 @@ class Matcher:
 
     def match(self, entry: Directive) -> Optional[Match]:
         """Accepts a BeanCount Entry and tries to find a Matching Rule."""
-        for rule in self.rules:
-            match = rule.check(entry)
+        view = EntryView(entry)
+        for rule, signature in self.ordered_rules():
+            match = rule.check(entry, view=view)
+            if signature is not None:
+                self.history.record(signature, match is not None)
             if match is not None:
                 return Match(
                     entry=entry,
@@ -485,6 +471,12 @@ class Matcher:
 
 def add_arguments(parser):
     """Possibly hook entry point bean CLI.  But we call directly for now."""
+    parser.add_argument(
+        'staged',
+        nargs='*',
+        metavar='STAGED_FILE',
+        help='Beancount files to match, "-" for stdin.  Read a chunk at a time.'
+    )
     parser.add_argument(
         '-e', '-f', '--existing', '--previous',
         metavar='BEANCOUNT_FILE',
@@ -492,38 +484,173 @@ def add_arguments(parser):
         help=('Beancount file or existing entries for de-duplication '
               '(optional)')
     )
-
-    #  parser.add_argument(
-    #      '-r', '--rules',
-    #      action='store',
-    #      metavar='RULES_FILENAME',
-    #      help=(
-    #          'Rules specification file. '
-    #          'This is a YAML file with Match Rules '
-    #      )
-    #  )
+    parser.add_argument(
+        '-r', '--rules',
+        action='append',
+        default=[],
+        metavar='RULES_FILENAME',
+        help=(
+            'Rules specification file. '
+            'This is a YAML file with Match Rules '
+        )
+    )
+    parser.add_argument(
+        '-o', '--output',
+        metavar='OUTPUT_FILE',
+        default=None,
+        help='Where to write the matched entries, stdout by default'
+    )
+    parser.add_argument(
+        '--chunk-size',
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help='Number of entries to parse and match at a time'
+    )
+    parser.add_argument(
+        '--rules-cache',
+        default=None,
+        metavar='DIRECTORY',
+        help='Where to cache the compiled rules, "off" to disable'
+    )
+    parser.add_argument(
+        '--test',
+        action='store_true',
+        help='Run the test cases embedded in the --rules files and exit'
+    )
+    parser.add_argument(
+        '--analyze',
+        action='store_true',
+        help=('Report dead, shadowed and conflicting --rules, using the '
+              'transactions in --existing and any staged files')
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Number of processes for --test'
+    )
+    parser.add_argument(
+        '-v', '--verbose',
+        action='store_true',
+        help='Debug logging'
+    )
     return parser
 
 
+def test_rules_files(rules_files: List[str], rules_cache=None, workers: int = 1) -> bool:
+    """Run the test cases in rules_files, printing a report.  True if all pass."""
+    cache = RulesCache(rules_cache)
+    rules = []
+    labels = []
+    for file_path in rules_files:
+        file_rules = cache.load(file_path)
+        rules.extend(file_rules)
+        labels.extend(f"{file_path} rule {i}" for i in range(len(file_rules)))
+
+    start = time.perf_counter()
+    report = run_tests(rules, workers=workers)
+    elapsed = time.perf_counter() - start
+
+    for failure in report.failures:
+        print(f"FAIL {labels[failure.position]} case {failure.case}: "
+              f"{failure.key} {failure.value!r}: {failure.reason}")
+    for position, seconds in report.slowest(5):
+        logger.info(f"{labels[position]}: {seconds * 1000:.3f}ms")
+    print(f"{report.cases} cases in {len(rules)} rules, {len(report.failures)} failures, "
+          f"{elapsed * 1000:.1f}ms")
+    return report.ok
+
+
+def analyze_rules_files(rules_files: List[str], existing: Optional[str], staged: List[str], rules_cache=None):
+    """Print the dead, subset and conflicting rules over a corpus of entries"""
+    cache = RulesCache(rules_cache)
+    rules = []
+    labels = []
+    for file_path in rules_files:
+        file_rules = cache.load(file_path)
+        rules.extend(file_rules)
+        labels.extend(f"{file_path} rule {i}" for i in range(len(file_rules)))
+
+    from beancount import loader
+    from beancount.parser import parser
+
+    entries = []
+    if existing:
+        entries, errors, _ = loader.load_file(existing)
+        if errors:
+            print_errors(errors)
+    for file_path in staged:
+        # No plugins, these are only staged
+        staged_entries, errors, _ = parser.parse_file(file_path)
+        if errors:
+            print_errors(errors)
+        entries.extend(staged_entries)
+
+    accounts = [entry.account for entry in entries if isinstance(entry, data.Open)]
+    analysis, transactions = analyze(rules, entries, accounts=accounts)
+
+    for position in analysis.dead:
+        print(f"DEAD {labels[position]}")
+    for subset in analysis.subsets:
+        kind = "SHADOWED" if subset.shadowed else "SUBSET"
+        print(f"{kind} {labels[subset.position]} by {labels[subset.superset]}")
+    for conflict in analysis.conflicts:
+        entry = transactions[conflict.entry]
+        print(f"CONFLICT {entry.meta.get('filename')}:{entry.meta.get('lineno')} {entry.narration!r}")
+        for account, positions in conflict.accounts.items():
+            print(f"  {account}: {', '.join(labels[p] for p in positions)}")
+    print(
+        f"{len(rules)} rules, {analysis.entries} entries, {analysis.checks} checks: "
+        f"{len(analysis.dead)} dead, {len(analysis.subsets)} subsets, {len(analysis.conflicts)} conflicts"
+    )
+    return analysis
+
+
 def main():
-    # We don't do much other the validate the file
-    # The File needs to load the plugin coolbean.matcher
     parser = argparse.ArgumentParser()
     add_arguments(parser)
     args = parser.parse_args()
 
     logging.basicConfig(
         stream=sys.stderr,
-        level=logging.DEBUG
+        level=logging.DEBUG if args.verbose else logging.INFO
     )
 
-    from beancount import loader
+    if args.test:
+        sys.exit(0 if test_rules_files(args.rules, args.rules_cache, args.workers) else 1)
+
+    if args.analyze:
+        analyze_rules_files(args.rules, args.existing, args.staged, args.rules_cache)
+        return
+
+    if not args.staged:
+        # We don't do much other the validate the file
+        # The File needs to load the plugin coolbean.matcher
+        if not args.existing:
+            parser.error("Nothing to do, give a staged file or --existing")
 
-    # Load the bean_file
-    entries, errors, options_map = loader.load_file(args.existing)
+        from beancount import loader
 
-    if errors:
-        print_errors(errors)
+        # Load the bean_file
+        entries, errors, options_map = loader.load_file(args.existing)
+
+        if errors:
+            print_errors(errors)
+        return
+
+    cache = RulesCache(args.rules_cache)
+    rules = []
+    for file_path in args.rules:
+        rules.extend(cache.load(file_path))
+    index = RuleIndex(rules)
+
+    output = open(args.output, "w") if args.output else sys.stdout
+    try:
+        count, matched, errors = match_files(args.staged, index, output, chunk_size=args.chunk_size)
+    finally:
+        if args.output:
+            output.close()
+    logger.info(f"Matched {matched} of {count} entries with {len(rules)} rules, {errors} errors")
 
 
 if __name__ == "__main__":
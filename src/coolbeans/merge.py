@@ -31,6 +31,7 @@ from beancount.core.display_context import DisplayContext
 # local library
 from coolbeans.utils import logging_config
 from coolbeans.apps import BEAN_FILE_ENV
+from coolbeans.tools.fingerprint import entry_dedupe_key
 
 # Logger
 logger = logging.getLogger(__name__)
@@ -146,8 +147,8 @@ class BeanOrganizer:
         # Loaded Transactions could have a match-key, to help de-duplicate
         match_key = entry.meta.get('match-key', None)
         if not match_key:
-            # Roll our own match-key for some things
-            match_key = printer.format_entry(entry)
+            # Roll our own match-key from the content of the entry
+            match_key = entry_dedupe_key(entry)
 
         if isinstance(entry, data.Transaction) and entry.postings:
             # Sort on the first account
@@ -192,8 +193,9 @@ class BeanOrganizer:
             # Make sure the existing_entry isn't "booked" with a '*'
             if existing_entry.flag == entry.flag or existing_entry.flag == '*':
                 return
-            else:
-                # We need to replace the existing entry!
+            elif entry.meta.get('match-key') or existing_entry.meta.get('filename') != entry.meta.get('filename'):
+                # We need to replace the existing entry!  Our own key leaves the flag out though,
+                # so within one file a '!' and a '*' copy of an entry are both kept
                 remove_list.append(existing_entry)
 
         for item in remove_list:
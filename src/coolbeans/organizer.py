@@ -9,6 +9,9 @@ Example:
 
         meta['global-sort'], DATE, meta['sort'], [Balance, Transaction, Note], Primary Account
 
+Each source file is sorted on its own, the existing year file is already in
+order, and the sorted sources are merged straight into the output file.
+
 This is still a work in progress as the workflow is evolving.
 """
 
@@ -20,8 +23,10 @@ import sys
 import pathlib
 import datetime
 import re
+import heapq
 import dateparser
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 
 # beancount imports
 from beancount.core import data, account
@@ -31,15 +36,24 @@ from beancount.parser import printer
 # local library
 from coolbeans.utils import logging_config
 from coolbeans.apps import BEAN_FILE_ENV
+from coolbeans.tools.fingerprint import entry_dedupe_key
+from coolbeans.tools.store import EntryStore
+from coolbeans.tools.output import stream_entries
 
 
 # Logger
 logger = logging.getLogger(__name__)
 
 
+def load_entries(file_name) -> typing.Tuple[list, list]:
+    """Load a file in a worker process, returns (entries, errors)"""
+    entries, errors, _ = load_file(file_name)
+    return entries, errors
+
+
 class BeanOrganizer:
 
-    entries: list = None
+    entries: EntryStore = None
     duplicates: dict = None
     year: int = None
     sort_method: str
@@ -57,6 +71,7 @@ class BeanOrganizer:
             do_filter: bool = True,
             between: typing.Tuple[datetime.date, datetime.date] = None,
             filter_account: str = None,
+            workers: int = None,
 
     ):
         """
@@ -69,39 +84,41 @@ class BeanOrganizer:
             filter_account:
             sort_method:
             do_filter:
+            workers: processes to load the input_files with, one at a time by default
         """
         from_date, through_date = between
         self.duplicates = {}
-        self.entries = []
+        self.entries = EntryStore()
         self.merge_file = output
 
         # These are the same thing?
         self.sort_method = sort_method
         self.split_type = split_type
 
-        # First add the existing core file:
         self.bean_file = pathlib.Path(bean_file).absolute()
-        self.add_file(bean_file)
+        source_files = [str(pathlib.Path(file_name).absolute()) for file_name in input_files]
+
+        # Parse every file at once, but add them in order so de-duplication doesn't depend on timing
+        loaded = self.load_files(bean_file, source_files, workers=workers)
 
-        source_files = []
+        # First add the existing core file:
+        self.add_entries(bean_file, loaded[0])
 
         # Now Merge the Input Files
-        for file_name in input_files:
-            file_path = str(pathlib.Path(file_name).absolute())
-            source_files.append(file_path)
+        for file_name, entries in zip(input_files, loaded[1:]):
             entries_count = len(self.entries)
-            self.add_file(file_path)
+            self.add_entries(file_name, entries)
             print(f"Loaded {len(self.entries)-entries_count} new from {file_name}")
 
         if do_filter:
             # In place Filter
-            self.entries = self.filter_entries(
+            self.entries = EntryStore(self.filter_entries(
                 self.entries,
                 source_files + [str(self.merge_file.absolute())],
                 from_date,
                 through_date,
                 filter_account=filter_account
-            )
+            ))
 
     def filter_entries(self, entries, valid_files, date_start, date_end, filter_account=None):
         logger.debug(
@@ -137,9 +154,37 @@ class BeanOrganizer:
 
         return entries
 
+    def load_files(self, bean_file, input_files: list, workers: int = None) -> typing.List[list]:
+        """The entries of bean_file, then of each input file, in order
+
+        With more than one worker the input files are parsed in a process pool
+        while we parse bean_file here.  That's opt-in: shipping the entries
+        back from the workers costs more than parsing them did in every
+        benchmark so far, see benchmarks/bench_organizer_load.py.
+        """
+        workers = workers or 1
+        if workers <= 1 or not input_files:
+            return [
+                self.load_beanfile(file_name, stop_on_error=False)
+                for file_name in [bean_file] + list(input_files)
+            ]
+
+        with ProcessPoolExecutor(max_workers=min(workers, len(input_files))) as pool:
+            futures = [pool.submit(load_entries, file_name) for file_name in input_files]
+            loaded = [self.load_beanfile(bean_file, stop_on_error=False)]
+            for future in futures:
+                entries, errors = future.result()
+                if errors:
+                    printer.print_errors(errors, sys.stderr)
+                loaded.append(entries)
+        return loaded
+
     def add_file(self, file_name):
         """Add a new file to the existing entries"""
-        entries = self.load_beanfile(file_name, stop_on_error=False)
+        self.add_entries(file_name, self.load_beanfile(file_name, stop_on_error=False))
+
+    def add_entries(self, file_name, entries: list):
+        """Add the entries loaded from file_name to the existing entries"""
         logger.debug(f"Found {len(entries)} potential entries in {file_name}")
         for entry in entries:
             self.safe_add_entry(entry)
@@ -159,8 +204,8 @@ class BeanOrganizer:
         # Loaded Transactions could have a match-key, to help de-duplicate
         match_key = entry.meta.get('match-key', None)
         if not match_key:
-            # Roll our own match-key for some things. Sha?
-            match_key = printer.format_entry(entry)
+            # Roll our own match-key from the content of the entry
+            match_key = entry_dedupe_key(entry)
 
         # Tag each entry with an "Account" Based on attribute, or best guess on Postings
         if isinstance(entry, data.Transaction) and entry.postings:
@@ -170,14 +215,13 @@ class BeanOrganizer:
 
         entry.meta['_account'] = self.guess_account(entry)
 
-        # This will posibly delete entries from our source file.
-        self.remove_exising_duplicate(entry)
+        # This will posibly replace entries from our source file.
+        self.remove_exising_duplicate(entry, match_key)
 
-        # Add back the good entry at the end
-        self.entries.append(entry)
-        self.entries.append(entry)
+        # Add the good entry at the end, unless it took the place of an existing one
+        self.entries.add(entry)
 
-    def remove_exising_duplicate(self, entry: data.Directive):
+    def remove_exising_duplicate(self, entry: data.Directive, match_key=None):
         """
         In some cases the incoming "source" file contains entires that have been "matched" with a flag of '*'
         while the existing entry in the file has a '!' status.  In that case, we want to swap out the entries
@@ -187,13 +231,15 @@ class BeanOrganizer:
 
         Args:
             entry: the new entry to possibly swap in
+            match_key: the key to de-duplicate on, the entry's match-key by default
 
         Returns:
-            None, mutates self.entries instead.
+            None, the new entry takes the place of the existing one in self.entries.
         """
 
         # Use just match-key for now, this matching business is a whole different issue:
-        match_key = entry.meta.get('match-key', None)
+        if match_key is None:
+            match_key = entry.meta.get('match-key', None)
         found_match_key = False
         existing_entry = None
 
@@ -229,79 +275,100 @@ class BeanOrganizer:
             # Make sure the existing_entry isn't "booked" with a '*'
             if existing_entry.flag == entry.flag or existing_entry.flag == '*':
                 return
-            else:
-                # We need to replace the existing entry!
+            elif entry.meta.get('match-key') or existing_entry.meta.get('filename') != entry.meta.get('filename'):
+                # We need to replace the existing entry!  Our own key leaves the flag out though,
+                # so within one file a '!' and a '*' copy of an entry are both kept
                 remove_list.append(existing_entry)
 
-        # Once we have a list of items that are "Matched" and went from '!' -> '*', delete the '!' ones:
+        # Once we have a list of items that are "Matched" and went from '!' -> '*', swap out the '!' ones:
         for item in remove_list:
-            if item in self.entries:
-                self.entries.remove(item)
-
-    def sort_key(self, entry):
-        account_sort_key = ()
-        amount_sort_key = 0
-        text_sort_key = ""
-        method = self.sort_method
-
-        account_sort_key = tuple(account.split(entry.meta['_account']))
-        # Not sure in what cases this is needed, but just incase
-        if isinstance(entry, data.TxnPosting):
-            entry = entry.txn
+            self.entries.replace(item, entry)
 
-        if isinstance(entry, data.Transaction) and entry.postings:
-            # Sort on the first account
-            for posting in entry.postings:
-                amount_sort_key = -abs(posting.price.number) if posting.price else 0
-                break
-
-            text_sort_key = entry.narration
+    def ranked_sort_key(
+            self,
+            entries,
+            position: typing.Callable = None) -> typing.Callable:
+        """The sort key for entries, by sort_method, with the accounts ranked up front
 
-        if isinstance(entry, data.Note):
-            account_sort_key = tuple(account.split(entry.account))
-            text_sort_key = entry.comment
+        Orders on meta['global-sort'], then the date and the account (which
+        first depends on the method), meta['sort'], [Balance, Transaction, Note],
+        the price and the text.  Each account of entries is split once, in
+        this call, and the keys compare an int rank instead of the split tuple.
 
-        if entry.meta.get('filename') == self.merge_file:
-            # If we're dealing with a transaction originating from our existing file, respect the position
-            line_number = entry.meta.get('lineno', 0)
-        else:
-            # Let's put it at the end of the day?
-            line_number = 99999
+        position(entry) is the last thing compared, to break ties.
+        """
+        method = self.sort_method
+        if method not in ('date', 'account'):
+            raise ValueError(f"Unknown sort method {method}. Try date or account")
 
-        if method == 'date':
+        accounts = set()
+        for entry in entries:
+            accounts.add(entry.account if type(entry) is data.Note else entry.meta['_account'])
+        ranks = {name: rank for rank, name in enumerate(sorted(accounts, key=account.split))}
+
+        sort_order = data.SORT_ORDER
+        Transaction, Note, TxnPosting = data.Transaction, data.Note, data.TxnPosting
+        by_date = method == 'date'
+
+        def sort_key(entry):
+            tiebreak = position(entry) if position is not None else 0
+            if type(entry) is TxnPosting:
+                entry = entry.txn
+            entry_type = type(entry)
+            meta = entry.meta
+            amount_sort_key = 0
+            text_sort_key = ""
+            if entry_type is Note:
+                account_rank = ranks[entry.account]
+                text_sort_key = entry.comment
+            else:
+                account_rank = ranks[meta['_account']]
+                if entry_type is Transaction and entry.postings:
+                    price = entry.postings[0].price
+                    if price:
+                        amount_sort_key = -abs(price.number)
+                    text_sort_key = entry.narration
+
+            if by_date:
+                return (
+                    meta.get('global-sort', 100), entry.date, meta.get('sort', 100),
+                    sort_order.get(entry_type, 0), account_rank, amount_sort_key, text_sort_key,
+                    tiebreak,
+                )
             return (
-                entry.meta.get('global-sort', 100),
-                entry.date,
-                entry.meta.get('sort', 100),
-                #  entry.meta.get('lineno', 0) if , # Not sure how highly to prioritize existing position.
-                data.SORT_ORDER.get(type(entry), 0),
-                account_sort_key,
-                amount_sort_key,
-                text_sort_key,
-            )
-        elif method == 'account':
-            sort_key = (
-                entry.meta.get('global-sort', 100),
-                account_sort_key,
-                entry.date,
-                entry.meta.get('sort', 100),
-                #           entry.meta.get('lineno', 0) if , # Not sure how highly to prioritize existing position.
-                data.SORT_ORDER.get(type(entry), 0),
-                amount_sort_key,
-                text_sort_key,
+                meta.get('global-sort', 100), account_rank, entry.date, meta.get('sort', 100),
+                sort_order.get(entry_type, 0), amount_sort_key, text_sort_key,
+                tiebreak,
             )
-            return sort_key
-        else:
-            raise ValueError(f"Unknown sort method {method}. Try date or account")
+
+        return sort_key
+
+    def source_entries(self) -> typing.List[list]:
+        """self.entries grouped by the file they came from, in insertion order"""
+        sources = {}
+        for entry in self.entries:
+            sources.setdefault(entry.meta.get('filename'), []).append(entry)
+        return list(sources.values())
 
     def sorted_entries(self, sort_key=None):
+        """Sort each source on its own, then k-way merge them
+
+        The sources are mostly in order already, which is close to a linear
+        pass for sort().  The default key ends with the position in
+        self.entries, so the order is the same as one stable sort of
+        self.entries, even for an entry that took the place of one from
+        another file.
+        """
         if not sort_key:
-            sort_key = self.sort_key
+            sort_key = self.ranked_sort_key(
+                self.entries, position=self.entries.position)
 
-        self.entries.sort(key=sort_key)
+        runs = self.source_entries()
+        for run in runs:
+            run.sort(key=sort_key)
 
-        for entry in self.entries:
-            yield entry
+        # Only the head of each run is decorated while merging
+        yield from heapq.merge(*runs, key=sort_key)
 
     def fold_injector(self, outstream):
 
@@ -344,14 +411,15 @@ class BeanOrganizer:
     def guess_account(self, entry: data.Directive) -> str:
         # Tag each entry with an "Account" Based on attribute, or best guess on Postings
         if isinstance(entry, data.Transaction) and entry.postings:
-            logger.debug(f"Guessing account for {entry} in {entry.meta['filename']}")
+            # Lazy, formatting every entry costs more than the rest of the merge
+            logger.debug("Guessing account for %s in %s", entry, entry.meta.get('filename'))
             # Sort on the first account
             for posting in entry.postings:
                 account_parts =  account.split(posting.account)
                 if account_parts[0] in ("Assets", "Liabilities"):
                     return posting.account
             else:
-                return entry.postings[0]
+                return entry.postings[0].account
         elif hasattr(entry, 'account'):
             return entry.account
         else:
@@ -386,8 +454,8 @@ class BeanOrganizer:
         else:
             # We will want to roll our own
             with self.merge_file.open("w") as outstream:
-                printer.print_entries(
-                    list(self.sorted_entries()),
+                stream_entries(
+                    self.sorted_entries(),
                     file=self.fold_injector(outstream),
                     dcontext=context,
                 )
@@ -434,6 +502,12 @@ def main():
         choices=('date', 'account'),
         help="Split outbound files on 'year' or 'account'",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of processes to load the input files with, one by default"
+    )
     parser.add_argument(
         "input_files",
         nargs='*',
@@ -466,7 +540,8 @@ def main():
         split_type=args.split_type,
         do_filter=True,
         filter_account=args.account,
-        sort_method=args.split_type
+        sort_method=args.split_type,
+        workers=args.workers,
     )
 
     # Now we can print the new File
@@ -17,6 +17,22 @@ To check a Rule against an entry:
 
 match is an instance of Match, which would contain any needed meta-data
 
+Besides regular expressions, a Rule can filter on the amount of the
+eligible posting and on the date.  These are checked before any regex:
+
+    - match-narration: UBER .*
+      match-amount:
+        min: 5
+        max: 80
+        currency: USD
+      match-date:
+        weekday: [sat, sun]
+
+match-amount takes min, max, exact (compared to the absolute number) and
+currency.  match-date takes min, max (inclusive dates), weekday and day (of
+the month).  Each takes a single value or a list, and a list of such dicts
+matches if any of them does.
+
 To Transform an entry based on this Rule:
 
     new_entry = rule.apply(entry)
@@ -28,16 +44,22 @@ Open questions:
 
 """
 from __future__ import annotations
-import yaml
 import re
+import copy
+import time
+import datetime
+import hashlib
 import pprint
 import logging
+from decimal import Decimal
 from dataclasses import dataclass, field
-from typing import List, Optional, Set, Iterator
+from typing import ClassVar, List, Optional, Set, Iterator
 
 from beancount.core import data
 from beancount.parser import printer
 
+from coolbeans.utils import yaml_load
+
 
 logger = logging.getLogger(__name__)
 
@@ -60,6 +82,25 @@ SUB_KEY_RE = list(map(re.compile, [
 VALID_COMMANDS = ('match', 'set', 'test')
 
 
+# Keys on a rule that aren't match/set/test directives
+#   commutes: the Rule's actions don't depend on the order rules are tried
+#             in, so it can be re-ordered (see Matcher ordering='adaptive')
+RULE_OPTIONS = ('match-key', 'commutes')
+
+# Imported entries can carry extra keys match-key-1 .. match-key-N
+MATCH_KEY_RE = re.compile(r"^match-key(-\d+)?$")
+
+
+def is_rule_option(key: str) -> bool:
+    return key in RULE_OPTIONS or MATCH_KEY_RE.match(key) is not None
+
+
+# Match parameters that take typed predicates instead of regular expressions
+PREDICATE_PARAMETERS = ('amount', 'date')
+
+WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+
 TRANSACTION_PARAMETERS = (
     'narration',
     'tags',
@@ -92,6 +133,94 @@ def match_any_re(regex_list, value):
             return match.groupdict()
 
 
+def eligible_posting(entry):
+    """The posting that posting-level MatchRules look at, or None"""
+    for posting in entry.postings:
+
+        # Use the first posting with a '*' flag
+        if posting.flag != '!' or posting.flag == '*':
+            return posting
+    return None
+
+
+def field_value(obj, parameter: str, meta_key: Optional[str] = None):
+    # Now we don't care if it's a posting or object
+    if parameter == 'meta' and meta_key in obj.meta:
+        return obj.meta[meta_key]
+
+    return str(getattr(obj, parameter))
+
+
+def extract_field(entry, directive: str, parameter: str, meta_key: Optional[str] = None):
+    """Get the value a MatchRule looks at on an entry.
+
+    Returns None if the entry has no suitable posting."""
+    obj = entry
+    if directive == 'posting':
+        obj = eligible_posting(entry)
+        if obj is None:
+            return None
+
+    return field_value(obj, parameter, meta_key)
+
+
+def fold(value: str) -> str:
+    """Case-fold a value for comparison with lower case literals.
+
+    re.I lets 'i' match the Turkish dotted and dot-less i, which casefold()
+    leaves alone, so we map those back onto a plain 'i'.
+    """
+    return value.casefold().replace('i\u0307', 'i').replace('\u0131', 'i')
+
+
+_MISSING = object()
+
+
+class EntryView:
+    """The values of an entry that MatchRules look at, each extracted once.
+
+    Every Rule checking the same entry shares one view, so the narration,
+    payee, eligible posting's account, tags, links and meta are only turned
+    into strings (and case-folded) once per entry instead of once per Rule.
+    """
+    __slots__ = ('entry', 'values', 'folded', '_posting')
+
+    def __init__(self, entry):
+        self.entry = entry
+        self.values = {}
+        self.folded = {}
+        self._posting = _MISSING
+
+    @property
+    def posting(self):
+        if self._posting is _MISSING:
+            self._posting = eligible_posting(self.entry)
+        return self._posting
+
+    def get(self, directive: str, parameter: str, meta_key: Optional[str] = None):
+        """Same as extract_field(entry, ...)"""
+        key = (directive, parameter, meta_key)
+        value = self.values.get(key, _MISSING)
+        if value is _MISSING:
+            obj = self.entry
+            if directive == 'posting':
+                obj = self.posting
+            value = None if obj is None else field_value(obj, parameter, meta_key)
+            self.values[key] = value
+        return value
+
+    def get_folded(self, directive: str, parameter: str, meta_key: Optional[str] = None):
+        """The case-folded value, or the raw value if it isn't a string"""
+        key = (directive, parameter, meta_key)
+        value = self.folded.get(key, _MISSING)
+        if value is _MISSING:
+            value = self.get(directive, parameter, meta_key)
+            if isinstance(value, str):
+                value = fold(value)
+            self.folded[key] = value
+        return value
+
+
 @dataclass
 class DirectiveAttribute:
     """A Single Attribute on a Directive"""
@@ -149,51 +278,192 @@ class MatchRule(DirectiveAttribute):
         return result
 
     def extract_value(self, entry):
-        # Get the value on an entry
-        obj = entry
-        if self.directive == 'posting':
-            # Find the first posting:
-            for posting in entry.postings:
-
-                # Use the first posting with a '*' flag
-                if posting.flag != '!' or posting.flag == '*':
-                    obj = posting
-                    break
-            else:
-                return None
+        return extract_field(entry, self.directive, self.parameter, self.meta_key)
 
-        # Now we don't care if it's a posting or object
-        if self.parameter == 'meta' and self.meta_key in obj.meta:
-            return obj.meta[self.meta_key]
+    def match_entry(self, entry, on_regex=None, view: EntryView = None):
+        """Return the groupdict of the first regular expression matching entry.
 
-        return str(getattr(obj, self.parameter))
-
-    def match_entry(self, entry):
-        value = self.extract_value(entry)
+        on_regex is an optional callable(regex, seconds) used for profiling.
+        view is an optional EntryView of entry to take the value from.
+        """
+        if view is None:
+            value = self.extract_value(entry)
+        else:
+            value = view.get(self.directive, self.parameter, self.meta_key)
 
         if value is None:
             logger.info(f"Got None value for: {self}\n{printer.format_entry(entry)}")
             return
 
-        history = MATCH_CHECK.setdefault(value, {'count': 0})
-        history['count'] += 1
+        if on_regex is not None:
+            return self._timed_match(value, on_regex)
+        return self.match_value(value)
 
+    def match_value(self, value):
+        """Return the groupdict of the first regular expression matching value"""
         for reg in self.regular_expressions:
             match = reg.match(value)
             if match:
-                #  logger.info(f"Match:   {value:42} : {reg}")
-                if hasattr(match, 'groupdict'):
-                    history[reg] = match.groupdict()
-                    return match.groupdict()
-                else:
-                    history[reg] = {}
-                    return {}
+                return match.groupdict()
+
+    def _timed_match(self, value, on_regex):
+        for reg in self.regular_expressions:
+            start = time.perf_counter()
+            match = reg.match(value)
+            on_regex(reg, time.perf_counter() - start)
+            if match:
+                return match.groupdict()
+
+
+def _as_list(value) -> list:
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return list(value)
+    return [value]
+
+
+def _as_decimal(value) -> Optional[Decimal]:
+    if value is None:
+        return None
+    return Decimal(str(value))
+
+
+def _as_date(value) -> Optional[datetime.date]:
+    if value is None:
+        return None
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value))
+
 
-            elif reg not in history:
-                history[reg] = None
+def _as_weekday(value) -> int:
+    if isinstance(value, int) and 0 <= value < 7:
+        return value
+    name = str(value).strip().lower()[:3]
+    if name not in WEEKDAYS:
+        raise ValueError(f"Invalid weekday {value}, use one of {WEEKDAYS}")
+    return WEEKDAYS.index(name)
+
+
+def _predicate_specs(value, keys: tuple, default_key: str) -> List[dict]:
+    """A match-amount/match-date value as a list of dicts"""
+    specs = []
+    for spec in _as_list(value):
+        if not isinstance(spec, dict):
+            spec = {default_key: spec}
+        unknown = set(spec) - set(keys)
+        if unknown:
+            raise ValueError(f"Invalid keys {sorted(unknown)}, use {keys}")
+        specs.append(spec)
+    if not specs:
+        raise ValueError(f"Empty predicate {value}")
+    return specs
+
+
+@dataclass
+class MatchPredicate(DirectiveAttribute):
+    """A typed test on an entry, cheaper than any regular expression.
+
+    match_entry returns {} on a match, None otherwise, like MatchRule.
+    """
+    # Each alternative is a tuple of conditions, any alternative may match
+    alternatives: List[tuple] = field(default_factory=list)
+
+    # Lower is cheaper, Rule.check tries the cheapest first
+    cost: ClassVar[int] = 0
 
+    @property
+    def key(self):
+        return f"{self.directive}-{self.parameter}"
 
-MATCH_CHECK = dict()
+    @classmethod
+    def from_attribute(cls, da: DirectiveAttribute) -> MatchPredicate:
+        for predicate_class in (AmountMatch, DateMatch):
+            if predicate_class.parameter_name == da.parameter:
+                return predicate_class(
+                    command='match',
+                    directive=da.directive,
+                    parameter=da.parameter,
+                    meta_key=None,
+                    alternatives=predicate_class.parse(da.value),
+                )
+        raise ValueError(f"No predicate for {da.parameter}")
+
+
+@dataclass
+class AmountMatch(MatchPredicate):
+    """match-amount: the absolute units of the eligible posting"""
+    parameter_name: ClassVar[str] = 'amount'
+    cost: ClassVar[int] = 2
+
+    @classmethod
+    def parse(cls, value) -> List[tuple]:
+        alternatives = []
+        for spec in _predicate_specs(value, ('min', 'max', 'exact', 'currency'), 'exact'):
+            alternatives.append((
+                frozenset(str(c) for c in _as_list(spec.get('currency'))),
+                frozenset(_as_decimal(v) for v in _as_list(spec.get('exact'))),
+                _as_decimal(spec.get('min')),
+                _as_decimal(spec.get('max')),
+            ))
+        return alternatives
+
+    def match_entry(self, entry, view: EntryView = None):
+        posting = eligible_posting(entry) if view is None else view.posting
+        units = getattr(posting, 'units', None)
+        number = getattr(units, 'number', None)
+        if not isinstance(number, Decimal):
+            return None
+        number = abs(number)
+        for currencies, exact, low, high in self.alternatives:
+            if currencies and units.currency not in currencies:
+                continue
+            if exact and number not in exact:
+                continue
+            if low is not None and number < low:
+                continue
+            if high is not None and number > high:
+                continue
+            return {}
+        return None
+
+
+@dataclass
+class DateMatch(MatchPredicate):
+    """match-date: the date of the transaction"""
+    parameter_name: ClassVar[str] = 'date'
+    cost: ClassVar[int] = 1
+
+    @classmethod
+    def parse(cls, value) -> List[tuple]:
+        alternatives = []
+        for spec in _predicate_specs(value, ('min', 'max', 'weekday', 'day'), 'min'):
+            alternatives.append((
+                _as_date(spec.get('min')),
+                _as_date(spec.get('max')),
+                frozenset(_as_weekday(d) for d in _as_list(spec.get('weekday'))),
+                frozenset(int(d) for d in _as_list(spec.get('day'))),
+            ))
+        return alternatives
+
+    def match_entry(self, entry, view: EntryView = None):
+        date = getattr(entry, 'date', None)
+        if date is None:
+            return None
+        for low, high, weekdays, days in self.alternatives:
+            if low is not None and date < low:
+                continue
+            if high is not None and date > high:
+                continue
+            if weekdays and date.weekday() not in weekdays:
+                continue
+            if days and date.day not in days:
+                continue
+            return {}
+        return None
 
 
 class Rule:
@@ -205,6 +475,8 @@ class Rule:
 
     # Dict (directive, key, meta-key) -> [values]
     match_requirements: dict = None
+    # Typed predicates, cheapest first
+    match_predicates: List[MatchPredicate]
     set_rules: List[SetRule]
 
     actions: list = None
@@ -217,11 +489,20 @@ class Rule:
             set_rules={pprint.pformat(self.set_rules)},
         )"""
 
-    def __init__(self, rule_dict: dict):
+    def __init__(self, rule_dict: dict, analyzer=None):
+        # Optional coolbeans.rules.analyzer.RegexAnalyzer, checks every regex
+        self.analyzer = analyzer
+
         # These are the Match rules
         self.match_requirements = {}
+        self.match_predicates = []
         self.set_rules = []
 
+        # Anything in RULE_OPTIONS
+        self.options = {
+            k: v for k, v in rule_dict.items() if is_rule_option(k)
+        }
+
         # This is what to do if we match
         self.actions = []
 
@@ -250,7 +531,7 @@ class Rule:
     def expand_rule_dict(self, rule_dict: dict) -> Iterator[DirectiveAttribute]:
 
         for key, value in rule_dict.items():
-            if key == 'match-key': continue
+            if is_rule_option(key): continue
             key_match = match_any_re(KEY_RE, key)
 
             if key_match is None:
@@ -271,8 +552,16 @@ class Rule:
             )
 
             if command == 'test':
+                # A test's value is sample data, a dict isn't sub-keys
                 attr.value = value
                 yield attr
+                continue
+
+            if command == 'match' and parameter in PREDICATE_PARAMETERS:
+                # The dict is the predicate, not sub-keys
+                attr.value = value
+                yield attr
+                continue
 
             # Is this code even related
             if isinstance(value, dict):
@@ -306,17 +595,64 @@ class Rule:
             attr.directive = 'posting'
         elif attr.parameter in ('meta',):
             assert attr.meta_key, f"Meta requires an addition name, like 'match-meta-mykey {attr}"
+        elif attr.parameter == 'amount' and attr.command == 'match':
+            assert attr.directive is None or attr.directive == 'posting', attr
+            attr.directive = 'posting'
+        elif attr.parameter == 'date' and attr.command == 'match':
+            assert attr.directive is None or attr.directive == 'transaction', attr
+            attr.directive = 'transaction'
 
         return attr
 
-    def add_directives(self, rule_dict: dict):
+    @classmethod
+    def from_attributes(cls, attributes: List[DirectiveAttribute], options: dict = None, analyzer=None) -> Rule:
+        """Build a Rule from already normalized attributes, see normalize_rule_dict."""
+        rule = cls(dict(options or {}), analyzer=analyzer)
+        rule.add_attributes(attributes)
+        return rule
 
-        for da in self.expand_rule_dict(rule_dict):
+    @property
+    def commutes(self) -> bool:
+        """True if this Rule may be tried in any order relative to other commuting Rules"""
+        return bool(self.options.get('commutes', False))
 
+    @property
+    def signature(self) -> str:
+        """A stable identifier of what this Rule matches and sets"""
+        parts = (
+            sorted(
+                (key, sorted(r.pattern for r in m.regular_expressions))
+                for key, m in self.match_requirements.items()
+            ),
+            [(s.directive, s.parameter, s.meta_key, repr(s.value)) for s in self.set_rules],
+        )
+        if self.match_predicates:
+            parts += (sorted((p.key, repr(p.alternatives)) for p in self.match_predicates),)
+        return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+    def normalize_rule_dict(self, rule_dict: dict) -> List[DirectiveAttribute]:
+        """Expand a rule_dict into a list of validated DirectiveAttributes"""
+        result = []
+        for da in self.expand_rule_dict(rule_dict):
             self.setdefault_params(da)
             da.validate()
+            # expand_rule_dict re-uses the same instance for sub-keys
+            result.append(copy.copy(da))
+        return result
 
-            if da.command == 'match':
+    def add_directives(self, rule_dict: dict):
+        self.add_attributes(self.normalize_rule_dict(rule_dict))
+
+    def add_attributes(self, attributes: List[DirectiveAttribute]):
+
+        for da in attributes:
+
+            if da.command == 'match' and da.parameter in PREDICATE_PARAMETERS:
+                self.match_predicates.append(MatchPredicate.from_attribute(da))
+                # sort() is stable, so equal costs keep their order
+                self.match_predicates.sort(key=lambda p: p.cost)
+
+            elif da.command == 'match':
 
                 # This str/list/set is a bit of a mess
                 if isinstance(da.value, str):
@@ -327,6 +663,9 @@ class Rule:
                     values = da.value
 
                 values = {re.compile(v, re.I) for v in values}
+                if self.analyzer is not None:
+                    for regex in values:
+                        self.analyzer.check(regex)
 
                 m = MatchRule(
                     command='match',
@@ -338,6 +677,9 @@ class Rule:
                 # Add it to our list of Match Rules
                 self.upset_match_rule(m)
 
+            if da.command == 'test':
+                self.tests.append(da)
+
             if da.command == 'set':
                 assert da.value is not None, str(da)
                 self.set_rules.append(
@@ -353,26 +695,42 @@ class Rule:
     def decode_value(self, value):
         if isinstance(value, str):
             try:
-                value = yaml.load(value, Loader=yaml.FullLoader)
+                value = yaml_load(value)
             except ValueError:
                 pass
         return value
 
-    def check(self, entry):
+    def check(self, entry, on_near_miss=None, on_regex=None, view: EntryView = None):
         """Check to see if an Entry matches this Rule.
 
         args:
             entry - an data.Transaction
+            on_near_miss - optional callable(rule, match_rule, entry), called
+                when a MatchRule fails after an earlier one matched
+            on_regex - optional callable(regex, seconds), see MatchRule.match_entry
+            view - an EntryView of entry, shared when checking many Rules
         returns:
             None if there's no match
             dict if there's any match.  Note the dict might be empty.
 
         """
+        if view is None:
+            view = EntryView(entry)
+
+        # Cheap typed checks first, these reject most entries
+        for predicate in self.match_predicates:
+            if predicate.match_entry(entry, view=view) is None:
+                return None
+
         result_dict = {}
+        matched = False
         for key, match_requirement in self.match_requirements.items():
-            match = match_requirement.match_entry(entry)
+            match = match_requirement.match_entry(entry, on_regex=on_regex, view=view)
             if match is None:
+                if matched and on_near_miss is not None:
+                    on_near_miss(self, match_requirement, entry)
                 return None
+            matched = True
             result_dict.update(match)
         return result_dict
 
@@ -382,64 +740,92 @@ class Rule:
             match_values: dict,
             flag_to_done=True):
         """takes an Entry and a dict of values we parsed from the Entry
+
+        All the changes are collected first, so the Transaction and each
+        Posting are only rebuilt once.
         """
+        changes = {}
+        meta = None
+        posting_rules = []
 
-        # Pre-process match_value?
         for sr in self.set_rules:
 
             if sr.directive == 'transaction':
                 # Should Possible Eval the Value?
                 if sr.meta_key:
                     # Meta Key is inserted
-                    meta = dict(entry.meta)
+                    if meta is None:
+                        meta = dict(entry.meta)
                     meta[sr.meta_key] = sr.value
-                    entry = entry._replace(meta=meta)
                 else:
                     value = sr.value
                     if sr.parameter in ('links', 'tags'):
-                        current:set = getattr(entry, sr.parameter, set()) or set()
-                        current.add(value)
-                        value = current
-
-                    entry = entry._replace(**{sr.parameter: value})
+                        current = changes.get(sr.parameter, getattr(entry, sr.parameter, None)) or set()
+                        value = set(current)
+                        value.add(sr.value)
+                    changes[sr.parameter] = value
 
             elif sr.directive == 'posting':
-                postings = []
-                for posting in entry.postings:
-                    if posting.flag == '!':
-                        if sr.meta_key:
-                            meta = dict(posting.meta)
-                            meta[sr.meta_key] = sr.value
-                            posting = posting._replace(
-                                meta=meta
-                            )
-                        elif sr.value is not None:
-                            posting = posting._replace(**{
-                                sr.parameter: sr.value
-                            })
-                        else:
-                            logger.warning(f"Invalid directive to Set {sr.parameter} to {sr.value} on {posting} for {entry}")
-                            logger.warning(f"{self}")
-                        logger.debug(f"New POSTING: {posting}")
-                    postings.append(posting)
-
-                entry = entry._replace(postings=postings)
+                posting_rules.append(sr)
 
             for field, value in match_values.items():
                 # We allow <payee> and <meta_tagname> in match-groups
-                if field == "payee" and not entry.payee:
-                    entry = entry._replace(payee=value.title())  # Propercase
+                if field == "payee" and not changes.get('payee', entry.payee):
+                    changes['payee'] = value.title()  # Propercase
                 if field.startswith('meta_'):
-                    meta_name = field[5:]
-                    entry.meta[meta_name] = value
+                    if meta is None:
+                        meta = dict(entry.meta)
+                    meta[field[5:]] = value
+
+        if posting_rules or flag_to_done:
+            changes['postings'] = [
+                self.modify_posting(entry, posting, posting_rules, flag_to_done)
+                for posting in entry.postings
+            ]
 
         if flag_to_done:
             # Set all ! -> *
-            postings = []
-            for posting in entry.postings:
-                if posting.flag == '!':
-                    posting = posting._replace(flag='')
-                postings.append(posting)
-            entry = entry._replace(postings=postings, flag='*')
+            changes['flag'] = '*'
+
+        if meta is not None:
+            changes['meta'] = meta
 
+        if changes:
+            entry = entry._replace(**changes)
         return entry
+
+    def modify_posting(
+            self,
+            entry: data.Transaction,
+            posting: data.Posting,
+            posting_rules: List[SetRule],
+            flag_to_done=True) -> data.Posting:
+        """Apply the posting SetRules to a single '!' posting"""
+        changes = {}
+        meta = None
+        flag = posting.flag
+
+        for sr in posting_rules:
+            if flag != '!':
+                continue
+            if sr.meta_key:
+                if meta is None:
+                    meta = dict(posting.meta)
+                meta[sr.meta_key] = sr.value
+            elif sr.value is not None:
+                changes[sr.parameter] = sr.value
+                if sr.parameter == 'flag':
+                    flag = sr.value
+            else:
+                logger.warning(f"Invalid directive to Set {sr.parameter} to {sr.value} on {posting} for {entry}")
+                logger.warning(f"{self}")
+
+        if flag_to_done and flag == '!':
+            changes['flag'] = ''
+
+        if meta is not None:
+            changes['meta'] = meta
+
+        if changes:
+            posting = posting._replace(**changes)
+        return posting
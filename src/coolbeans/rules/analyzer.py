@@ -0,0 +1,194 @@
+"""
+Regex safety and cost checks for rules files.
+
+A single ``match-narration`` with nested quantifiers, like ``(\\w+\\s?)*$``,
+can take seconds (or forever) on a long OFX memo, and fava stalls while it
+does.  The RegexAnalyzer looks at each regular expression as the Rules are
+compiled:
+
+* Statically, for nested quantifiers and quantified alternations whose
+  branches overlap, the usual sources of catastrophic backtracking.
+* Dynamically, by timing the regex against a corpus of real narrations from
+  the ledger and comparing the worst call with a time budget.
+
+Problems are logged as warnings.  With reject=True, a regex that is prone to
+backtracking or blows the budget raises UnsafeRegexError and the Rule is
+dropped.  A regex that is prone to backtracking is never timed, that could
+hang the very reload we're trying to protect.
+
+Timings are kept between reloads for as long as the corpus stays the same,
+so an unchanged rules file isn't timed again on every save.
+
+    2020-01-01 custom "coolbeans" "regex-budget-ms" "1.0"
+    2020-01-01 custom "coolbeans" "regex-reject" "true"
+
+"""
+import time
+import hashlib
+import logging
+from typing import Dict, Iterable, List, Optional
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:  # pragma: no cover
+    import sre_parse
+
+
+logger = logging.getLogger(__name__)
+
+
+REPEATS = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT)
+
+# Only time against this many narrations, the longest ones
+DEFAULT_CORPUS_SIZE = 100
+
+DEFAULT_BUDGET_SECONDS = 0.001
+
+
+# corpus digest -> pattern -> worst seconds, only for the latest corpus
+TIMINGS: Dict[str, Dict[str, float]] = {}
+
+
+class UnsafeRegexError(ValueError):
+    """A regex is prone to backtracking or exceeded the time budget"""
+
+
+def _first_chars(items) -> Optional[set]:
+    """The set of literal characters a sequence can start with, None if any"""
+    for op, av in items:
+        if op is sre_parse.LITERAL:
+            return {chr(av).lower()}
+        if op is sre_parse.SUBPATTERN:
+            return _first_chars(av[-1])
+        if op is sre_parse.AT:
+            continue
+        return None
+    return set()
+
+
+def _overlapping(alternatives) -> bool:
+    seen = set()
+    for alternative in alternatives:
+        chars = _first_chars(alternative)
+        if chars is None or chars & seen:
+            return True
+        seen.update(chars)
+    return False
+
+
+def _find_problem(items, in_repeat: bool) -> Optional[str]:
+    for op, av in items:
+        if op in REPEATS:
+            low, high, body = av
+            repeats = high > 1
+            if repeats and in_repeat:
+                return "nested quantifier"
+            problem = _find_problem(body, in_repeat or repeats)
+            if problem:
+                return problem
+        elif op is sre_parse.SUBPATTERN:
+            problem = _find_problem(av[-1], in_repeat)
+            if problem:
+                return problem
+        elif op is sre_parse.BRANCH:
+            if in_repeat and _overlapping(av[1]):
+                return "quantified alternation with overlapping branches"
+            for alternative in av[1]:
+                problem = _find_problem(alternative, in_repeat)
+                if problem:
+                    return problem
+    return None
+
+
+def backtracking_risk(regex) -> Optional[str]:
+    """Why a compiled regex is prone to catastrophic backtracking, or None"""
+    try:
+        parsed = sre_parse.parse(regex.pattern, regex.flags)
+    except Exception:
+        return None
+    return _find_problem(list(parsed), False)
+
+
+class RegexAnalyzer:
+    """Checks each regex of a Rule as it's compiled, see Rule(analyzer=...)"""
+
+    corpus: List[str]
+
+    # pattern -> worst seconds per call
+    timings: Dict[str, float]
+
+    def __init__(
+            self,
+            corpus: Iterable[str] = (),
+            budget: float = DEFAULT_BUDGET_SECONDS,
+            reject: bool = False,
+            corpus_size: int = DEFAULT_CORPUS_SIZE):
+        """
+        Args:
+            corpus: sample values, usually the narrations in the ledger
+            budget: worst allowed seconds for a single match call
+            reject: raise UnsafeRegexError for regexes over budget
+            corpus_size: how many (of the longest) corpus values to use
+        """
+        unique = sorted(
+            set(c for c in corpus if isinstance(c, str)),
+            key=len, reverse=True,
+        )
+        self.corpus = unique[:corpus_size]
+        self.budget = budget
+        self.reject = reject
+
+        # Re-use the timings of the last analyzer with the same corpus
+        content = "\0".join(self.corpus).encode('utf-8')
+        digest = hashlib.sha256(content).hexdigest()
+        if digest not in TIMINGS:
+            TIMINGS.clear()
+            TIMINGS[digest] = {}
+        self.timings = TIMINGS[digest]
+        self.warnings = []
+        self.rejected = []
+
+    def worst_time(self, regex) -> float:
+        """The slowest regex.match over the corpus, in seconds"""
+        worst = self.timings.get(regex.pattern, None)
+        if worst is None:
+            worst = 0.0
+            for value in self.corpus:
+                start = time.perf_counter()
+                regex.match(value)
+                elapsed = time.perf_counter() - start
+                if elapsed > worst:
+                    worst = elapsed
+            self.timings[regex.pattern] = worst
+        return worst
+
+    def check(self, regex):
+        """Warn about (or reject) a compiled regular expression"""
+        risk = backtracking_risk(regex)
+        if risk:
+            message = (
+                f"Regex {regex.pattern!r} is prone to catastrophic "
+                f"backtracking: {risk}"
+            )
+            if self.reject:
+                self.rejected.append(regex.pattern)
+                raise UnsafeRegexError(message)
+            # Timing it could take forever
+            self.warn(message)
+            return
+
+        worst = self.worst_time(regex)
+        if worst > self.budget:
+            message = (
+                f"Regex {regex.pattern!r} took {worst * 1000:.2f}ms "
+                f"on a narration, "
+                f"budget is {self.budget * 1000:.2f}ms"
+            )
+            if self.reject:
+                self.rejected.append(regex.pattern)
+                raise UnsafeRegexError(message)
+            self.warn(message)
+
+    def warn(self, message: str):
+        self.warnings.append(message)
+        logger.warning(message)
@@ -0,0 +1,251 @@
+"""
+On-disk cache of compiled rules files.
+
+Fava reloads the ledger on every save, and every reload used to parse each
+rules.yaml and expand every key again.  We keep the normalized rules (the
+validated DirectiveAttributes of each Rule) in a pickle, keyed on the path of
+the rules file.  The cached copy is only used if both the mtime and the
+sha256 of the file content are unchanged.
+
+Next to the pickle we keep a JSON mirror of the parsed rules file.  When the
+pickle can't be used (a new coolbeans version, say) but the YAML content is
+unchanged, the mirror is loaded instead of parsing the YAML again.  YAML is
+parsed with libyaml when PyYAML has it, see utils.yaml_load.
+
+Configure it in the ledger:
+
+    2020-01-01 custom "coolbeans" "rules-cache" "~/.cache/coolbeans"
+
+Use "off" to disable the cache.  By default we use $XDG_CACHE_HOME/coolbeans.
+"""
+import os
+import json
+import pickle
+import hashlib
+import logging
+import pathlib
+import tempfile
+from typing import Dict, List, Optional, Union
+
+from coolbeans.utils import yaml_load
+from coolbeans.rule import Rule, DirectiveAttribute, is_rule_option
+from coolbeans.rules.analyzer import UnsafeRegexError
+
+
+logger = logging.getLogger(__name__)
+
+
+# Bump this whenever the normalized structure of a Rule changes
+CACHE_VERSION = 3
+
+DISABLED = ('off', 'false', 'no', 'none')
+
+
+def default_cache_dir() -> pathlib.Path:
+    base = os.environ.get('XDG_CACHE_HOME', None)
+    if not base:
+        base = pathlib.Path('~/.cache').expanduser()
+    return pathlib.Path(base).joinpath('coolbeans')
+
+
+def _pack(attributes: List[DirectiveAttribute]) -> list:
+    return [
+        (
+            a.command, a.directive, a.parameter, a.meta_key,
+            getattr(a, 'value', None),
+        )
+        for a in attributes
+    ]
+
+
+def _unpack(packed: list) -> List[DirectiveAttribute]:
+    result = []
+    for command, directive, parameter, meta_key, value in packed:
+        attr = DirectiveAttribute(
+            command=command,
+            directive=directive,
+            parameter=parameter,
+            meta_key=meta_key,
+        )
+        attr.value = value
+        result.append(attr)
+    return result
+
+
+class RulesCache:
+    """Load rules files, re-using normalized rules from disk when possible"""
+
+    directory: Optional[pathlib.Path]
+
+    # path -> sha256 of each rules file we've loaded
+    hashes: Dict[str, str]
+
+    def __init__(self, directory: Union[str, pathlib.Path, None] = None):
+        if directory is None:
+            directory = default_cache_dir()
+        elif str(directory).lower() in DISABLED:
+            directory = None
+        self.directory = None
+        if directory:
+            self.directory = pathlib.Path(directory).expanduser()
+        self.hashes = {}
+        self.hits = 0
+        self.misses = 0
+
+    def version(self) -> str:
+        """A hash over the content of every rules file loaded, in order"""
+        digest = hashlib.sha256(str(CACHE_VERSION).encode('utf-8'))
+        for path, file_hash in self.hashes.items():
+            digest.update(f"{path}:{file_hash}\n".encode('utf-8'))
+        return digest.hexdigest()
+
+    def cache_file(self, file: pathlib.Path) -> pathlib.Path:
+        name = hashlib.sha1(str(file).encode('utf-8')).hexdigest()
+        return self.directory.joinpath(f"rules-{name}.pickle")
+
+    def mirror_file(self, file: pathlib.Path) -> pathlib.Path:
+        return self.cache_file(file).with_suffix('.json')
+
+    def write_file(self, target: pathlib.Path, content: bytes):
+        """Write atomically so a concurrent reader never sees half a file"""
+        try:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(
+                dir=str(target.parent), suffix='.tmp')
+            with os.fdopen(fd, "wb") as stream:
+                stream.write(content)
+            os.replace(tmp_name, str(target))
+        except OSError:
+            logger.warning(
+                f"Unable to write rules cache {target}", exc_info=True)
+
+    def read_cache(
+            self,
+            file: pathlib.Path,
+            mtime_ns: int,
+            digest: str) -> Optional[list]:
+        cache_file = self.cache_file(file)
+        if not cache_file.exists():
+            return None
+        try:
+            with cache_file.open("rb") as stream:
+                cached = pickle.load(stream)
+        except Exception:
+            logger.warning(f"Ignoring unreadable rules cache {cache_file}")
+            return None
+
+        stamp = (
+            cached.get('version'), cached.get('path'),
+            cached.get('mtime_ns'), cached.get('sha256'),
+        )
+        if stamp != (CACHE_VERSION, str(file), mtime_ns, digest):
+            return None
+        return cached['rules']
+
+    def write_cache(
+            self,
+            file: pathlib.Path,
+            mtime_ns: int,
+            digest: str,
+            rules: list):
+        cached = {
+            'version': CACHE_VERSION,
+            'path': str(file),
+            'mtime_ns': mtime_ns,
+            'sha256': digest,
+            'rules': rules,
+        }
+        content = pickle.dumps(cached, protocol=pickle.HIGHEST_PROTOCOL)
+        self.write_file(self.cache_file(file), content)
+
+    def read_mirror(self, file: pathlib.Path, digest: str) -> Optional[list]:
+        mirror_file = self.mirror_file(file)
+        if not mirror_file.exists():
+            return None
+        try:
+            with mirror_file.open("rb") as stream:
+                mirror = json.load(stream)
+        except (OSError, ValueError):
+            logger.warning(f"Ignoring unreadable rules mirror {mirror_file}")
+            return None
+
+        if mirror.get('sha256') != digest:
+            return None
+        return mirror['rules']
+
+    def write_mirror(self, file: pathlib.Path, digest: str, rule_dicts: list):
+        mirror = {
+            'path': str(file),
+            'sha256': digest,
+            'rules': rule_dicts,
+        }
+        try:
+            # Only plain rules survive the round trip, dates and the like don't
+            content = json.dumps(mirror, allow_nan=False)
+            if json.loads(content)['rules'] != rule_dicts:
+                return
+        except (TypeError, ValueError):
+            return
+        self.write_file(self.mirror_file(file), content.encode('utf-8'))
+
+    def read_rule_dicts(
+            self,
+            file: pathlib.Path,
+            content: bytes,
+            digest: str) -> list:
+        """The parsed rules file, the JSON mirror if the YAML is unchanged"""
+        rule_dicts = None
+        if self.directory:
+            rule_dicts = self.read_mirror(file, digest)
+        if rule_dicts is None:
+            rule_dicts = yaml_load(content) or []
+            if self.directory:
+                self.write_mirror(file, digest, rule_dicts)
+        else:
+            logger.debug(f"Using JSON mirror of {file}")
+        return rule_dicts
+
+    def parse(self, rule_dicts: list) -> list:
+        """Turn parsed rule_dicts into a list of packed, normalized rules"""
+        packed = []
+        for rule_dict in rule_dicts:
+            rule = Rule({})
+            options = {
+                k: v for k, v in rule_dict.items() if is_rule_option(k)
+            }
+            attributes = rule.normalize_rule_dict(rule_dict)
+            packed.append((options, _pack(attributes)))
+        return packed
+
+    def load(
+            self,
+            file: Union[str, pathlib.Path],
+            analyzer=None) -> List[Rule]:
+        """Return the Rules in a rules file, less any the analyzer rejects"""
+        file = pathlib.Path(file).expanduser().absolute()
+        content = file.read_bytes()
+        mtime_ns = file.stat().st_mtime_ns
+        digest = hashlib.sha256(content).hexdigest()
+        self.hashes[str(file)] = digest
+
+        packed = None
+        if self.directory:
+            packed = self.read_cache(file, mtime_ns, digest)
+
+        if packed is None:
+            self.misses += 1
+            packed = self.parse(self.read_rule_dicts(file, content, digest))
+            if self.directory:
+                self.write_cache(file, mtime_ns, digest, packed)
+        else:
+            self.hits += 1
+            logger.debug(f"Using cached rules for {file}")
+
+        rules = []
+        for position, (options, p) in enumerate(packed):
+            try:
+                rules.append(Rule.from_attributes(
+                    _unpack(p), options=options, analyzer=analyzer))
+            except UnsafeRegexError as exc:
+                logger.error(f"Rejected rule {position} in {file}: {exc}")
+        return rules
@@ -0,0 +1,163 @@
+"""
+Find dead, shadowed and conflicting rules using the ledger's own history.
+
+Every Rule is checked against every transaction, on its own (not in sequence
+like match_directives does), which gives a sparse rule x entry hit matrix.
+From that we report:
+
+* dead rules, which never match anything,
+* subset rules, whose hits are a strict subset of another rule's hits.  If
+  the other rule comes first, it shadows this one,
+* conflicts, entries matched by rules setting different posting accounts.
+
+Only the candidates a RuleIndex returns are checked, and each field of an
+entry is extracted once (EntryView), so 50k entries x 5k rules is far from the
+250M checks of a plain double loop:
+
+    cool-match --analyze --rules rules.yaml -e main.bean
+
+"""
+import logging
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from beancount.core import data
+
+from coolbeans.rule import Rule, EntryView
+from coolbeans.rules.index import RuleIndex
+
+
+logger = logging.getLogger(__name__)
+
+
+class HitMatrix:
+    """Which entries each Rule matches, and which Rules match each entry"""
+
+    # rule position -> entry positions
+    rule_hits: List[Set[int]]
+    # entry position -> rule positions, only for entries with any hit
+    entry_hits: Dict[int, List[int]]
+
+    def __init__(self, size: int):
+        self.rule_hits = [set() for _ in range(size)]
+        self.entry_hits = {}
+        self.checks = 0
+
+    def add(self, entry_position: int, rule_positions: List[int]):
+        self.entry_hits[entry_position] = rule_positions
+        for position in rule_positions:
+            self.rule_hits[position].add(entry_position)
+
+
+def build_hit_matrix(
+        index: RuleIndex,
+        entries: List[data.Transaction]) -> HitMatrix:
+    """Check every Rule that could match against every entry"""
+    matrix = HitMatrix(len(index))
+    rules = index.rules
+    for entry_position, entry in enumerate(entries):
+        view = EntryView(entry)
+        candidates = index.candidates(entry, view=view)
+        matrix.checks += len(candidates)
+        hits = [
+            p for p in candidates
+            if rules[p].check(entry, view=view) is not None
+        ]
+        if hits:
+            matrix.add(entry_position, hits)
+    return matrix
+
+
+def posting_account(rule: Rule) -> Optional[str]:
+    """The account a Rule sets on the posting, if it does"""
+    account = None
+    for set_rule in rule.set_rules:
+        if set_rule.directive == 'posting' and set_rule.parameter == 'account':
+            account = set_rule.value
+    return account
+
+
+class Subset(NamedTuple):
+    position: int
+    # The Rule matching everything position matches, and more
+    superset: int
+
+    @property
+    def shadowed(self) -> bool:
+        return self.superset < self.position
+
+
+class Conflict(NamedTuple):
+    entry: int
+    # account -> positions of the Rules setting it
+    accounts: Dict[str, List[int]]
+
+
+class RuleAnalysis(NamedTuple):
+    entries: int
+    checks: int
+    dead: List[int]
+    subsets: List[Subset]
+    conflicts: List[Conflict]
+
+
+def dead_rules(matrix: HitMatrix) -> List[int]:
+    return [
+        position for position, hits in enumerate(matrix.rule_hits) if not hits
+    ]
+
+
+def subset_rules(matrix: HitMatrix) -> List[Subset]:
+    result = []
+    for position, hits in enumerate(matrix.rule_hits):
+        if not hits:
+            continue
+        # A superset has to hit every entry we hit, so look at the rarest one
+        pivot = min(hits, key=lambda e: len(matrix.entry_hits[e]))
+        for other in matrix.entry_hits[pivot]:
+            other_hits = matrix.rule_hits[other]
+            if other == position or len(other_hits) <= len(hits):
+                continue
+            if hits <= other_hits:
+                result.append(Subset(position, other))
+    return result
+
+
+def conflicting_entries(
+        matrix: HitMatrix,
+        rules: List[Rule]) -> List[Conflict]:
+    accounts = [posting_account(rule) for rule in rules]
+    result = []
+    for entry_position, positions in sorted(matrix.entry_hits.items()):
+        by_account: Dict[str, List[int]] = {}
+        for position in positions:
+            account = accounts[position]
+            if account is not None:
+                by_account.setdefault(account, []).append(position)
+        if len(by_account) > 1:
+            result.append(Conflict(entry_position, by_account))
+    return result
+
+
+def analyze(
+        rules: List[Rule],
+        entries: Iterable[data.Directive],
+        accounts: Iterable[str] = (),
+) -> Tuple[RuleAnalysis, List[data.Transaction]]:
+    """Analyze rules over the transactions in entries"""
+    transactions = [
+        entry for entry in entries if isinstance(entry, data.Transaction)
+    ]
+    index = RuleIndex(rules, accounts=accounts)
+    matrix = build_hit_matrix(index, transactions)
+    logger.info(
+        f"Checked {len(rules)} rules against {len(transactions)} entries, "
+        f"{matrix.checks} checks instead of {len(rules) * len(transactions)}"
+    )
+    analysis = RuleAnalysis(
+        entries=len(transactions),
+        checks=matrix.checks,
+        dead=dead_rules(matrix),
+        subsets=subset_rules(matrix),
+        conflicts=conflicting_entries(matrix, index.rules),
+    )
+    return analysis, transactions
@@ -0,0 +1,147 @@
+"""
+Propose rules for pending entries, see matcher.generate_new_rules.
+
+Bank narrations are mostly a merchant name plus some noise: order numbers,
+store numbers, dates, reference codes.  Grouping on the exact narration gives
+one candidate per order, so we tokenize each narration and mask every token
+containing a digit:
+
+    "AMZN Mktp US*2K3AB91Q2"  -> amzn, " ", mktp, " ", us, "*", <id>
+    "AMZN Mktp US*L08746BB3"  -> amzn, " ", mktp, " ", us, "*", <id>
+
+Entries with the same masked signature form a cluster, and each cluster gets
+one regular expression that matches all of its narrations:
+
+    amzn\\s+mktp\\s+us\\*\\w+
+
+"""
+import re
+import decimal
+import collections
+from dataclasses import dataclass, field
+from typing import Counter, Dict, Iterable, List, Optional, Set, Tuple
+
+from beancount.core import data
+
+
+# Whitespace, words (including IDs like L08746BB3) and single punctuation
+TOKEN_RE = re.compile(r"\s+|\w+|[^\w\s]")
+
+# Stands in for any word containing a digit, it can't be a token itself
+MASK = '<id>'
+
+
+@dataclass
+class PossibleRule:
+    """A cluster of pending entries with the same masked narration"""
+    signature: Tuple[str, ...]
+    count: int = field(default=0)
+    entry: Optional[data.Transaction] = field(default=None)
+    # For each masked token, did every narration have only digits there
+    digits_only: List[bool] = field(default_factory=list)
+    accounts: Counter = field(default_factory=collections.Counter)
+    amounts: Set[float] = field(default_factory=set)
+
+    def add(self, entry: data.Transaction, tokens: List[str]):
+        if self.entry is None:
+            self.entry = entry
+            self.digits_only = [t.isdecimal() for t in tokens if _masked(t)]
+        else:
+            position = 0
+            for token in tokens:
+                if _masked(token):
+                    if not token.isdecimal():
+                        self.digits_only[position] = False
+                    position += 1
+        self.count += 1
+
+        for posting in entry.postings:
+            # Unbooked postings may still have MISSING units
+            number = getattr(posting.units, 'number', None)
+            if isinstance(number, decimal.Decimal):
+                self.amounts.add(float(abs(number)))
+            if posting.flag == "*":
+                self.accounts[posting.account] += 1
+
+    @property
+    def pattern(self) -> str:
+        """A regular expression matching every narration in the cluster"""
+        parts = []
+        masks = iter(self.digits_only)
+        for token in self.signature:
+            if token == MASK:
+                parts.append(r"\d+" if next(masks) else r"\w+")
+            elif token == " ":
+                parts.append(r"\s+")
+            else:
+                parts.append(re.escape(token))
+        return "".join(parts)
+
+    @property
+    def account(self) -> str:
+        if not self.accounts:
+            return ""
+        return self.accounts.most_common(1)[0][0]
+
+    def as_rule(self) -> dict:
+        amounts = sorted(self.amounts)
+        return {
+            'match-narration': self.pattern,
+            'match-account': self.account,
+            'comment': {
+                'count': self.count,
+                'example': self.entry.narration,
+                'amounts': {
+                    'min': amounts[0] if amounts else None,
+                    'max': amounts[-1] if amounts else None,
+                    'distinct': len(amounts),
+                },
+            },
+        }
+
+
+def _masked(token: str) -> bool:
+    return any(c.isdecimal() for c in token)
+
+
+def tokenize(narration: str) -> List[str]:
+    """Lower case tokens of a narration, whitespace collapsed to one space"""
+    tokens = []
+    for token in TOKEN_RE.findall(narration.strip().lower()):
+        if token.isspace():
+            token = " "
+        tokens.append(token)
+    return tokens
+
+
+def signature(tokens: List[str]) -> Tuple[str, ...]:
+    return tuple(MASK if _masked(t) else t for t in tokens)
+
+
+def cluster_entries(
+        entries: Iterable[data.Directive],
+) -> Dict[Tuple[str, ...], PossibleRule]:
+    """Group the pending transactions by their masked narration"""
+    clusters: Dict[Tuple[str, ...], PossibleRule] = {}
+    for entry in entries:
+        if not isinstance(entry, data.Transaction):
+            continue
+        if entry.flag != "!" or not entry.narration:
+            continue
+        tokens = tokenize(entry.narration)
+        key = signature(tokens)
+        possible = clusters.get(key, None)
+        if possible is None:
+            possible = clusters[key] = PossibleRule(signature=key)
+        possible.add(entry, tokens)
+    return clusters
+
+
+def propose_rules(entries: Iterable[data.Directive]) -> List[dict]:
+    """One proposed rule per cluster, least common first"""
+    rules = [
+        possible.as_rule() for possible in cluster_entries(entries).values()
+    ]
+    rules.sort(
+        key=lambda item: (item['comment']['count'], item['match-narration']))
+    return rules
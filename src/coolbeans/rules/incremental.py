@@ -0,0 +1,104 @@
+"""
+Incremental matching between reloads.
+
+Fava re-runs the plugins on every save, but usually only a handful of the
+pending ('!') entries changed.  We remember, for each entry fingerprint, which
+Rules matched it and with what values.  On the next run an entry with the same
+fingerprint, under the same version of the rules, simply gets those Rules
+re-applied without checking any of the others.
+
+Enable it in the ledger:
+
+    2020-01-01 custom "coolbeans" "match-incremental" "true"
+
+It's skipped while match-statistics or match-profile is on, the statistics
+need every entry checked against the rules.
+"""
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from coolbeans.rules.index import RuleIndex
+from coolbeans.tools.fingerprint import entry_fingerprint
+
+
+logger = logging.getLogger(__name__)
+
+
+class IncrementalMatcher:
+    """Remembers match results across runs of match_directives"""
+
+    # fingerprint -> ((position, match_values), ...)
+    results: Dict[str, Tuple[Tuple[int, dict], ...]]
+    version: Optional[str]
+
+    def __init__(self):
+        self.results = {}
+        self.version = None
+        self.index = None
+        self.seen = set()
+        self.hits = 0
+        self.misses = 0
+
+    def begin(self, index: RuleIndex, version: str):
+        """Start a new run with the given rules"""
+        if version != self.version:
+            logger.info(
+                f"Rules changed, dropping {len(self.results)} cached matches")
+            self.results = {}
+        self.version = version
+        self.index = index
+        self.seen = set()
+        self.hits = self.misses = 0
+
+    def apply(self, entry) -> Tuple[object, bool]:
+        """Same as RuleIndex.apply, re-using results from earlier runs"""
+        key = entry_fingerprint(entry)
+        self.seen.add(key)
+
+        applied = self.results.get(key, None)
+        if applied is None:
+            self.misses += 1
+            entry, applied = self.index.match_all(entry)
+            self.results[key] = tuple(applied)
+            return entry, bool(applied)
+
+        self.hits += 1
+        return self.index.replay(entry, applied), bool(applied)
+
+    def apply_many(
+            self,
+            entries: List,
+            match_many=None) -> List[Tuple[object, bool]]:
+        """RuleIndex.apply_many, only matching the entries we haven't seen"""
+        keys = [entry_fingerprint(entry) for entry in entries]
+        self.seen.update(keys)
+
+        todo = [i for i, key in enumerate(keys) if key not in self.results]
+        match_many = match_many or self.index.match_many
+        matched = match_many([entries[i] for i in todo])
+
+        results = [None] * len(entries)
+        for i, (entry, applied) in zip(todo, matched):
+            self.results[keys[i]] = tuple(applied)
+            results[i] = (entry, bool(applied))
+        self.misses += len(todo)
+
+        for i, key in enumerate(keys):
+            if results[i] is None:
+                self.hits += 1
+                applied = self.results[key]
+                entry = self.index.replay(entries[i], applied)
+                results[i] = (entry, bool(applied))
+
+        return results
+
+    def finish(self):
+        """Forget entries that are no longer in the ledger"""
+        for key in set(self.results) - self.seen:
+            del self.results[key]
+        logger.info(
+            f"Incremental match: {self.hits} re-used, {self.misses} matched")
+
+
+# One per process, so it survives fava reloads
+INCREMENTAL_MATCHER = IncrementalMatcher()
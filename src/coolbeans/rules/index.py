@@ -0,0 +1,483 @@
+"""
+An Index over a list of Rules.
+
+Trying every Rule against every pending entry gets slow with a few thousand
+rules.  Most rules can never match most entries though: a narration rule
+like ``AMZN Mktp.*`` needs the narration to *start* with "amzn mktp".
+
+We compile each Rule once, pull the literal prefixes out of its regular
+expressions and file the Rule under those prefixes.  For an entry we then only
+look at the Rules whose prefixes the entry actually starts with.  A regex
+starting with ``.*`` has no prefix, but any literal after it still has to
+appear somewhere in the value, so those are filed on that literal instead.
+Anything we can't reason about (odd regex constructs) is always checked, so
+the result is exactly the same as a linear scan over the rules.
+
+Rules with a ``match-account`` are also sharded on the accounts they can
+match.  Given the accounts opened in the ledger we work out, once, which of
+those Rules can match each account, and skip the others for an entry whose
+eligible posting is in that account.
+
+    index = RuleIndex(rules, accounts=opened_accounts)
+    new_entry, modified = index.apply(entry)
+
+"""
+import logging
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:  # pragma: no cover
+    import sre_parse
+
+from coolbeans.rule import Rule, MatchRule, EntryView
+
+
+logger = logging.getLogger(__name__)
+
+
+# Stop expanding alternations (a|b|c) after this many prefixes
+MAX_PREFIXES = 64
+
+# Only plain ASCII literals are safe to compare after folding. Under re.I
+# these match exactly the characters that rule.fold() maps back onto them.
+SAFE_LITERALS = frozenset(chr(c) for c in range(0x20, 0x7f))
+
+FieldKey = Tuple[str, str, Optional[str]]
+
+# (position, match_values) of every Rule applied to an entry
+Applied = List[Tuple[int, dict]]
+
+# The field match-account looks at, and its MatchRule.key
+ACCOUNT_KEY: FieldKey = ('posting', 'account', None)
+ACCOUNT_RULE_KEY = 'posting-account'
+
+
+def _sequence_prefixes(items) -> Tuple[Set[str], bool]:
+    """Walk a parsed regex sequence.
+
+    Returns the set of literal prefixes any match has to start with and
+    whether the whole sequence was consumed (so the caller can keep
+    appending to the prefixes).
+    """
+    result = {""}
+    for op, av in items:
+        if op is sre_parse.LITERAL:
+            char = chr(av)
+            if char not in SAFE_LITERALS:
+                return result, False
+            result = {p + char.lower() for p in result}
+        elif op is sre_parse.AT:
+            # Zero width, doesn't consume anything
+            continue
+        elif op is sre_parse.SUBPATTERN:
+            sub_prefixes, complete = _sequence_prefixes(av[-1])
+            result = {p + s for p in result for s in sub_prefixes}
+            if not complete:
+                return result, False
+        elif op is sre_parse.BRANCH:
+            alternatives = [_sequence_prefixes(alt) for alt in av[1]]
+            expanded = {
+                p + s for p in result for a, _ in alternatives for s in a
+            }
+            if len(expanded) > MAX_PREFIXES:
+                return result, False
+            result = expanded
+            if not all(complete for _, complete in alternatives):
+                return result, False
+        else:
+            return result, False
+
+        if len(result) > MAX_PREFIXES:
+            return {""}, False
+
+    return result, True
+
+
+def regex_prefixes(regex) -> Optional[Set[str]]:
+    """Find the folded literal prefixes a compiled regex needs to match.
+
+    Returns None if any string could match (at least as far as we can tell).
+    """
+    try:
+        parsed = sre_parse.parse(regex.pattern, regex.flags)
+    except Exception:
+        logger.debug(f"Unable to parse {regex.pattern}")
+        return None
+    prefixes, _ = _sequence_prefixes(list(parsed))
+    if not prefixes or "" in prefixes:
+        return None
+    return prefixes
+
+
+def regex_infixes(regex) -> Optional[Set[str]]:
+    """Literals one of which appears in any value ``.*foo`` matches.
+
+    A prefix is an infix too.  Returns None if we can't tell.
+    """
+    prefixes = regex_prefixes(regex)
+    if prefixes is not None:
+        return prefixes
+    try:
+        parsed = list(sre_parse.parse(regex.pattern, regex.flags))
+    except Exception:
+        return None
+    if not parsed:
+        return None
+    op, av = parsed[0]
+    if op not in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) or av[0] != 0:
+        return None
+    if [item[0] for item in av[2]] != [sre_parse.ANY]:
+        return None
+    infixes, _ = _sequence_prefixes(parsed[1:])
+    if not infixes or "" in infixes:
+        return None
+    return infixes
+
+
+def match_rule_infixes(match_rule: MatchRule) -> Optional[Set[str]]:
+    result = set()
+    for regex in match_rule.regular_expressions:
+        infixes = regex_infixes(regex)
+        if infixes is None:
+            return None
+        result.update(infixes)
+    return result or None
+
+
+def match_rule_key(match_rule: MatchRule) -> FieldKey:
+    """The field of an entry match_rule looks at"""
+    return (match_rule.directive, match_rule.parameter, match_rule.meta_key)
+
+
+def match_rule_prefixes(match_rule: MatchRule) -> Optional[Set[str]]:
+    """A MatchRule matches if any of it's regular expressions match."""
+    result = set()
+    for regex in match_rule.regular_expressions:
+        prefixes = regex_prefixes(regex)
+        if prefixes is None:
+            return None
+        result.update(prefixes)
+    return result or None
+
+
+class PrefixTable:
+    """Rule positions filed by the literal prefix of a single field"""
+
+    def __init__(self):
+        # prefix -> positions, and the distinct prefix lengths to try
+        self.prefixes: Dict[str, List[int]] = {}
+        self.lengths: List[int] = []
+        self.positions: List[int] = []
+
+    def add(self, prefixes: Iterable[str], position: int):
+        for prefix in prefixes:
+            self.prefixes.setdefault(prefix, []).append(position)
+        self.lengths = sorted(
+            set(self.lengths).union(len(p) for p in prefixes))
+        self.positions.append(position)
+
+    def lookup(self, folded, found: Set[int]):
+        """Add the positions of Rules that could match a folded value"""
+        if folded is None:
+            # MatchRule.match_entry never matches a missing value
+            return
+        if not isinstance(folded, str):
+            # Can't reason about these, let the rules decide
+            found.update(self.positions)
+            return
+
+        # One dict lookup per prefix length, however many prefixes share
+        # a start
+        size = len(folded)
+        for length in self.lengths:
+            if length > size:
+                break
+            positions = self.prefixes.get(folded[:length])
+            if positions:
+                found.update(positions)
+
+
+class InfixTable:
+    """Rule positions with literals that have to appear in a single field"""
+
+    def __init__(self):
+        self.infixes: List[Tuple[Tuple[str, ...], int]] = []
+        self.positions: List[int] = []
+
+    def add(self, infixes: Iterable[str], position: int):
+        self.infixes.append((tuple(sorted(infixes)), position))
+        self.positions.append(position)
+
+    def lookup(self, folded, found: Set[int]):
+        if folded is None:
+            return
+        if not isinstance(folded, str):
+            found.update(self.positions)
+            return
+        for infixes, position in self.infixes:
+            for infix in infixes:
+                if infix in folded:
+                    found.add(position)
+                    break
+
+
+class AccountShards:
+    """Rule positions with a match-account, keyed on the accounts they match
+
+    An account's shard is only worked out the first time it's looked up, so
+    we never run every match-account regex over every opened account.  The
+    shards stay valid for as long as the RuleIndex lives, see IndexCache.
+    """
+
+    # position -> the Rule's match-account MatchRule
+    match_rules: Dict[int, MatchRule]
+    accounts: FrozenSet[str]
+    shards: Dict[str, FrozenSet[int]]
+
+    def __init__(self, accounts: Iterable[str] = ()):
+        self.match_rules = {}
+        self.accounts = frozenset(accounts)
+        self.shards = {}
+        # Number of accounts we ran the match-account regexes over
+        self.computed = 0
+
+    def __len__(self):
+        return len(self.match_rules)
+
+    def __contains__(self, position: int):
+        return position in self.match_rules
+
+    def add(self, position: int, match_rule: MatchRule):
+        self.match_rules[position] = match_rule
+        # Only the new Rule has to be checked against the accounts we've seen
+        regexes = match_rule.regular_expressions
+        for account, shard in self.shards.items():
+            if any(regex.match(account) for regex in regexes):
+                self.shards[account] = shard | {position}
+
+    def set_accounts(self, accounts: Iterable[str]):
+        """The opened accounts, shards of any other account are dropped"""
+        accounts = frozenset(accounts)
+        if accounts != self.accounts:
+            self.accounts = accounts
+            self.shards = {
+                a: shard for a, shard in self.shards.items() if a in accounts
+            }
+
+    def matching(self, account: str) -> FrozenSet[int]:
+        """Positions of the Rules whose match-account matches account"""
+        self.computed += 1
+        return frozenset(
+            position for position, match_rule in self.match_rules.items()
+            if any(regex.match(account)
+                   for regex in match_rule.regular_expressions)
+        )
+
+    def lookup(self, account) -> FrozenSet[int]:
+        if account is None:
+            # MatchRule.match_entry never matches a missing value
+            return frozenset()
+        shard = self.shards.get(account, None)
+        if shard is None:
+            shard = self.shards[account] = self.matching(account)
+        return shard
+
+
+class RuleIndex:
+    """Dispatch table over a list of Rules, in their original order."""
+
+    rules: List[Rule]
+    always: List[int]
+    tables: Dict[FieldKey, PrefixTable]
+    infix_tables: Dict[FieldKey, InfixTable]
+    account_shards: AccountShards
+
+    def __init__(
+            self,
+            rules: Iterable[Rule],
+            stats=None,
+            accounts: Iterable[str] = ()):
+        """
+        Args:
+            rules: the Rules, in the order they should be applied
+            stats: optional MatchStatistics, sized for the rules
+            accounts: the opened accounts, see set_accounts
+        """
+        self.stats = stats
+        self.rules = []
+        self.always = []
+        self.tables = {}
+        self.infix_tables = {}
+        self.account_shards = AccountShards(accounts)
+        for rule in rules:
+            self.add_rule(rule)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def add_rule(self, rule: Rule):
+        position = len(self.rules)
+        self.rules.append(rule)
+
+        # All of a Rule's MatchRules have to match, so we only need to
+        # file it under one of them.  Pick the most selective.  The account
+        # is always checked by the AccountShards, so leave that out.
+        best_key, best_prefixes = None, None
+        for match_rule in rule.match_requirements.values():
+            if match_rule.key == ACCOUNT_RULE_KEY:
+                continue
+            prefixes = match_rule_prefixes(match_rule)
+            if prefixes is None:
+                continue
+            length = min(map(len, prefixes))
+            if best_prefixes is None or length > min(map(len, best_prefixes)):
+                best_key = match_rule_key(match_rule)
+                best_prefixes = prefixes
+
+        if best_prefixes is not None:
+            table = self.tables.setdefault(best_key, PrefixTable())
+            table.add(best_prefixes, position)
+        else:
+            self.add_infix_rule(rule, position)
+
+        account_rule = rule.match_requirements.get(ACCOUNT_RULE_KEY, None)
+        if account_rule is not None:
+            self.account_shards.add(position, account_rule)
+
+    def add_infix_rule(self, rule: Rule, position: int):
+        best_key, best_infixes = None, None
+        for match_rule in rule.match_requirements.values():
+            if match_rule.key == ACCOUNT_RULE_KEY:
+                continue
+            infixes = match_rule_infixes(match_rule)
+            if infixes is None:
+                continue
+            length = min(map(len, infixes))
+            if best_infixes is None or length > min(map(len, best_infixes)):
+                best_key = match_rule_key(match_rule)
+                best_infixes = infixes
+
+        if best_infixes is None:
+            self.always.append(position)
+        else:
+            table = self.infix_tables.setdefault(best_key, InfixTable())
+            table.add(best_infixes, position)
+
+    def set_accounts(self, accounts: Iterable[str]):
+        """The accounts to shard match-account Rules on, usually the Opens"""
+        self.account_shards.set_accounts(accounts)
+
+    def candidates(
+            self,
+            entry,
+            start: int = 0,
+            view: EntryView = None) -> List[int]:
+        """Return the sorted positions of Rules that could match entry"""
+        if view is None:
+            view = EntryView(entry)
+        found = set(self.always)
+        for key, table in self.tables.items():
+            table.lookup(view.get_folded(*key), found)
+        for key, table in self.infix_tables.items():
+            table.lookup(view.get_folded(*key), found)
+
+        shards = self.account_shards
+        if len(shards):
+            allowed = shards.lookup(view.get(*ACCOUNT_KEY))
+            return sorted(
+                p for p in found
+                if p >= start and (p in allowed or p not in shards)
+            )
+        return sorted(p for p in found if p >= start)
+
+    def apply(self, entry) -> Tuple[object, bool]:
+        """Check entry against the Rules in order, modifying it on every match.
+
+        This gives the same result as running each Rule.check/modify_entry
+        in turn.
+        """
+        entry, applied = self.match_all(entry)
+        return entry, bool(applied)
+
+    def apply_many(
+            self,
+            entries: List,
+            match_many=None) -> List[Tuple[object, bool]]:
+        """apply() over a list of entries, maybe with another match_many"""
+        match_many = match_many or self.match_many
+        return [
+            (entry, bool(applied)) for entry, applied in match_many(entries)
+        ]
+
+    def match_many(self, entries: Iterable) -> List[Tuple[object, Applied]]:
+        """match_all() over a list of entries"""
+        return [self.match_all(entry) for entry in entries]
+
+    def match_all(self, entry) -> Tuple[object, Applied]:
+        """Like apply, but also return the (position, match_values) of every
+        Rule we applied, so the result can be replayed later."""
+        applied = []
+        view = EntryView(entry)
+        candidates = self.candidates(entry, view=view)
+        i = 0
+        while i < len(candidates):
+            position = candidates[i]
+            i += 1
+            rule = self.rules[position]
+            if self.stats is None:
+                match_values = rule.check(entry, view=view)
+            else:
+                match_values = self.stats.check(
+                    position, rule, entry, view=view)
+            if match_values is None:
+                continue
+            entry = rule.modify_entry(entry, match_values)
+            applied.append((position, match_values))
+
+            # The entry changed, so later Rules might see something else
+            view = EntryView(entry)
+            candidates = self.candidates(entry, start=position + 1, view=view)
+            i = 0
+
+        return entry, applied
+
+    def replay(self, entry, applied: Applied):
+        """Re-apply the result of match_all to an identical entry"""
+        for position, match_values in applied:
+            entry = self.rules[position].modify_entry(entry, match_values)
+        return entry
+
+
+class IndexCache:
+    """Keeps the RuleIndex between runs of match_directives
+
+    Fava reloads the ledger on every save.  As long as the rules are the same
+    version we keep the same RuleIndex, and with it the account shards and
+    prefix tables.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.index = None
+        self.hits = 0
+
+    def get(
+            self,
+            version: str,
+            rules: Iterable[Rule],
+            stats=None,
+            accounts: Iterable[str] = ()) -> RuleIndex:
+        if self.index is None or version != self.version:
+            self.index = RuleIndex(rules, accounts=accounts)
+            self.version = version
+        else:
+            self.hits += 1
+            self.index.set_accounts(accounts)
+        # Statistics are per run
+        self.index.stats = stats
+        return self.index
+
+
+# Shared by every run of match_directives, like INCREMENTAL_MATCHER
+INDEX_CACHE = IndexCache()
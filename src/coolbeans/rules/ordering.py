@@ -0,0 +1,91 @@
+"""
+Adaptive Rule ordering for first-match lookups.
+
+Matcher.match returns the first Rule that matches, so trying the Rules that
+hit most often first saves checking the rest.  Re-ordering can change which
+Rule wins though, so only Rules flagged as commuting are moved:
+
+    - match-narration: AMZN Mktp.*
+      set-posting-account: Expenses:Shopping
+      commutes: true
+
+Consecutive commuting Rules are sorted by their historical hit rate; every
+other Rule keeps its position and acts as a barrier.  The history is kept in
+a small JSON file, keyed on Rule.signature, so it survives between runs.
+"""
+import json
+import logging
+import pathlib
+from typing import Dict, List, Optional, Union
+
+from coolbeans.rule import Rule
+
+
+logger = logging.getLogger(__name__)
+
+
+ORDERINGS = ('file', 'adaptive')
+
+
+class RuleHistory:
+    """Attempts and hits per Rule signature"""
+
+    # signature -> [attempts, hits]
+    counts: Dict[str, List[int]]
+
+    def __init__(self, file: Union[str, pathlib.Path, None] = None):
+        self.file = pathlib.Path(file).expanduser() if file else None
+        self.counts = {}
+        if self.file and self.file.exists():
+            self.load()
+
+    def load(self):
+        try:
+            with self.file.open("r") as stream:
+                counts = json.load(stream)
+            self.counts = {k: list(v) for k, v in counts.items()}
+        except (OSError, ValueError):
+            logger.warning(f"Ignoring unreadable rule history {self.file}")
+            self.counts = {}
+
+    def save(self):
+        if not self.file:
+            return
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        with self.file.open("w") as stream:
+            json.dump(self.counts, stream)
+
+    def record(self, signature: str, hit: bool):
+        counts = self.counts.setdefault(signature, [0, 0])
+        counts[0] += 1
+        if hit:
+            counts[1] += 1
+
+    def rate(self, signature: str) -> float:
+        """Smoothed hit rate, so unseen Rules land in the middle"""
+        attempts, hits = self.counts.get(signature, (0, 0))
+        return (hits + 1) / (attempts + 2)
+
+
+def adaptive_order(
+        rules: List[Rule],
+        history: Optional[RuleHistory]) -> List[Rule]:
+    """Sort each run of consecutive commuting Rules by descending hit rate"""
+    if history is None:
+        return list(rules)
+
+    def by_rate(rule: Rule) -> float:
+        return history.rate(rule.signature)
+
+    result = []
+    block = []
+    for rule in rules:
+        if rule.commutes:
+            block.append(rule)
+            continue
+        # sorted() is stable, so ties keep their file order
+        result.extend(sorted(block, key=by_rate, reverse=True))
+        block = []
+        result.append(rule)
+    result.extend(sorted(block, key=by_rate, reverse=True))
+    return result
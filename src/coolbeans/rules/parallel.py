@@ -0,0 +1,96 @@
+"""
+Match large batches of pending entries on a process pool.
+
+Matching is plain CPU work on independent entries, so a bulk back-import of
+a few years can be spread across all cores.  Each worker gets the Rules once,
+when it starts, and sends back only which Rules matched each entry.  We then
+replay those on the original entries, in their original order.
+
+Small batches (a normal fava reload) stay in this process, starting a pool
+costs more than it saves:
+
+    2020-01-01 custom "coolbeans" "match-workers" "8"
+    2020-01-01 custom "coolbeans" "match-parallel-threshold" "20000"
+
+"""
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+from coolbeans.rules.index import Applied, RuleIndex
+
+
+logger = logging.getLogger(__name__)
+
+
+# Below this many pending entries we don't bother with a pool
+DEFAULT_THRESHOLD = 20000
+
+# Each worker's copy of the index, see _init_worker
+_WORKER_INDEX: Optional[RuleIndex] = None
+
+
+def _init_worker(rules, accounts):
+    global _WORKER_INDEX
+    _WORKER_INDEX = RuleIndex(rules, accounts=accounts)
+
+
+def _match_chunk(entries) -> List[Applied]:
+    return [_WORKER_INDEX.match_all(entry)[1] for entry in entries]
+
+
+class ParallelMatcher:
+    """A drop-in match_many for RuleIndex, sharding entries over processes"""
+
+    def __init__(
+            self,
+            index: RuleIndex,
+            workers: Optional[int] = None,
+            threshold: int = DEFAULT_THRESHOLD,
+            chunk_size: Optional[int] = None):
+        self.index = index
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.workers = workers
+        self.threshold = threshold
+        self.chunk_size = chunk_size
+
+    def use_pool(self, count: int) -> bool:
+        # Statistics are collected in-process, so they need the serial path
+        if self.index.stats is not None:
+            return False
+        return self.workers > 1 and count >= self.threshold
+
+    def match_many(self, entries: List) -> List[Tuple[object, Applied]]:
+        entries = list(entries)
+        if not self.use_pool(len(entries)):
+            return self.index.match_many(entries)
+
+        # A few chunks per worker keeps them busy if some chunks are slower
+        chunk_size = self.chunk_size
+        if not chunk_size:
+            chunk_size = max(1, -(-len(entries) // (self.workers * 4)))
+        chunks = [
+            entries[i:i + chunk_size]
+            for i in range(0, len(entries), chunk_size)
+        ]
+        logger.info(
+            f"Matching {len(entries)} entries on {self.workers} processes "
+            f"in {len(chunks)} chunks"
+        )
+
+        with ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(
+                    self.index.rules,
+                    self.index.account_shards.accounts,
+                )) as pool:
+            chunk_results = list(pool.map(_match_chunk, chunks))
+
+        results = []
+        for chunk, applied_list in zip(chunks, chunk_results):
+            for entry, applied in zip(chunk, applied_list):
+                results.append((self.index.replay(entry, applied), applied))
+        return results
@@ -0,0 +1,209 @@
+"""
+Rules written inline in the ledger, see the matcher module docstring.
+
+Besides the rules files, a rule can be a custom directive holding YAML:
+
+    2016-06-14 custom "matcher" "rule" "
+      match-narration: (?P<payee>AirBnB).*
+      match-account: Assets:.*
+      set-posting-account: Income:AirBnB
+    "
+
+or a categorized transaction with match-* meta, used as a template for the
+pending entries it matches:
+
+    2019-09-11 * "AirBnB" "Deposit - AIRBNB PAYMENTS"
+      match-narration: "(?P<payee>AirBnB).*"
+      * Assets:Banking:BofA:Checking   1039.80 USD
+      * Income:AirBnB                 -1039.80 USD
+
+The RuleRegistry keeps every Rule it compiled, keyed on the rule dict it came
+from.  Fava reloads the ledger on every save, and an unchanged directive or
+template gets its Rule back without compiling a single regex.
+"""
+import json
+import hashlib
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from beancount.core import data
+
+from coolbeans.utils import yaml_load
+from coolbeans.rule import Rule, is_rule_option
+from coolbeans.rules.analyzer import UnsafeRegexError
+
+
+logger = logging.getLogger(__name__)
+
+
+# In the order their Rules are tried, after any rules files
+SOURCES = ('file', 'custom', 'meta')
+
+CUSTOM_TYPE = 'matcher'
+CUSTOM_RULE = 'rule'
+
+
+def custom_rule_dicts(entry: data.Custom) -> List[dict]:
+    """The rule dicts in a custom "matcher" "rule" directive"""
+    if len(entry.values) < 2:
+        raise ValueError("Expected the YAML of a rule after \"rule\"")
+    value = yaml_load(entry.values[1].value)
+    rule_dicts = value if isinstance(value, list) else [value]
+    for rule_dict in rule_dicts:
+        if not isinstance(rule_dict, dict):
+            raise ValueError(f"Expected a rule dict, not {rule_dict!r}")
+    return rule_dicts
+
+
+def has_rule_meta(entry: data.Transaction) -> bool:
+    # match-key(-N) is an option, imported entries carry it and aren't rules
+    for key in entry.meta:
+        if key.startswith('match-') and not is_rule_option(key):
+            return True
+    return False
+
+
+def posting_account(entry: data.Transaction) -> Optional[str]:
+    """The categorized account of a template, whatever order it's written in
+
+    An Expenses posting wins, like it always has.  Failing that the last
+    posting outside of Assets and Liabilities, say Income:AirBnB on a deposit.
+    """
+    account = None
+    for posting in entry.postings:
+        if posting.account.startswith('Expenses'):
+            return posting.account
+        if not posting.account.startswith(('Assets', 'Liabilities')):
+            account = posting.account
+    return account
+
+
+def meta_rule_dict(entry: data.Transaction) -> dict:
+    """Use a categorized Transaction with match-* meta as a template"""
+    rule_dict = {}
+    if entry.payee:
+        rule_dict['set-payee'] = entry.payee
+    if len(entry.tags or ()) == 1:
+        # A set-tags rule adds a single tag
+        rule_dict['set-tags'] = next(iter(entry.tags))
+    account = posting_account(entry)
+    if account:
+        rule_dict['set-posting-account'] = account
+
+    for key, value in entry.meta.items():
+        if is_rule_option(key):
+            continue
+        if key.startswith('match-') or key.startswith('set-'):
+            rule_dict[key] = value
+    return rule_dict
+
+
+def location(entry: data.Directive) -> str:
+    return f"{entry.meta.get('filename')}:{entry.meta.get('lineno')}"
+
+
+def rule_key(source: str, rule_dict: dict) -> str:
+    return source + ":" + json.dumps(rule_dict, sort_keys=True, default=str)
+
+
+class RuleRegistry:
+    """Every Rule, by source, only compiling the inline ones that changed"""
+
+    # rule key -> compiled Rule, for every inline rule of the last update
+    compiled: Dict[str, Rule]
+    # source -> [(rule key, Rule)], in ledger order
+    sources: Dict[str, List[Tuple[str, Rule]]]
+
+    def __init__(self):
+        self.compiled = {}
+        self.sources = {source: [] for source in SOURCES}
+        self.reused = 0
+        self.built = 0
+
+    def set_file_rules(self, rules: Iterable[Rule]):
+        """The Rules of the rules files, RulesCache does their caching"""
+        self.sources['file'] = [(None, rule) for rule in rules]
+
+    def inline_rule_dicts(
+            self,
+            entries: Iterable[data.Directive],
+    ) -> Iterable[Tuple[str, data.Directive, dict]]:
+        """Yields (source, entry, rule dict) for every inline rule"""
+        for entry in entries:
+            if isinstance(entry, data.Custom):
+                if entry.type != CUSTOM_TYPE or not entry.values:
+                    continue
+                if entry.values[0].value != CUSTOM_RULE:
+                    continue
+                try:
+                    rule_dicts = custom_rule_dicts(entry)
+                except ValueError as exc:
+                    logger.error(f"Invalid rule at {location(entry)}: {exc}")
+                    continue
+                for rule_dict in rule_dicts:
+                    yield 'custom', entry, rule_dict
+            elif isinstance(entry, data.Transaction):
+                # Pending entries are what we match, not templates
+                if entry.flag == '!' or not entry.meta:
+                    continue
+                if not has_rule_meta(entry):
+                    continue
+                yield 'meta', entry, meta_rule_dict(entry)
+
+    def update(self, entries: Iterable[data.Directive], analyzer=None):
+        """Pick up the inline rules in entries, re-using unchanged Rules"""
+        compiled = {}
+        sources = {source: [] for source in SOURCES if source != 'file'}
+        self.reused = self.built = 0
+
+        for source, entry, rule_dict in self.inline_rule_dicts(entries):
+            key = rule_key(source, rule_dict)
+            rule = compiled.get(key, None) or self.compiled.get(key, None)
+            if rule is not None:
+                self.reused += 1
+            else:
+                try:
+                    rule = Rule(rule_dict, analyzer=analyzer)
+                except UnsafeRegexError as exc:
+                    # Not kept, the analyzer may well accept it next time
+                    logger.error(
+                        f"Rejected {source} rule at {location(entry)}: {exc}")
+                    continue
+                except (ValueError, AssertionError) as exc:
+                    logger.error(
+                        f"Invalid {source} rule at {location(entry)}: {exc}")
+                    continue
+                self.built += 1
+            compiled[key] = rule
+            sources[source].append((key, rule))
+
+        # Drop whatever was edited or removed since the last update
+        self.compiled = compiled
+        self.sources.update(sources)
+        logger.info(
+            f"Rules by source: {self.counts()}, "
+            f"{self.built} compiled, {self.reused} re-used"
+        )
+
+    @property
+    def rules(self) -> List[Rule]:
+        return [rule for source in SOURCES for _, rule in self.sources[source]]
+
+    def counts(self) -> Dict[str, int]:
+        """Number of Rules from each source"""
+        return {source: len(self.sources[source]) for source in SOURCES}
+
+    def version(self) -> str:
+        """A hash over the inline rules, in order"""
+        digest = hashlib.sha256()
+        for source in SOURCES:
+            if source == 'file':
+                continue
+            for key, _ in self.sources[source]:
+                digest.update(key.encode('utf-8'))
+                digest.update(b"\n")
+        return digest.hexdigest()
+
+
+# Shared by every run of match_directives, like INCREMENTAL_MATCHER
+RULE_REGISTRY = RuleRegistry()
@@ -0,0 +1,211 @@
+"""
+Optional statistics on Rule matching.
+
+Nothing is collected unless a collector is handed to the RuleIndex, so
+the normal path doesn't pay for it.  Counters are kept per Rule position in
+fixed size arrays, and near-misses (a Rule where one field matched but a later
+one did not) are sampled into a bounded queue.
+
+Enable it in the ledger:
+
+    2020-01-01 custom "coolbeans" "match-statistics" "true"
+    2020-01-01 custom "coolbeans" "match-near-misses" "100"
+
+Only one out of every match-near-miss-rate near-misses is kept, 1 by default:
+
+    2020-01-01 custom "coolbeans" "match-near-miss-rate" "10"
+
+The MatchProfiler also times every regular expression and writes a report
+next to the output-file (matched.profile.yaml), with the most expensive Rules
+first:
+
+    2020-01-01 custom "coolbeans" "match-profile" "yaml"
+
+"""
+import json
+import time
+import pathlib
+import logging
+import statistics
+import collections
+from array import array
+from typing import Deque, Dict, List, NamedTuple, Optional
+
+import yaml
+
+from coolbeans.rule import Rule, MatchRule, EntryView
+
+
+logger = logging.getLogger(__name__)
+
+
+class NearMiss(NamedTuple):
+    position: int
+    field: str
+    value: str
+
+
+class MatchStatistics:
+    """Per-Rule attempts, hits and time spent in Rule.check"""
+
+    attempts: array
+    hits: array
+    seconds: array
+    near_misses: Optional[Deque[NearMiss]]
+
+    def __init__(
+            self,
+            size: int,
+            near_miss_size: int = 0,
+            near_miss_rate: int = 1):
+        """
+        Args:
+            size: the number of Rules
+            near_miss_size: how many near-misses to keep, 0 to disable
+            near_miss_rate: keep one out of this many near-misses
+        """
+        self.attempts = array('Q', bytes(8 * size))
+        self.hits = array('Q', bytes(8 * size))
+        self.seconds = array('d', bytes(8 * size))
+
+        self.near_misses = None
+        if near_miss_size:
+            self.near_misses = collections.deque(maxlen=near_miss_size)
+        self.near_miss_rate = max(1, near_miss_rate)
+        self.near_miss_count = 0
+
+        # Set while inside check(), so the near-miss callback knows the slot
+        self._position = 0
+
+        # Optional callable(regex, seconds), see MatchRule.match_entry
+        self.on_regex = None
+
+    def __len__(self):
+        return len(self.attempts)
+
+    def _near_miss(self, rule: Rule, match_rule: MatchRule, entry):
+        self.near_miss_count += 1
+        if self.near_miss_count % self.near_miss_rate:
+            return
+        value = match_rule.extract_value(entry)
+        self.near_misses.append(
+            NearMiss(self._position, match_rule.key, str(value)[:80]))
+
+    def check(self, position: int, rule: Rule, entry, view: EntryView = None):
+        """Same as rule.check(entry), counting the result"""
+        on_near_miss = None
+        if self.near_misses is not None:
+            self._position = position
+            on_near_miss = self._near_miss
+
+        start = time.perf_counter()
+        result = rule.check(
+            entry, on_near_miss=on_near_miss, on_regex=self.on_regex,
+            view=view,
+        )
+        self.seconds[position] += time.perf_counter() - start
+
+        self.attempts[position] += 1
+        if result is not None:
+            self.hits[position] += 1
+        return result
+
+    def summary(self, top: int = 10) -> List[str]:
+        """Lines describing the most expensive Rules"""
+        positions = sorted(
+            range(len(self)), key=lambda p: self.seconds[p], reverse=True)
+        lines = []
+        for position in positions[:top]:
+            lines.append(
+                f"rule {position}: {self.attempts[position]} attempts, "
+                f"{self.hits[position]} hits, "
+                f"{self.seconds[position] * 1000:.2f}ms"
+            )
+        return lines
+
+
+class MatchProfiler(MatchStatistics):
+    """MatchStatistics that also times each regular expression"""
+
+    # pattern -> [calls, total seconds, worst seconds]
+    regexes: Dict[str, list]
+
+    # A regex is an outlier if its worst call is this many times the median
+    # worst call
+    OUTLIER_FACTOR = 10.0
+    # ...and slower than this
+    OUTLIER_MIN_SECONDS = 0.001
+
+    def __init__(self, size: int, **kwds):
+        super().__init__(size, **kwds)
+        self.regexes = {}
+        self.on_regex = self._on_regex
+
+    def _on_regex(self, regex, seconds: float):
+        timing = self.regexes.get(regex.pattern, None)
+        if timing is None:
+            timing = self.regexes[regex.pattern] = [0, 0.0, 0.0]
+        timing[0] += 1
+        timing[1] += seconds
+        if seconds > timing[2]:
+            timing[2] = seconds
+
+    def outliers(self) -> List[str]:
+        """Patterns whose worst-case time per call stands out"""
+        if not self.regexes:
+            return []
+        median = statistics.median(t[2] for t in self.regexes.values())
+        limit = max(median * self.OUTLIER_FACTOR, self.OUTLIER_MIN_SECONDS)
+        return [pattern for pattern, t in self.regexes.items() if t[2] > limit]
+
+    def report(self, rules: List[Rule]) -> dict:
+        """A dict describing every Rule and the slow regular expressions"""
+        rule_reports = []
+        for position, rule in enumerate(rules):
+            rule_reports.append({
+                'position': position,
+                'match': {
+                    key: sorted(
+                        r.pattern for r in match_rule.regular_expressions)
+                    for key, match_rule in rule.match_requirements.items()
+                },
+                'evaluations': self.attempts[position],
+                'hits': self.hits[position],
+                'seconds': round(self.seconds[position], 6),
+                'dead': self.hits[position] == 0,
+            })
+        rule_reports.sort(key=lambda r: r['seconds'], reverse=True)
+
+        outliers = set(self.outliers())
+        regex_reports = [
+            {
+                'pattern': pattern,
+                'calls': calls,
+                'seconds': round(total, 6),
+                'worst': round(worst, 6),
+                'outlier': pattern in outliers,
+            }
+            for pattern, (calls, total, worst) in self.regexes.items()
+        ]
+        regex_reports.sort(key=lambda r: r['worst'], reverse=True)
+
+        return {'rules': rule_reports, 'regexes': regex_reports}
+
+    def write_report(
+            self,
+            rules: List[Rule],
+            output_file: pathlib.Path,
+            format: str = 'yaml') -> pathlib.Path:
+        """Write the report next to output_file, returns the report's path"""
+        format = 'json' if format == 'json' else 'yaml'
+        report_file = output_file.with_name(
+            f"{output_file.stem}.profile.{format}")
+        report = self.report(rules)
+        with report_file.open("w") as stream:
+            if format == 'json':
+                json.dump(report, stream, indent=2)
+            else:
+                yaml.safe_dump(report, stream, sort_keys=False)
+        logger.info(
+            f"Wrote match profile for {len(rules)} rules to {report_file}")
+        return report_file
@@ -0,0 +1,159 @@
+"""
+Match staged .bean files a chunk at a time, see matcher.main (cool-match).
+
+The plugin path loads the whole ledger and runs every plugin before we get to
+see a single entry.  For a large staged import we only need the entries in
+that file, so we split it into chunks of dated entries, parse each chunk on
+its own, match its pending entries and print it before reading the next:
+
+    cool-match --rules rules.yaml staged.bean -o matched.bean
+
+Memory use is bounded by the chunk size, not the size of the file.  Chunks
+are only split on a line starting with a date, and any pushtag still open is
+carried into the next chunk.  The options and plugins of the staged file are
+not applied.
+"""
+import re
+import sys
+import logging
+from typing import Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from beancount.core.display_context import DisplayContext
+from beancount.parser import parser
+from beancount.parser.printer import print_entries, print_errors
+
+from coolbeans.rules.index import RuleIndex
+
+
+logger = logging.getLogger(__name__)
+
+
+# Number of dated entries in a chunk
+DEFAULT_CHUNK_SIZE = 1000
+
+ENTRY_START_RE = re.compile(r"\d{4}[-/]\d{2}[-/]\d{2}\s")
+PUSHTAG_RE = re.compile(r"(push|pop)tag\s+#(\S+)")
+
+
+class Chunk:
+    """Some lines of a file, ready to be parsed on their own"""
+    __slots__ = ('filename', 'lineno', 'lines', 'tags', 'open_tags')
+
+    def __init__(self, filename: str, lineno: int, tags: List[str]):
+        self.filename = filename
+        self.lineno = lineno
+        self.lines = []
+        # Tags pushed before the start of this chunk
+        self.tags = list(tags)
+        # Tags still pushed at the end of this chunk
+        self.open_tags = []
+
+    def text(self) -> str:
+        return "".join(self.lines)
+
+    def parse(self) -> Tuple[list, list]:
+        prefix = "".join(f"pushtag #{tag}\n" for tag in self.tags)
+        suffix = "".join(
+            f"poptag #{tag}\n" for tag in reversed(self.open_tags))
+        entries, errors, _ = parser.parse_string(
+            prefix + self.text() + "\n" + suffix,
+            report_filename=self.filename,
+            report_firstline=self.lineno - len(self.tags),
+        )
+        return entries, errors
+
+
+def iter_chunks(
+        stream: TextIO,
+        filename: str = '<stdin>',
+        chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Chunk]:
+    """Split a beancount file into Chunks of about chunk_size entries"""
+    tags: List[str] = []
+    chunk = Chunk(filename, 1, tags)
+    count = 0
+    for lineno, line in enumerate(stream, 1):
+        if ENTRY_START_RE.match(line):
+            if count >= chunk_size:
+                chunk.open_tags = list(tags)
+                yield chunk
+                chunk = Chunk(filename, lineno, tags)
+                count = 0
+            count += 1
+        else:
+            match = PUSHTAG_RE.match(line)
+            if match:
+                # Tags still open at the next boundary are pushed again there
+                if match.group(1) == 'push':
+                    tags.append(match.group(2))
+                elif match.group(2) in tags:
+                    tags.remove(match.group(2))
+        chunk.lines.append(line)
+    if chunk.lines:
+        chunk.open_tags = list(tags)
+        yield chunk
+
+
+def match_chunks(
+        chunks: Iterable[Chunk],
+        index: RuleIndex) -> Iterator[Tuple[list, list, int]]:
+    """Yields (entries, errors, number matched) for each Chunk"""
+    for chunk in chunks:
+        entries, errors = chunk.parse()
+        pending = [
+            entry for entry in entries if getattr(entry, 'flag', None) == '!'
+        ]
+        results = iter(index.apply_many(pending))
+        matched = 0
+        output = []
+        for entry in entries:
+            if getattr(entry, 'flag', None) == '!':
+                entry, modified = next(results)
+                if modified:
+                    matched += 1
+            output.append(entry)
+        yield output, errors, matched
+
+
+def match_files(
+        files: List[str],
+        index: RuleIndex,
+        output: TextIO,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        errors_output: Optional[TextIO] = None) -> Tuple[int, int, int]:
+    """Match and print every entry of files
+
+    Returns (entries, matched, errors).
+    """
+    dcontext = DisplayContext()
+    dcontext.set_commas(True)
+    errors_output = errors_output or sys.stderr
+
+    totals = [0, 0, 0]
+    for file_name in files:
+        if file_name == '-':
+            chunks = iter_chunks(sys.stdin, chunk_size=chunk_size)
+            totals = _write(
+                match_chunks(chunks, index),
+                output, dcontext, errors_output, totals,
+            )
+            continue
+        with open(file_name, "r") as stream:
+            chunks = iter_chunks(
+                stream, filename=file_name, chunk_size=chunk_size)
+            totals = _write(
+                match_chunks(chunks, index),
+                output, dcontext, errors_output, totals,
+            )
+    return tuple(totals)
+
+
+def _write(results, output, dcontext, errors_output, totals) -> list:
+    for entries, errors, matched in results:
+        if errors:
+            print_errors(errors, file=errors_output)
+        print_entries(entries, dcontext=dcontext, file=output)
+        output.flush()
+        totals[0] += len(entries)
+        totals[1] += matched
+        totals[2] += len(errors)
+    return totals
@@ -0,0 +1,190 @@
+"""
+Run the test cases embedded in rules files.
+
+Any rule can carry sample values it's expected to match:
+
+    - match-narration: AMZN Mktp.*
+      match-account: Liabilities:.*
+      set-posting-account: Expenses:Shopping
+      test-narration:
+        - AMZN Mktp US*L08746BB3
+        - amzn mktp us*2K3AB91Q2
+      test:
+        narration: AMZN Mktp US*123
+        account: Liabilities:CreditCard:Chase
+
+Each value of a test-<field> key is a case of its own.  A test dict (or a
+list of them) is one case per dict, and all of its fields have to match.
+
+We gather every case of every rule, group the values by field and check each
+field in one pass, so a few thousand rules are checked in well under a
+second:
+
+    cool-match --test --rules rules.yaml
+
+"""
+import time
+import logging
+import collections
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from coolbeans.rule import Rule, DirectiveAttribute, SUB_KEY_RE, match_any_re
+
+
+logger = logging.getLogger(__name__)
+
+
+class RuleTestCase(NamedTuple):
+    # Position of the Rule in the list given to run_tests
+    position: int
+    # Number of the case within the Rule
+    case: int
+    # MatchRule key -> sample value
+    values: Dict[str, object]
+
+
+class RuleTestFailure(NamedTuple):
+    position: int
+    case: int
+    key: str
+    value: object
+    reason: str
+
+
+class RuleTestReport(NamedTuple):
+    cases: int
+    failures: List[RuleTestFailure]
+    # position -> seconds spent on that Rule's cases
+    seconds: Dict[int, float]
+
+    @property
+    def ok(self) -> bool:
+        return not self.failures
+
+    def slowest(self, top: int = 10) -> List[Tuple[int, float]]:
+        slowest = sorted(
+            self.seconds.items(), key=lambda item: item[1], reverse=True)
+        return slowest[:top]
+
+
+def _failure_order(failure: RuleTestFailure) -> tuple:
+    return failure.position, failure.case, failure.key
+
+
+def _field_key(
+        directive: Optional[str],
+        parameter: str,
+        meta_key: Optional[str]) -> str:
+    """The same key as MatchRule.key"""
+    if directive is None:
+        directive = 'posting' if parameter == 'account' else 'transaction'
+    elif directive in ('tx', 'trans'):
+        directive = 'transaction'
+    elif directive == 'pst':
+        directive = 'posting'
+    key = f"{directive}-{parameter}"
+    if meta_key:
+        key += f"-{meta_key}"
+    return key
+
+
+def _dict_case(values: dict) -> Dict[str, object]:
+    case = {}
+    for name, value in values.items():
+        parsed = match_any_re(SUB_KEY_RE, name)
+        if parsed is None:
+            raise ValueError(f"Invalid test key {name}")
+        key = _field_key(
+            parsed.get('directive', None),
+            parsed['parameter'],
+            parsed.get('meta_key', None),
+        )
+        case[key] = value
+    return case
+
+
+def rule_test_cases(rule: Rule, position: int = 0) -> List[RuleTestCase]:
+    """The test cases of a Rule, from its test and test-<field> keys"""
+    cases = []
+    attr: DirectiveAttribute
+    for attr in rule.tests:
+        value = getattr(attr, 'value', None)
+        if attr.parameter is None:
+            for values in (value if isinstance(value, list) else [value]):
+                if not isinstance(values, dict):
+                    raise ValueError(
+                        f"A test needs a dict of fields, not {values!r}")
+                cases.append(_dict_case(values))
+        else:
+            key = _field_key(attr.directive, attr.parameter, attr.meta_key)
+            for sample in (value if isinstance(value, list) else [value]):
+                cases.append({key: sample})
+    return [
+        RuleTestCase(position, number, values)
+        for number, values in enumerate(cases)
+    ]
+
+
+def check_cases(
+        rules: Sequence[Tuple[int, Rule]],
+) -> Tuple[int, List[RuleTestFailure], Dict[int, float]]:
+    """Check the test cases of (position, Rule) pairs, one pass per field"""
+    by_field: Dict[str, List[Tuple[int, int, object]]]
+    by_field = collections.defaultdict(list)
+    rule_by_position = {}
+    count = 0
+    failures = []
+    for position, rule in rules:
+        rule_by_position[position] = rule
+        try:
+            cases = rule_test_cases(rule, position)
+        except ValueError as exc:
+            failures.append(RuleTestFailure(position, -1, '', None, str(exc)))
+            continue
+        count += len(cases)
+        for case in cases:
+            for key, value in case.values.items():
+                by_field[key].append((position, case.case, value))
+
+    seconds: Dict[int, float] = collections.defaultdict(float)
+    perf_counter = time.perf_counter
+    for key, samples in by_field.items():
+        for position, case, value in samples:
+            start = perf_counter()
+            rule = rule_by_position[position]
+            match_rule = rule.match_requirements.get(key, None)
+            if match_rule is None:
+                reason = f"no match-{key} to test"
+            elif not isinstance(value, str):
+                reason = f"expected a string, got {type(value).__name__}"
+            elif match_rule.match_value(value) is None:
+                reason = "no match"
+            else:
+                reason = None
+            seconds[position] += perf_counter() - start
+            if reason:
+                failures.append(
+                    RuleTestFailure(position, case, key, value, reason))
+
+    failures.sort(key=_failure_order)
+    return count, failures, dict(seconds)
+
+
+def run_tests(rules: List[Rule], workers: int = 1) -> RuleTestReport:
+    """Run every embedded test case, optionally over a process pool"""
+    numbered = list(enumerate(rules))
+    if workers <= 1 or len(numbered) < workers * 2:
+        return RuleTestReport(*check_cases(numbered))
+
+    size = -(-len(numbered) // workers)
+    chunks = [numbered[i:i + size] for i in range(0, len(numbered), size)]
+    cases, failures, seconds = 0, [], {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(check_cases, chunks)
+        for chunk_cases, chunk_failures, chunk_seconds in results:
+            cases += chunk_cases
+            failures.extend(chunk_failures)
+            seconds.update(chunk_seconds)
+    failures.sort(key=_failure_order)
+    return RuleTestReport(cases, failures, seconds)
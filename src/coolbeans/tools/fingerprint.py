@@ -0,0 +1,93 @@
+"""
+Stable fingerprints of beancount entries.
+
+entry_fingerprint covers everything a Rule can look at, entry_dedupe_key just
+what makes two entries in different files the same entry.
+
+The fingerprint only depends on the content of an entry, not on where it was
+loaded from, so the same transaction gets the same fingerprint between
+reloads even if it moved around in the file.
+"""
+import hashlib
+import typing
+
+from beancount.core import data
+
+
+# Meta keys that change without the entry changing
+VOLATILE_META = frozenset(('filename', 'lineno'))
+
+
+def _meta_items(meta: typing.Optional[dict]) -> tuple:
+    if not meta:
+        return ()
+    return tuple(sorted(
+        (key, repr(value)) for key, value in meta.items()
+        if key not in VOLATILE_META and not key.startswith('__')
+    ))
+
+
+def _posting_parts(posting: data.Posting) -> tuple:
+    return (
+        posting.account,
+        repr(posting.units),
+        repr(posting.cost),
+        repr(posting.price),
+        posting.flag,
+        _meta_items(posting.meta),
+    )
+
+
+def entry_fingerprint(entry: data.Transaction) -> str:
+    """Hash everything a Rule can look at on a Transaction"""
+    parts = (
+        entry.date.isoformat(),
+        entry.flag,
+        entry.payee,
+        entry.narration,
+        tuple(sorted(entry.tags or ())),
+        tuple(sorted(entry.links or ())),
+        _meta_items(entry.meta),
+        tuple(_posting_parts(p) for p in entry.postings),
+    )
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def _hashable(value):
+    if isinstance(value, list):
+        return tuple(_hashable(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _hashable(v)) for k, v in value.items()))
+    return value
+
+
+def _user_meta(meta: typing.Optional[dict]) -> tuple:
+    """The meta written in the file, not where it was loaded from or our own _keys"""
+    if not meta:
+        return ()
+    return tuple(sorted(
+        (key, _hashable(value)) for key, value in meta.items()
+        if key not in VOLATILE_META and not key.startswith('_')
+    ))
+
+
+def entry_dedupe_key(entry: data.Directive) -> tuple:
+    """What makes two entries the same, for de-duplicating files
+
+    Built from the fields themselves, nothing is rendered to text.  The
+    filename, line number and _ meta and the flag are left out, so a pending
+    entry and its booked copy get the same key.  Any other meta, the tags and
+    the links count.
+    """
+    if isinstance(entry, data.Transaction):
+        # One flat tuple, every object we keep around is more work for the gc
+        key = [
+            data.Transaction, entry.date, entry.payee, entry.narration,
+            _user_meta(entry.meta), frozenset(entry.tags or ()), frozenset(entry.links or ()),
+            len(entry.postings),
+        ]
+        for posting in entry.postings:
+            key += (posting.account, posting.units, posting.cost, posting.price)
+        return tuple(key)
+    # Every other directive is its meta followed by its fields
+    return (type(entry), _user_meta(entry.meta)) + tuple(_hashable(value) for value in entry[1:])
@@ -0,0 +1,90 @@
+"""
+Write rendered entries only when they changed.
+
+Rewriting an output file with the same content still bumps its mtime, and
+fava (or any file watcher) then reloads the ledger again.  We render into
+memory, compare the hash with the file on disk and only replace the file,
+atomically, if it's different.
+"""
+import io
+import os
+import hashlib
+import logging
+import pathlib
+import tempfile
+import collections
+from typing import Iterable, NamedTuple, TextIO
+
+from beancount.core import data
+from beancount.core.display_context import DisplayContext
+from beancount.parser.printer import EntryPrinter, print_entries
+
+
+logger = logging.getLogger(__name__)
+
+
+class WriteResult(NamedTuple):
+    changed: bool
+    added: int
+    removed: int
+
+
+def render_entries(entries: list, dcontext: DisplayContext = None) -> str:
+    """The text print_entries would write"""
+    stream = io.StringIO()
+    print_entries(entries, dcontext=dcontext, file=stream)
+    return stream.getvalue()
+
+
+def stream_entries(entries: Iterable[data.Directive], file: TextIO, dcontext: DisplayContext = None) -> int:
+    """Write entries like print_entries, without needing them all in a list"""
+    eprinter = EntryPrinter(dcontext)
+    previous_type = None
+    count = 0
+    for entry in entries:
+        # The same blank lines as print_entries
+        entry_type = type(entry)
+        if previous_type is None:
+            previous_type = entry_type
+        if entry_type in (data.Transaction, data.Commodity) or entry_type is not previous_type:
+            file.write('\n')
+            previous_type = entry_type
+        file.write(eprinter(entry))
+        count += 1
+    return count
+
+
+def entry_blocks(content: str) -> collections.Counter:
+    """Count the blank line separated blocks, one per printed entry"""
+    blocks = (block.strip() for block in content.split("\n\n"))
+    return collections.Counter(block for block in blocks if block)
+
+
+def write_if_changed(path: pathlib.Path, content: str) -> WriteResult:
+    """Atomically replace path with content, unless it already has that content"""
+    path = pathlib.Path(path)
+    new = content.encode('utf-8')
+    try:
+        old = path.read_bytes()
+    except FileNotFoundError:
+        old = None
+
+    if old is not None and hashlib.sha256(old).digest() == hashlib.sha256(new).digest():
+        return WriteResult(False, 0, 0)
+
+    old_blocks = entry_blocks(old.decode('utf-8', errors='replace')) if old else collections.Counter()
+    new_blocks = entry_blocks(content)
+    added = sum((new_blocks - old_blocks).values())
+    removed = sum((old_blocks - new_blocks).values())
+
+    fd, tmp_name = tempfile.mkstemp(dir=str(path.parent), prefix=f".{path.name}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, "wb") as stream:
+            stream.write(new)
+        if old is not None:
+            os.chmod(tmp_name, path.stat().st_mode & 0o777)
+        os.replace(tmp_name, str(path))
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+    return WriteResult(True, added, removed)
@@ -0,0 +1,81 @@
+"""
+An insertion-ordered collection of beancount entries.
+
+Entries are namedtuples, so `entry in list` and `list.remove(entry)` compare
+every field of every entry until they find one.  EntryStore keys each entry on
+its id() instead: adding, removing and replacing an entry are O(1), and the
+same entry object is never stored twice.
+"""
+import typing
+from typing import Callable, Dict, Iterable, Iterator, Optional
+
+from beancount.core import data
+
+
+class EntryStore:
+    """Entries in insertion order, keyed on the identity of each entry"""
+
+    # sequence number -> entry, dicts keep their insertion order
+    _entries: Dict[int, data.Directive]
+    # id(entry) -> sequence number
+    _positions: Dict[int, int]
+
+    def __init__(self, entries: Iterable[data.Directive] = ()):
+        self._entries = {}
+        self._positions = {}
+        self._next = 0
+        for entry in entries:
+            self.add(entry)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[data.Directive]:
+        return iter(self._entries.values())
+
+    def __contains__(self, entry) -> bool:
+        return id(entry) in self._positions
+
+    def position(self, entry: data.Directive) -> int:
+        """Where entry is in the insertion order, kept by replace()"""
+        return self._positions[id(entry)]
+
+    def add(self, entry: data.Directive) -> bool:
+        """Append entry, unless it's already in the store"""
+        if id(entry) in self._positions:
+            return False
+        self._positions[id(entry)] = self._next
+        self._entries[self._next] = entry
+        self._next += 1
+        return True
+
+    def discard(self, entry: data.Directive) -> bool:
+        """Remove entry if it's in the store"""
+        position = self._positions.pop(id(entry), None)
+        if position is None:
+            return False
+        del self._entries[position]
+        return True
+
+    def replace(self, old: data.Directive, new: data.Directive) -> bool:
+        """Put new in the place of old, new is appended if old isn't here"""
+        position = self._positions.pop(id(old), None)
+        if position is None:
+            return self.add(new)
+        # new might already be in here elsewhere, keep just the one
+        self.discard(new)
+        self._positions[id(new)] = position
+        self._entries[position] = new
+        return True
+
+    def sort(self, key: Optional[Callable] = None):
+        """Re-order the entries, like list.sort()"""
+        entries = sorted(self._entries.values(), key=key)
+        self._entries = {}
+        self._positions = {}
+        self._next = 0
+        for entry in entries:
+            self.add(entry)
+
+    def to_list(self) -> typing.List[data.Directive]:
+        return list(self._entries.values())
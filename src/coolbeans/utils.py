@@ -9,6 +9,15 @@ import yaml
 logger = logging.getLogger(__name__)
 
 
+# The libyaml loader is many times faster, when PyYAML was built with it
+YamlLoader = getattr(yaml, 'CFullLoader', yaml.FullLoader)
+
+
+def yaml_load(stream):
+    """Same as yaml.full_load, using libyaml when it's available"""
+    return yaml.load(stream, Loader=YamlLoader)
+
+
 def get_project_root() -> pathlib.Path:
     """Returns project root folder."""
     return pathlib.Path(__file__).parent
@@ -29,7 +38,7 @@ def logging_config(config_file=None, level=logging.INFO):
     assert config_file.exists(), f"Unable to find {config_file}"
 
     with config_file.open("r") as fil:
-        config = yaml.full_load(fil)
+        config = yaml_load(fil)
 
         config.setdefault(
             'loggers',
@@ -69,3 +78,13 @@ def get_setting(key, settings):
             else:
                 return value
         return value
+
+
+def get_bool_setting(key, settings, default=False) -> bool:
+    """Returns a setting as a bool, accepting TRUE or "true"/"yes"/"on" etc."""
+    value = get_setting(key, settings)
+    if value is None:
+        return default
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', 'yes', 'on', '1')
+    return bool(value)
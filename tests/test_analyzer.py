@@ -0,0 +1,94 @@
+import re
+import pathlib
+import tempfile
+import unittest
+
+from coolbeans.rule import Rule
+from coolbeans.rules.cache import RulesCache
+from coolbeans.rules.analyzer import RegexAnalyzer, UnsafeRegexError, backtracking_risk
+
+
+NARRATIONS = [
+    "AMZN Mktp US*L08746BB3",
+    "AirBnB Deposit - AIRBNB PAYMENTS",
+    "a" * 24 + "!",
+]
+
+
+class TestBacktrackingRisk(unittest.TestCase):
+
+    def test_safe(self):
+        for pattern in (r"AMZN Mktp.*", r"(?P<payee>AirBnB).*", r"(foo|bar)+", r"\d{4}-\d{2}"):
+            self.assertIsNone(backtracking_risk(re.compile(pattern, re.I)), pattern)
+
+    def test_nested(self):
+        self.assertEqual(backtracking_risk(re.compile(r"(a+)+$")), "nested quantifier")
+        self.assertEqual(backtracking_risk(re.compile(r"(\w+\s?)*$")), "nested quantifier")
+
+    def test_overlapping_alternation(self):
+        self.assertEqual(
+            backtracking_risk(re.compile(r"(ab|a.)*c")),
+            "quantified alternation with overlapping branches"
+        )
+        # Single characters are folded into a set, nothing to backtrack over
+        self.assertIsNone(backtracking_risk(re.compile(r"(x|\w)*c")))
+
+
+class TestRegexAnalyzer(unittest.TestCase):
+
+    def test_corpus(self):
+        analyzer = RegexAnalyzer(NARRATIONS + [None, NARRATIONS[0]], corpus_size=2)
+        self.assertEqual(analyzer.corpus, [NARRATIONS[1], NARRATIONS[2]])
+
+    def test_warn(self):
+        analyzer = RegexAnalyzer(NARRATIONS, budget=0.0)
+        with self.assertLogs('coolbeans.rules.analyzer', level='WARNING'):
+            Rule({'match-narration': r"AMZN.*"}, analyzer=analyzer)
+        self.assertEqual(len(analyzer.warnings), 1)
+        self.assertIn(r"AMZN.*", analyzer.timings)
+
+    def test_risky_not_timed(self):
+        # Long enough that timing (a+)+$ on it would never finish
+        corpus = ["a" * 64 + "!"]
+        analyzer = RegexAnalyzer(corpus, budget=1.0)
+        with self.assertLogs('coolbeans.rules.analyzer', level='WARNING'):
+            Rule({'match-narration': r"(a+)+$"}, analyzer=analyzer)
+        self.assertEqual(len(analyzer.warnings), 1)
+        self.assertNotIn(r"(a+)+$", analyzer.timings)
+
+        analyzer = RegexAnalyzer(corpus, budget=1.0, reject=True)
+        with self.assertRaises(UnsafeRegexError):
+            Rule({'match-narration': r"(a+)+$"}, analyzer=analyzer)
+        self.assertEqual(analyzer.rejected, [r"(a+)+$"])
+
+    def test_timings_kept(self):
+        analyzer = RegexAnalyzer(NARRATIONS + ["timings kept"], budget=1.0)
+        analyzer.check(re.compile(r"AMZN.*", re.I))
+        self.assertIn(r"AMZN.*", RegexAnalyzer(NARRATIONS + ["timings kept"]).timings)
+        self.assertNotIn(r"AMZN.*", RegexAnalyzer(NARRATIONS + ["a new narration"]).timings)
+
+    def test_reject(self):
+        analyzer = RegexAnalyzer(NARRATIONS, budget=0.0, reject=True)
+        with self.assertRaises(UnsafeRegexError):
+            Rule({'match-narration': r"AMZN.*"}, analyzer=analyzer)
+
+    def test_within_budget(self):
+        analyzer = RegexAnalyzer(NARRATIONS, budget=1.0, reject=True)
+        rule = Rule({'match-narration': r"AMZN.*", 'set-posting-account': 'Expenses:Shopping'}, analyzer=analyzer)
+        self.assertEqual(analyzer.warnings, [])
+        self.assertIn('transaction-narration', rule.match_requirements)
+
+    def test_cache_drops_rejected(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            rules_file = pathlib.Path(tmp).joinpath("rules.yaml")
+            rules_file.write_text(
+                "- match-narration: AMZN.*\n"
+                "  set-posting-account: Expenses:Shopping\n"
+                "- match-narration: (a+)+$\n"
+                "  set-posting-account: Expenses:Slow\n"
+            )
+            analyzer = RegexAnalyzer(NARRATIONS, reject=True)
+            with self.assertLogs('coolbeans.rules.cache', level='ERROR'):
+                rules = RulesCache("off").load(rules_file, analyzer=analyzer)
+            self.assertEqual(len(rules), 1)
+            self.assertEqual(analyzer.rejected, [r"(a+)+$"])
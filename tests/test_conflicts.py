@@ -0,0 +1,62 @@
+import unittest
+
+import yaml
+from beancount.parser import parser
+
+from coolbeans.rule import Rule
+from coolbeans.rules.conflicts import analyze, Subset
+
+
+RULES = yaml.full_load("""
+- match-narration: AMZN.*
+  set-posting-account: Expenses:Shopping
+- match-narration: AMZN Mktp.*
+  set-posting-account: Expenses:Books
+- match-narration: Never.*
+  set-posting-account: Expenses:Never
+- match-narration: .*store
+  set-tags: store
+- match-narration: Corner Store
+  match-account: Liabilities:.*
+  set-tags: corner
+""")
+
+ENTRIES = parser.parse_many("""
+2020-04-08 ! "AMZN Mktp US*L08746BB3"
+  * Liabilities:CreditCard  -39.98 USD
+  ! Expenses:FIXME           39.98 USD
+
+2020-04-09 * "AMZN Prime"
+  Liabilities:CreditCard  -9.99 USD
+  Expenses:Shopping        9.99 USD
+
+2020-04-10 * "Corner Store"
+  Liabilities:CreditCard  -5.00 USD
+  Expenses:Food            5.00 USD
+
+2020-04-11 * "Book store"
+  Assets:Checking  -5.00 USD
+  Expenses:Books    5.00 USD
+""")
+
+
+class TestRuleAnalysis(unittest.TestCase):
+
+    def setUp(self):
+        self.rules = [Rule(r) for r in RULES]
+        self.analysis, self.transactions = analyze(self.rules, ENTRIES)
+
+    def test_dead(self):
+        self.assertEqual(self.analysis.dead, [2])
+
+    def test_subsets(self):
+        self.assertEqual(self.analysis.subsets, [Subset(1, 0), Subset(4, 3)])
+        self.assertTrue(self.analysis.subsets[0].shadowed)
+
+    def test_conflicts(self):
+        conflict, = self.analysis.conflicts
+        self.assertEqual(self.transactions[conflict.entry].narration, "AMZN Mktp US*L08746BB3")
+        self.assertEqual(conflict.accounts, {'Expenses:Shopping': [0], 'Expenses:Books': [1]})
+
+    def test_pruned(self):
+        self.assertLess(self.analysis.checks, len(self.rules) * len(self.transactions))
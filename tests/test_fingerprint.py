@@ -0,0 +1,71 @@
+import unittest
+
+from beancount.core import data
+from beancount.parser import parser
+
+from coolbeans.tools.fingerprint import entry_dedupe_key
+
+
+LEDGER = """
+2020-01-02 ! "Coffee" #daily
+  receipt: "0042"
+  Assets:Checking  -3.50 USD
+  Expenses:FIXME    3.50 USD
+
+2020-01-02 balance Assets:Checking  100.00 USD
+
+2020-01-02 custom "budget" "Expenses:Food" 100.00 USD
+"""
+
+STAGED = """
+; Moved down a few lines
+
+2020-01-02 * "Coffee" #daily
+  receipt: "0042"
+  Assets:Checking  -3.50 USD
+  Expenses:FIXME    3.50 USD
+
+2020-01-02 balance Assets:Checking  100.00 USD
+
+2020-01-02 custom "budget" "Expenses:Food" 100.00 USD
+"""
+
+
+class TestDedupeKey(unittest.TestCase):
+
+    def setUp(self):
+        self.ledger = parser.parse_many(LEDGER)
+        self.staged = parser.parse_many(STAGED)
+
+    def test_same_entries(self):
+        # Line numbers and the flag don't count
+        for ledger_entry, staged_entry in zip(self.ledger, self.staged):
+            self.assertEqual(entry_dedupe_key(ledger_entry), entry_dedupe_key(staged_entry))
+        self.assertEqual(len({entry_dedupe_key(e) for e in self.ledger + self.staged}), 3)
+
+    def test_different_entries(self):
+        coffee, = [e for e in self.ledger if isinstance(e, data.Transaction)]
+        other = [
+            coffee._replace(narration="Tea"),
+            coffee._replace(payee="Cafe"),
+            coffee._replace(date=coffee.date.replace(day=3)),
+            coffee._replace(postings=coffee.postings[:1]),
+            coffee._replace(postings=[coffee.postings[0]._replace(account="Assets:Savings")] + coffee.postings[1:]),
+            coffee._replace(meta=dict(coffee.meta, receipt="0043")),
+            coffee._replace(meta=dict(coffee.meta, note="Decaf")),
+            coffee._replace(tags=frozenset()),
+            coffee._replace(links=frozenset(["order-1"])),
+        ]
+        keys = {entry_dedupe_key(entry) for entry in other}
+        self.assertEqual(len(keys), len(other))
+        self.assertNotIn(entry_dedupe_key(coffee), keys)
+
+    def test_own_meta_ignored(self):
+        coffee, = [e for e in self.ledger if isinstance(e, data.Transaction)]
+        tagged = coffee._replace(meta=dict(coffee.meta, _account="Assets:Checking", filename="other.bean"))
+        self.assertEqual(entry_dedupe_key(tagged), entry_dedupe_key(coffee))
+
+    def test_custom_meta(self):
+        custom, = [e for e in self.ledger if isinstance(e, data.Custom)]
+        other = custom._replace(meta=dict(custom.meta, category="food"))
+        self.assertNotEqual(entry_dedupe_key(other), entry_dedupe_key(custom))
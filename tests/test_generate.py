@@ -0,0 +1,92 @@
+import re
+import pathlib
+import tempfile
+import unittest
+
+import yaml
+from beancount.parser import parser
+
+from coolbeans.matcher import generate_new_rules
+from coolbeans.rules.generate import tokenize, signature, cluster_entries, propose_rules
+
+
+ENTRIES, _, _ = parser.parse_string("""
+2020-04-08 ! "AMZN Mktp US*L08746BB3"
+  * Liabilities:CreditCard  -39.98 USD
+  ! Expenses:FIXME
+
+2020-04-09 ! "AMZN Mktp  US*2K3AB91Q2"
+  * Liabilities:CreditCard  -12.00 USD
+  ! Expenses:FIXME
+
+2020-04-10 ! "AMZN Mktp US*123456"
+  * Liabilities:CreditCard  -39.98 USD
+  ! Expenses:FIXME
+
+2020-04-11 ! "CHECK 1041"
+  * Assets:Checking  -100.00 USD
+  ! Expenses:FIXME
+
+2020-04-12 ! "Check 1042"
+  * Assets:Checking  -250.00 USD
+  ! Expenses:FIXME
+
+2020-04-12 * "Check 1043"
+  * Assets:Checking  -250.00 USD
+  * Expenses:Rent
+""")
+
+
+class TestTokenize(unittest.TestCase):
+
+    def test_tokenize(self):
+        self.assertEqual(
+            tokenize("AMZN Mktp  US*L08746BB3"),
+            ['amzn', ' ', 'mktp', ' ', 'us', '*', 'l08746bb3']
+        )
+
+    def test_signature(self):
+        self.assertEqual(
+            signature(tokenize("AMZN Mktp US*L08746BB3")),
+            signature(tokenize("amzn mktp us*2K3AB91Q2")),
+        )
+        self.assertNotEqual(
+            signature(tokenize("Check #1041")),
+            signature(tokenize("Check 1041")),
+        )
+
+
+class TestProposeRules(unittest.TestCase):
+
+    def test_clusters(self):
+        clusters = cluster_entries(ENTRIES)
+        self.assertEqual(sorted(c.count for c in clusters.values()), [2, 3])
+
+    def test_rules(self):
+        rules = propose_rules(ENTRIES)
+        self.assertEqual([r['comment']['count'] for r in rules], [2, 3])
+
+        check, amazon = rules
+        self.assertEqual(check['match-narration'], r"check\s+\d+")
+        self.assertEqual(check['match-account'], "Assets:Checking")
+        self.assertEqual(amazon['match-narration'], r"amzn\s+mktp\s+us\*\w+")
+        self.assertEqual(amazon['comment']['amounts'], {'min': 12.0, 'max': 39.98, 'distinct': 2})
+
+        # Each proposal matches every narration in its cluster
+        for entry in ENTRIES:
+            if entry.flag == '!':
+                self.assertTrue(
+                    any(re.match(r['match-narration'], entry.narration, re.I) for r in rules),
+                    entry.narration
+                )
+
+    def test_no_rules_file(self):
+        result = generate_new_rules(ENTRIES, {'coolbeans': {}})
+        self.assertEqual(result, (ENTRIES, []))
+
+    def test_rules_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            rules_file = pathlib.Path(tmp).joinpath("new-rules.yaml")
+            generate_new_rules(ENTRIES, {'coolbeans': {'gen-rules-file': [str(rules_file)]}})
+            rules = yaml.full_load(rules_file.read_text())
+        self.assertEqual(len(rules), 2)
@@ -1,5 +1,7 @@
 """Test Our Matcher Code"""
 
+import pathlib
+import tempfile
 import unittest
 import logging
 import yaml
@@ -184,6 +186,40 @@ TEST_ENTIRES = parse_many("""
   ! Income:Unmatched              -1039.80 USD
 """)
 
+
+class TestAdaptiveOrdering(unittest.TestCase):
+
+    RULES = [
+        {'match-narration': 'Deposit.*', 'set-posting-account': 'Income:Deposit', 'commutes': True},
+        {'match-narration': 'AMZN.*', 'set-posting-account': 'Expenses:Shopping', 'commutes': True},
+        {'match-narration': '.*', 'set-posting-account': 'Expenses:Other'},
+        {'match-narration': 'Never.*', 'commutes': True},
+    ]
+
+    def test_default_order(self):
+        m = Matcher(self.RULES)
+        self.assertEqual([r for r, _ in m.ordered_rules()], m.rules)
+
+    def test_adaptive(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            history_file = pathlib.Path(tmp).joinpath("history.json")
+            m = Matcher(self.RULES, ordering='adaptive', history_file=history_file)
+            amazon = [e for e in TEST_ENTIRES if e.narration.startswith('AMZN')][0]
+            for _ in range(5):
+                self.assertIs(m.match(amazon).rule, m.rules[1])
+            m.save_history()
+
+            m = Matcher(self.RULES, ordering='adaptive', history_file=history_file)
+            ordered = [r for r, _ in m.ordered_rules()]
+            # The AMZN rule moves up, the catch-all stays put as a barrier
+            self.assertEqual(ordered, [m.rules[1], m.rules[0], m.rules[2], m.rules[3]])
+            self.assertIs(m.match(amazon).rule, m.rules[1])
+
+    def test_commutes_option(self):
+        m = Matcher(self.RULES)
+        self.assertEqual([r.commutes for r in m.rules], [True, True, False, True])
+
+
 if __name__ == '__main__':
     import logging, sys
     import logging
@@ -0,0 +1,67 @@
+import unittest
+
+import yaml
+from beancount.ingest import importer
+from beancount.parser import parser
+
+from coolbeans.rule import Rule
+from coolbeans.importers.matching import MatchingImporter, match_hook
+
+
+RULES = [Rule(r) for r in yaml.full_load("""
+- match-narration: AMZN Mktp.*
+  set-posting-account: Expenses:Shopping
+""")]
+
+EXTRACTED = parser.parse_many("""
+2020-04-08 ! "AMZN Mktp US*L08746BB3"
+  * Liabilities:CreditCard  -39.98 USD
+  ! Expenses:FIXME           39.98 USD
+
+2020-04-09 ! "Corner Store"
+  * Liabilities:CreditCard  -5.00 USD
+  ! Expenses:FIXME           5.00 USD
+""")
+
+
+class FakeFile:
+    name = "statement.ofx"
+
+
+class FakeImporter(importer.ImporterProtocol):
+
+    def name(self):
+        return "fake"
+
+    def identify(self, file):
+        return True
+
+    def file_account(self, file):
+        return "Liabilities:CreditCard"
+
+    def extract(self, file, existing_entries=None):
+        return list(EXTRACTED)
+
+
+class TestMatchingImporter(unittest.TestCase):
+
+    def assertMatched(self, entries):
+        shopping, corner = entries
+        self.assertEqual(shopping.flag, '*')
+        self.assertEqual(shopping.postings[1].account, 'Expenses:Shopping')
+        self.assertIs(corner, EXTRACTED[1])
+
+    def test_extract(self):
+        wrapped = MatchingImporter(FakeImporter(), rules=RULES)
+        self.assertEqual(wrapped.name(), "fake")
+        self.assertTrue(wrapped.identify(FakeFile()))
+        self.assertEqual(wrapped.file_account(FakeFile()), "Liabilities:CreditCard")
+        self.assertEqual(wrapped.FLAG, FakeImporter.FLAG)
+        self.assertMatched(wrapped.extract(FakeFile()))
+
+    def test_hook(self):
+        existing = parser.parse_many("2000-01-01 open Liabilities:CreditCard")
+        hook = match_hook(rules=RULES)
+        (filename, entries), = hook([("statement.ofx", list(EXTRACTED))], existing)
+        self.assertEqual(filename, "statement.ofx")
+        self.assertMatched(entries)
@@ -0,0 +1,225 @@
+import re
+import pathlib
+import tempfile
+import unittest
+from unittest import mock
+
+from beancount.core import data, account
+from beancount.parser import parser
+
+from coolbeans.organizer import BeanOrganizer
+
+
+OPEN = """
+2020-01-01 open Assets:Checking
+2020-01-01 open Expenses:FIXME
+2020-01-01 open Expenses:Food
+"""
+
+LEDGER = OPEN + """
+2020-01-02 ! "Coffee"
+  Assets:Checking  -3.50 USD
+  Expenses:FIXME    3.50 USD
+
+2020-01-02 * "Coffee"
+  Assets:Checking  -3.50 USD
+  Expenses:FIXME    3.50 USD
+
+2020-01-03 ! "Tea"
+  Assets:Checking  -2.00 USD
+  Expenses:FIXME    2.00 USD
+
+2020-01-03 * "Tea"
+  Assets:Checking  -2.50 USD
+  Expenses:Food     2.50 USD
+"""
+
+STAGED = OPEN + """
+2020-01-02 * "Coffee"
+  Assets:Checking  -4.00 USD
+  Expenses:Food     4.00 USD
+
+2020-01-03 * "Tea"
+  Assets:Checking  -2.00 USD
+  Expenses:FIXME    2.00 USD
+
+2020-01-04 * "Lunch"
+  Assets:Checking  -12.00 USD
+  Expenses:Food     12.00 USD
+"""
+
+
+SORTING = """
+2020-01-01 open Assets:Checking
+2020-01-01 open Assets:Checking:Joint
+2020-01-01 open Assets:Checking-Old
+2020-01-01 open Income:Salary
+2020-01-01 open Expenses:Food
+
+2020-01-02 note Assets:Checking-Old "Closed"
+
+2020-01-02 * "Refund"
+  Income:Salary    -5.00 USD
+  Expenses:Food     5.00 USD
+
+2020-01-02 * "Deposit"
+  Assets:Checking:Joint  100.00 USD
+  Income:Salary         -100.00 USD
+
+2020-01-02 note Assets:Checking "Called the bank"
+
+2020-01-03 * "Bread"
+  Assets:Checking-Old   -3.00 USD
+  Expenses:Food          3.00 USD
+
+2020-01-03 * "Milk"
+  Assets:Checking       -2.00 USD
+  Expenses:Food          2.00 USD
+
+2020-01-03 note Assets:Checking:Joint "Opened"
+"""
+
+
+def reference_key(method):
+    """The sort key the organizer always had, with the split account names"""
+    def sort_key(entry):
+        account_sort_key = tuple(account.split(entry.meta['_account']))
+        amount_sort_key = 0
+        text_sort_key = ""
+        if isinstance(entry, data.Transaction) and entry.postings:
+            price = entry.postings[0].price
+            amount_sort_key = -abs(price.number) if price else 0
+            text_sort_key = entry.narration
+        if isinstance(entry, data.Note):
+            account_sort_key = tuple(account.split(entry.account))
+            text_sort_key = entry.comment
+        rest = (entry.meta.get('sort', 100), data.SORT_ORDER.get(type(entry), 0))
+        if method == 'date':
+            return (entry.meta.get('global-sort', 100), entry.date) + rest + (account_sort_key, amount_sort_key, text_sort_key)
+        return (entry.meta.get('global-sort', 100), account_sort_key, entry.date) + rest + (amount_sort_key, text_sort_key)
+    return sort_key
+
+
+class TestBeanOrganizer(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = pathlib.Path(tmp.name)
+        self.ledger = self.write('ledger.bean', LEDGER)
+        self.staged = self.write('staged.bean', STAGED)
+
+    def write(self, name, text) -> pathlib.Path:
+        path = self.path.joinpath(name)
+        path.write_text(text)
+        return path
+
+    def organizer(self, input_files, **kwargs) -> BeanOrganizer:
+        kwargs.setdefault('workers', 1)
+        return BeanOrganizer(
+            bean_file=self.ledger,
+            input_files=input_files,
+            output=self.path.joinpath('out.bean'),
+            split_type='date',
+            do_filter=False,
+            between=(None, None),
+            **kwargs
+        )
+
+    def transactions(self, entries):
+        return [
+            (e.date.day, e.flag, e.narration, str(e.postings[0].units.number))
+            for e in entries if isinstance(e, data.Transaction)
+        ]
+
+    def test_same_file_kept(self):
+        # Without a match-key a pending and a booked Coffee in one file are two entries
+        organizer = self.organizer([])
+        self.assertEqual(self.transactions(organizer.entries), [
+            (2, '!', "Coffee", '-3.50'),
+            (2, '*', "Coffee", '-3.50'),
+            (3, '!', "Tea", '-2.00'),
+            (3, '*', "Tea", '-2.50'),
+        ])
+
+    def test_booked_replaces_pending(self):
+        organizer = self.organizer([self.staged])
+        self.assertEqual(self.transactions(organizer.entries), [
+            (2, '!', "Coffee", '-3.50'),
+            (2, '*', "Coffee", '-3.50'),
+            (3, '*', "Tea", '-2.00'),
+            (3, '*', "Tea", '-2.50'),
+            (2, '*', "Coffee", '-4.00'),
+            (4, '*', "Lunch", '-12.00'),
+        ])
+
+    def test_sorted_entries(self):
+        # The Coffees and the Teas tie, across both files.  The booked Tea
+        # from the staged file took the place of the pending one in the ledger
+        organizer = self.organizer([self.staged])
+        entries = list(organizer.entries)
+        expected = sorted(entries, key=organizer.ranked_sort_key(entries))
+        self.assertEqual([id(e) for e in organizer.sorted_entries()], [id(e) for e in expected])
+        self.assertEqual(self.transactions(expected), [
+            (2, '!', "Coffee", '-3.50'),
+            (2, '*', "Coffee", '-3.50'),
+            (2, '*', "Coffee", '-4.00'),
+            (3, '*', "Tea", '-2.00'),
+            (3, '*', "Tea", '-2.50'),
+            (4, '*', "Lunch", '-12.00'),
+        ])
+
+    def test_sort_methods(self):
+        # Checking:Joint sorts before Checking-Old split, but after it as a string
+        sorting = self.write('sorting.bean', SORTING)
+        for method in ('date', 'account'):
+            with self.subTest(method=method):
+                organizer = self.organizer([sorting], sort_method=method)
+                entries = list(organizer.entries)
+                expected = sorted(entries, key=reference_key(method))
+                self.assertEqual([id(e) for e in organizer.sorted_entries()], [id(e) for e in expected])
+
+    def test_sort_unknown_method(self):
+        organizer = self.organizer([], sort_method='payee')
+        with self.assertRaises(ValueError):
+            list(organizer.sorted_entries())
+
+    def test_guess_account(self):
+        organizer = self.organizer([])
+        refund, deposit, *_ = [e for e in parser.parse_many(SORTING) if isinstance(e, data.Transaction)]
+        # No Assets or Liabilities posting, the first posting's account
+        self.assertEqual(organizer.guess_account(refund), 'Income:Salary')
+        self.assertEqual(organizer.guess_account(deposit), 'Assets:Checking:Joint')
+
+    def test_load_files_serial_by_default(self):
+        organizer = self.organizer([])
+        with mock.patch('coolbeans.organizer.ProcessPoolExecutor') as pool:
+            loaded = organizer.load_files(self.ledger, [str(self.staged)])
+        pool.assert_not_called()
+        self.assertEqual([len(entries) for entries in loaded], [7, 6])
+
+    def test_load_files_workers(self):
+        sorting = self.write('sorting.bean', SORTING)
+        organizer = self.organizer([])
+        inputs = [str(self.staged), str(sorting)]
+        serial = organizer.load_files(self.ledger, inputs, workers=1)
+        parallel = organizer.load_files(self.ledger, inputs, workers=2)
+        self.assertEqual([len(entries) for entries in parallel], [7, 6, 12])
+        self.assertEqual(parallel, serial)
+
+        # And the merged result doesn't depend on how the files were loaded
+        merged = [
+            [(e.meta['filename'], e.meta['lineno']) for e in self.organizer(inputs, workers=workers).entries]
+            for workers in (1, 2)
+        ]
+        self.assertEqual(merged[0], merged[1])
+
+    def test_save_entries(self):
+        organizer = self.organizer([self.staged])
+        expected = list(organizer.sorted_entries())
+        organizer.save_entries()
+        text = self.path.joinpath('out.bean').read_text()
+        # In the merged order, under the month and day headings
+        narrations = re.findall(r'^\d{4}-\d\d-\d\d [*!] "(\w+)"', text, re.M)
+        self.assertEqual(narrations, [e.narration for e in expected if isinstance(e, data.Transaction)])
+        self.assertIn("** 2020-01-03 - Friday\n", text)
@@ -0,0 +1,67 @@
+import io
+import os
+import pathlib
+import tempfile
+import unittest
+
+from beancount.parser import parser
+
+from coolbeans.tools.output import render_entries, stream_entries, write_if_changed
+
+
+ENTRIES = parser.parse_many("""
+2020-04-08 * "AMZN Mktp US*L08746BB3"
+  Liabilities:CreditCard  -39.98 USD
+  Expenses:Shopping        39.98 USD
+
+2020-04-09 * "Corner Store"
+  Liabilities:CreditCard  -5.00 USD
+  Expenses:Food            5.00 USD
+""")
+
+
+MIXED = parser.parse_many("""
+2020-01-01 open Liabilities:CreditCard
+2020-01-01 open Expenses:Food
+2020-04-08 balance Liabilities:CreditCard  0.00 USD
+2020-04-09 note Expenses:Food "Groceries"
+""") + ENTRIES
+
+
+class TestStreamEntries(unittest.TestCase):
+
+    def test_same_as_print_entries(self):
+        for entries in (ENTRIES, MIXED, []):
+            stream = io.StringIO()
+            count = stream_entries(iter(entries), file=stream)
+            self.assertEqual(count, len(entries))
+            self.assertEqual(stream.getvalue(), render_entries(entries))
+
+
+class TestWriteIfChanged(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.file = pathlib.Path(self.tmp.name).joinpath("matched.bean")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_new_file(self):
+        result = write_if_changed(self.file, render_entries(ENTRIES))
+        self.assertEqual(result, (True, 2, 0))
+        self.assertEqual(self.file.read_text(), render_entries(ENTRIES))
+
+    def test_unchanged(self):
+        write_if_changed(self.file, render_entries(ENTRIES))
+        os.utime(str(self.file), ns=(0, 0))
+
+        result = write_if_changed(self.file, render_entries(ENTRIES))
+        self.assertEqual(result, (False, 0, 0))
+        self.assertEqual(self.file.stat().st_mtime_ns, 0)
+
+    def test_changed(self):
+        write_if_changed(self.file, render_entries(ENTRIES[:1]))
+        result = write_if_changed(self.file, render_entries(ENTRIES[1:]))
+        self.assertEqual(result, (True, 1, 1))
+        self.assertEqual(os.listdir(self.tmp.name), ["matched.bean"])
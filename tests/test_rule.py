@@ -5,7 +5,7 @@ import logging
 
 from beancount.parser import parser
 
-from coolbeans.rule import KEY_RE, Rule, MatchRule
+from coolbeans.rule import KEY_RE, Rule, MatchRule, EntryView, extract_field
 from coolbeans import matcher
 
 
@@ -213,3 +213,133 @@ class TestMatchRule(unittest.TestCase):
 
             self.assertEqual(entry.flag, '*')
 
+
+class TestEntryView(unittest.TestCase):
+
+    def test_same_as_extract_field(self):
+        entry = parser.parse_one("""
+2020-04-08 ! "AMZN Mktp US*L08746BB3" #shopping
+  match-key: "2020040824692160098100992944500"
+  * Liabilities:CreditCard:Chase:Amazon  -39.98 USD
+  ! Expenses:FIXME                        39.98 USD
+""")
+        view = EntryView(entry)
+        for key in [
+                ('transaction', 'narration', None),
+                ('transaction', 'payee', None),
+                ('transaction', 'tags', None),
+                ('transaction', 'meta', 'match-key'),
+                ('transaction', 'meta', 'missing'),
+                ('posting', 'account', None)]:
+            self.assertEqual(view.get(*key), extract_field(entry, *key), key)
+        self.assertEqual(view.get_folded('transaction', 'narration'), "amzn mktp us*l08746bb3")
+
+    def test_no_eligible_posting(self):
+        entry = parser.parse_one("""
+2020-04-08 ! "Nothing"
+  ! Expenses:FIXME                        39.98 USD
+  ! Assets:Cash
+""")
+        view = EntryView(entry)
+        self.assertIsNone(view.get('posting', 'account'))
+        self.assertIsNone(Rule({'match-account': '.*'}).check(entry, view=view))
+
+
+class TestModifyEntry(unittest.TestCase):
+
+    def setUp(self):
+        self.entry = parser.parse_one("""
+2020-04-08 ! "AMZN Mktp US*L08746BB3"
+  match-key: "2020040824692160098100992944500"
+  * Liabilities:CreditCard:Chase:Amazon  -39.98 USD
+  ! Expenses:FIXME                        20.00 USD
+  ! Expenses:FIXME                        19.98 USD
+""")
+
+    def test_modify(self):
+        rule = Rule({
+            'match-narration': r"(?P<payee>amzn mktp us)\*(?P<meta_order_id>.*)",
+            'set-posting-account': 'Expenses:Shopping',
+            'set-posting-meta-category': 'online',
+            'set-transaction-meta-source': 'rules',
+            'set-tags': 'shopping',
+        })
+        match_values = rule.check(self.entry)
+        new_entry = rule.modify_entry(self.entry, match_values)
+
+        self.assertEqual(new_entry.flag, '*')
+        self.assertEqual(new_entry.payee, 'Amzn Mktp Us')
+        self.assertEqual(new_entry.tags, {'shopping'})
+        self.assertEqual(new_entry.meta['order_id'], 'L08746BB3')
+        self.assertEqual(new_entry.meta['source'], 'rules')
+        self.assertNotIn('order_id', self.entry.meta)
+
+        first, second, third = new_entry.postings
+        self.assertIs(first, self.entry.postings[0])
+        for posting in (second, third):
+            self.assertEqual(posting.account, 'Expenses:Shopping')
+            self.assertEqual(posting.flag, '')
+            self.assertEqual(posting.meta['category'], 'online')
+
+    def test_set_payee_wins(self):
+        rule = Rule({
+            'match-narration': r"(?P<payee>amzn mktp us).*",
+            'set-payee': 'Amazon',
+        })
+        new_entry = rule.modify_entry(self.entry, rule.check(self.entry), flag_to_done=False)
+        self.assertEqual(new_entry.payee, 'Amazon')
+        self.assertEqual(new_entry.flag, '!')
+        self.assertEqual([p.flag for p in new_entry.postings], ['*', '!', '!'])
+
+
+class TestMatchPredicates(unittest.TestCase):
+
+    def setUp(self):
+        # 2020-04-11 is a Saturday
+        self.entry = parser.parse_one("""
+2020-04-11 ! "UBER   *TRIP HELP.UBER.COM"
+  * Liabilities:CreditCard  -23.50 USD
+  ! Expenses:FIXME           23.50 USD
+""")
+
+    def check(self, rule_dict):
+        return Rule(rule_dict).check(self.entry)
+
+    def test_amount(self):
+        self.assertEqual(self.check({'match-amount': {'min': 5, 'max': 80}}), {})
+        self.assertEqual(self.check({'match-amount': 23.5}), {})
+        self.assertEqual(self.check({'match-amount': {'exact': [1, '23.50'], 'currency': 'USD'}}), {})
+        self.assertIsNone(self.check({'match-amount': {'min': 5, 'currency': 'CAD'}}))
+        self.assertIsNone(self.check({'match-amount': {'max': 20}}))
+        self.assertEqual(self.check({'match-amount': [{'max': 20}, {'min': 20}]}), {})
+
+    def test_date(self):
+        self.assertEqual(self.check({'match-date': {'weekday': ['sat', 'sun']}}), {})
+        self.assertEqual(self.check({'match-date': {'min': '2020-04-01', 'max': '2020-04-30', 'day': [11]}}), {})
+        self.assertIsNone(self.check({'match-date': {'weekday': 'mon'}}))
+        self.assertIsNone(self.check({'match-date': {'max': '2020-04-10'}}))
+
+    def test_sub_keys(self):
+        rule = Rule({'match': {'amount': {'max': 80}, 'narration': 'UBER.*'}})
+        self.assertEqual([p.parameter for p in rule.match_predicates], ['amount'])
+        self.assertEqual(list(rule.match_requirements), ['transaction-narration'])
+        self.assertEqual(rule.check(self.entry), {})
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, Rule, {'match-amount': {'above': 5}})
+        self.assertRaises(ValueError, Rule, {'match-date': {'weekday': 'someday'}})
+
+    def test_cheapest_first(self):
+        rule = Rule({
+            'match-narration': r"(?P<payee>uber).*",
+            'match-amount': {'max': 80},
+            'match-date': {'weekday': 'sat'},
+        })
+        self.assertEqual([p.parameter for p in rule.match_predicates], ['date', 'amount'])
+        self.assertEqual(rule.check(self.entry), {'payee': 'UBER'})
+
+        # A failing predicate never gets to the regular expressions
+        rule = Rule({'match-narration': r"uber.*", 'match-date': {'weekday': 'mon'}})
+        seen = []
+        self.assertIsNone(rule.check(self.entry, on_regex=lambda regex, seconds: seen.append(regex)))
+        self.assertEqual(seen, [])
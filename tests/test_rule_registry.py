@@ -0,0 +1,138 @@
+import unittest
+from unittest import mock
+
+from beancount.parser import parser
+
+from coolbeans.rule import Rule
+from coolbeans.rules.index import RuleIndex
+from coolbeans.rules.registry import RuleRegistry, meta_rule_dict
+
+
+LEDGER = """
+2016-06-14 custom "matcher" "rule" "
+match-narration: (?P<payee>AirBnB).*
+match-account: Assets:.*
+set-posting-account: Income:AirBnB
+"
+
+2016-06-14 custom "matcher" "other" "ignored"
+
+2019-09-11 * "AirBnB" "Deposit - VRBO PAYMENTS"
+  match-narration: "Deposit - VRBO.*"
+  * Assets:Banking:BofA:Checking   1039.80 USD
+  * Income:VRBO                   -1039.80 USD
+
+2019-09-12 * "Imported, not a rule"
+  match-key: "201909110615000000000"
+  * Assets:Banking:BofA:Checking   10.00 USD
+  * Income:Other                  -10.00 USD
+
+2019-09-13 * "Booked, with a second key"
+  match-key: "201909130615000000000"
+  match-key-1: "201909130615000000001"
+  * Assets:Banking:BofA:Checking   20.00 USD
+  * Income:Other                  -20.00 USD
+"""
+
+PENDING = """
+2019-10-11 ! "AIRBNB PAYMENTS"
+  * Assets:Banking:BofA:Checking   1039.80 USD
+  ! Income:Unmatched              -1039.80 USD
+
+2019-10-12 ! "Deposit - VRBO PAYMENTS"
+  * Assets:Banking:BofA:Checking   100.00 USD
+  ! Income:Unmatched              -100.00 USD
+"""
+
+
+class TestRuleRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.entries, errors, _ = parser.parse_string(LEDGER)
+        self.assertEqual(errors, [])
+        self.registry = RuleRegistry()
+        self.registry.set_file_rules([Rule({'match-narration': 'Never'})])
+
+    def test_counts(self):
+        self.registry.update(self.entries)
+        self.assertEqual(self.registry.counts(), {'file': 1, 'custom': 1, 'meta': 1})
+        self.assertEqual(len(self.registry.rules), 3)
+        self.assertEqual(self.registry.built, 2)
+
+    def test_meta_rule_dict(self):
+        entry = self.entries[2]
+        self.assertEqual(meta_rule_dict(entry), {
+            'set-payee': 'AirBnB',
+            'set-posting-account': 'Income:VRBO',
+            'match-narration': 'Deposit - VRBO.*',
+        })
+
+    def test_match_key_not_a_rule(self):
+        # The booked entry with a match-key-1 used to be an invalid template
+        with mock.patch('coolbeans.rules.registry.logger') as logger:
+            self.registry.update(self.entries)
+        logger.error.assert_not_called()
+        self.assertEqual(self.registry.counts()['meta'], 1)
+
+    def test_match_key_not_copied(self):
+        entry = self.entries[2]._replace(meta=dict(
+            self.entries[2].meta, **{'match-key': "1", 'match-key-1': "2"}))
+        self.assertEqual(
+            meta_rule_dict(entry), meta_rule_dict(self.entries[2]))
+
+    def test_match_key_option(self):
+        rule = Rule({'match-narration': 'Deposit.*', 'match-key-1': "2"})
+        self.assertEqual(rule.options, {'match-key-1': "2"})
+        self.assertEqual(
+            list(rule.match_requirements), ['transaction-narration'])
+
+    def test_meta_rule_dict_expense_first(self):
+        entries, errors, _ = parser.parse_string("""
+2019-09-11 * "Coffee"
+  match-narration: "STARBUCKS.*"
+  * Expenses:Coffee                 4.50 USD
+  * Liabilities:CreditCard         -4.50 USD
+""")
+        self.assertEqual(errors, [])
+        self.assertEqual(meta_rule_dict(entries[0])['set-posting-account'], 'Expenses:Coffee')
+
+    def test_unchanged_not_recompiled(self):
+        self.registry.update(self.entries)
+        rules = self.registry.rules
+        version = self.registry.version()
+
+        entries, _, _ = parser.parse_string(LEDGER)
+        self.registry.update(entries)
+        self.assertEqual(self.registry.built, 0)
+        self.assertEqual(self.registry.reused, 2)
+        self.assertEqual([id(r) for r in self.registry.rules], [id(r) for r in rules])
+        self.assertEqual(self.registry.version(), version)
+
+    def test_changed_meta(self):
+        self.registry.update(self.entries)
+        custom_rule = self.registry.rules[1]
+        version = self.registry.version()
+
+        entries, _, _ = parser.parse_string(LEDGER.replace("VRBO.*", "VRBO PAY.*"))
+        self.registry.update(entries)
+        self.assertEqual((self.registry.built, self.registry.reused), (1, 1))
+        self.assertIs(self.registry.rules[1], custom_rule)
+        self.assertNotEqual(self.registry.version(), version)
+
+    def test_invalid_rule_skipped(self):
+        entries, _, _ = parser.parse_string(LEDGER + """
+2016-06-15 custom "matcher" "rule" "not-a-key: x"
+""")
+        with self.assertLogs('coolbeans.rules.registry', 'ERROR'):
+            self.registry.update(entries)
+        self.assertEqual(self.registry.counts()['custom'], 1)
+
+    def test_match(self):
+        self.registry.update(self.entries)
+        index = RuleIndex(self.registry.rules)
+        pending, _, _ = parser.parse_string(PENDING)
+        airbnb, vrbo = [entry for entry, _ in index.apply_many(pending)]
+        self.assertEqual(airbnb.payee, 'Airbnb')
+        self.assertEqual(airbnb.postings[1].account, 'Income:AirBnB')
+        self.assertEqual(vrbo.payee, 'AirBnB')
+        self.assertEqual(vrbo.postings[1].account, 'Income:VRBO')
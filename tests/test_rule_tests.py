@@ -0,0 +1,57 @@
+import unittest
+
+import yaml
+
+from coolbeans.rule import Rule
+from coolbeans.rules.testing import rule_test_cases, run_tests
+
+
+RULES = yaml.full_load("""
+- match-narration: AMZN Mktp.*
+  match-account: Liabilities:.*
+  set-posting-account: Expenses:Shopping
+  test-narration:
+    - AMZN Mktp US*L08746BB3
+    - Amazon.com
+  test:
+    narration: AMZN Mktp US*123
+    account: Liabilities:CreditCard:Chase
+- match-narration: (?P<payee>AirBnB).*
+  set-posting-account: Income:AirBnB
+  test-account: Assets:Checking
+- match-transaction-meta-ofx-type: DEBIT
+  set-tags: debit
+  test-meta-ofx-type: debit
+""")
+
+
+class TestRuleTests(unittest.TestCase):
+
+    def setUp(self):
+        self.rules = [Rule(r) for r in RULES]
+
+    def test_cases(self):
+        self.assertEqual(len(self.rules[0].tests), 2)
+        cases = rule_test_cases(self.rules[0])
+        self.assertEqual([c.values for c in cases], [
+            {'transaction-narration': 'AMZN Mktp US*L08746BB3'},
+            {'transaction-narration': 'Amazon.com'},
+            {'transaction-narration': 'AMZN Mktp US*123', 'posting-account': 'Liabilities:CreditCard:Chase'},
+        ])
+
+    def test_report(self):
+        report = run_tests(self.rules)
+        self.assertEqual(report.cases, 5)
+        self.assertFalse(report.ok)
+        self.assertEqual(
+            [(f.position, f.case, f.reason) for f in report.failures],
+            [(0, 1, "no match"), (1, 0, "no match-posting-account to test")]
+        )
+        self.assertEqual(set(report.seconds), {0, 1, 2})
+
+    def test_parallel(self):
+        rules = self.rules * 4
+        serial = run_tests(rules)
+        parallel = run_tests(rules, workers=2)
+        self.assertEqual(serial.cases, parallel.cases)
+        self.assertEqual(serial.failures, parallel.failures)
@@ -0,0 +1,336 @@
+import re
+import json
+import pathlib
+import tempfile
+import unittest
+
+import yaml
+from beancount.parser import parser
+
+from coolbeans.rule import Rule, fold
+from coolbeans.matcher import apply_coolbean_settings, match_directives
+from coolbeans.rules.index import RuleIndex, IndexCache, regex_prefixes, regex_infixes
+from coolbeans.rules.incremental import IncrementalMatcher
+from coolbeans.rules.stats import MatchStatistics, MatchProfiler
+from coolbeans.rules.parallel import ParallelMatcher
+from coolbeans.tools.fingerprint import entry_fingerprint
+
+
+RULES = yaml.load("""
+- match-narration: AMZN Mktp.*
+  set-posting-account: Expenses:Shopping
+- match-narration: (?P<payee>Amazon.com|amzn mktp us)\\*(?P<meta_order_id>.*)
+  match-account: Liabilities:.*
+- match-narration: .*airbnb.*
+  set-posting-account: Income:AirBnB
+- match-narration: Deposit - (AIRBNB|VRBO).*
+  set-narration: AirBnB Deposit
+- match-narration: AirBnB Deposit
+  set-payee: AirBnB
+- match-account: Assets:Banking:.*
+  set-tags: banking
+- match-narration: istanbul.*
+  set-posting-account: Expenses:Travel
+- match-transaction-meta-ofx-type: DEBIT
+  match-narration: '[0-9]+ .*'
+  set-posting-account: Expenses:Numbered
+""", Loader=yaml.FullLoader)
+
+
+ENTRIES = parser.parse_many("""
+2020-04-08 ! "AMZN Mktp US*L08746BB3"
+  match-key: "2020040824692160098100992944500"
+  ofx-type: "DEBIT"
+  * Liabilities:CreditCard:Chase:Amazon  -39.98 USD
+  ! Expenses:FIXME                        39.98 USD
+
+2019-09-11 ! "Deposit - AIRBNB PAYMENTS"
+  ofx-type: "CREDIT"
+  * Assets:Banking:NFCU:Checking   1039.80 USD
+  ! Income:Unmatched              -1039.80 USD
+
+2019-09-12 ! "İSTANBUL AIRPORT"
+  * Liabilities:CreditCard:Chase:Amazon  -10.00 USD
+  ! Expenses:FIXME                        10.00 USD
+
+2019-09-13 ! "123 STREET"
+  ofx-type: "DEBIT"
+  * Liabilities:CreditCard:Chase:Amazon  -10.00 USD
+  ! Expenses:FIXME                        10.00 USD
+
+2019-09-14 ! "Nothing to see"
+  * Liabilities:CreditCard:Chase:Amazon  -10.00 USD
+  ! Expenses:FIXME                        10.00 USD
+""")
+
+
+def linear_scan(rules, entry):
+    modified = False
+    for rule in rules:
+        match_values = rule.check(entry)
+        if match_values is None:
+            continue
+        entry = rule.modify_entry(entry, match_values)
+        modified = True
+    return entry, modified
+
+
+class TestRegexPrefixes(unittest.TestCase):
+
+    def test_literal(self):
+        self.assertEqual(regex_prefixes(re.compile("AMZN Mktp.*", re.I)), {"amzn mktp"})
+
+    def test_branch(self):
+        self.assertEqual(
+            regex_prefixes(re.compile(r"(?P<payee>Amazon.com|amzn mktp us)\*", re.I)),
+            {"amazon", "amzn mktp us"}
+        )
+
+    def test_no_prefix(self):
+        self.assertIsNone(regex_prefixes(re.compile(".*airbnb", re.I)))
+        self.assertIsNone(regex_prefixes(re.compile("(a|.b)", re.I)))
+
+    def test_infix(self):
+        self.assertEqual(regex_infixes(re.compile(".*AirBnB.*", re.I)), {"airbnb"})
+        self.assertEqual(regex_infixes(re.compile("AMZN.*", re.I)), {"amzn"})
+        self.assertIsNone(regex_infixes(re.compile(".+airbnb", re.I)))
+        self.assertIsNone(regex_infixes(re.compile(".*[0-9]", re.I)))
+
+    def test_fold(self):
+        self.assertTrue(fold("İstanbul").startswith("istanbul"))
+
+
+class TestRuleIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.rules = [Rule(r) for r in RULES]
+        self.index = RuleIndex(self.rules)
+
+    def test_same_as_linear_scan(self):
+        for entry in ENTRIES:
+            self.assertEqual(
+                linear_scan(self.rules, entry),
+                self.index.apply(entry),
+                entry.narration
+            )
+
+    def test_candidates_pruned(self):
+        entry, = [e for e in ENTRIES if e.narration == "Nothing to see"]
+        self.assertEqual(self.index.candidates(entry), [])
+        entry, = [e for e in ENTRIES if e.narration == "Deposit - AIRBNB PAYMENTS"]
+        self.assertEqual(self.index.candidates(entry), [2, 3, 5])
+
+
+class TestAccountShards(unittest.TestCase):
+
+    ACCOUNTS = [
+        "Liabilities:CreditCard:Chase:Amazon",
+        "Assets:Banking:NFCU:Checking",
+        "Expenses:FIXME",
+    ]
+
+    def setUp(self):
+        self.rules = [Rule(r) for r in RULES]
+        self.index = RuleIndex(self.rules, accounts=self.ACCOUNTS)
+
+    def test_same_as_linear_scan(self):
+        for entry in ENTRIES:
+            self.assertEqual(
+                linear_scan(self.rules, entry),
+                self.index.apply(entry),
+                entry.narration
+            )
+
+    def test_shards(self):
+        shards = self.index.account_shards
+        self.assertEqual(len(shards), 2)
+        self.assertEqual(shards.lookup("Liabilities:CreditCard:Chase:Amazon"), {1})
+        self.assertEqual(shards.lookup("Assets:Banking:NFCU:Checking"), {5})
+        self.assertEqual(shards.lookup("Expenses:FIXME"), set())
+        self.assertEqual(shards.lookup(None), set())
+
+    def test_lazy(self):
+        shards = self.index.account_shards
+        self.assertEqual(shards.computed, 0)
+        shards.lookup("Expenses:FIXME")
+        shards.lookup("Assets:Other")
+        shards.lookup("Expenses:FIXME")
+        # Only what was looked up, once each
+        self.assertEqual(shards.computed, 2)
+        self.assertEqual(set(shards.shards), {"Expenses:FIXME", "Assets:Other"})
+
+        # Same accounts, nothing to do
+        self.index.set_accounts(reversed(self.ACCOUNTS))
+        self.assertIn("Assets:Other", shards.shards)
+
+        self.index.set_accounts(self.ACCOUNTS[2:])
+        shards.lookup("Expenses:FIXME")
+        self.assertEqual(shards.computed, 2)
+        self.assertNotIn("Assets:Other", shards.shards)
+
+        # A new Rule is added to the shards we already have
+        self.index.add_rule(Rule({'match-account': 'Expenses:.*', 'set-tags': 'fixme'}))
+        self.assertEqual(shards.lookup("Expenses:FIXME"), {len(RULES)})
+        self.assertEqual(shards.computed, 2)
+
+    def test_candidates_pruned(self):
+        # Filed under the narration, the longer literal prefix
+        rules = [Rule({'match-narration': 'AMZN Mktp US.*', 'match-account': 'Assets:.*'})]
+        entry, = [e for e in ENTRIES if e.narration.startswith("AMZN")]
+        index = RuleIndex(rules, accounts=self.ACCOUNTS)
+        self.assertEqual(list(index.tables), [('transaction', 'narration', None)])
+        self.assertEqual(index.candidates(entry), [])
+        self.assertEqual(index.candidates(entry._replace(postings=entry.postings[1:])), [])
+
+
+class TestIndexCache(unittest.TestCase):
+
+    def test_reused(self):
+        rules = [Rule(r) for r in RULES]
+        cache = IndexCache()
+        index = cache.get("v1", rules, accounts=TestAccountShards.ACCOUNTS)
+        index.account_shards.lookup("Expenses:FIXME")
+
+        stats = MatchStatistics(len(rules))
+        self.assertIs(cache.get("v1", [Rule(r) for r in RULES], stats=stats, accounts=["Expenses:FIXME"]), index)
+        self.assertIs(index.stats, stats)
+        self.assertEqual(index.account_shards.accounts, {"Expenses:FIXME"})
+        self.assertEqual(index.account_shards.computed, 1)
+        self.assertEqual(cache.hits, 1)
+
+        self.assertIsNot(cache.get("v2", rules), index)
+
+
+class TestIncrementalMatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.index = RuleIndex(Rule(r) for r in RULES)
+
+    def test_fingerprint_ignores_position(self):
+        entry = ENTRIES[0]
+        moved = entry._replace(meta=dict(entry.meta, lineno=999))
+        self.assertEqual(entry_fingerprint(entry), entry_fingerprint(moved))
+        changed = entry._replace(narration="Other")
+        self.assertNotEqual(entry_fingerprint(entry), entry_fingerprint(changed))
+
+    def test_reuse(self):
+        matcher = IncrementalMatcher()
+        matcher.begin(self.index, "v1")
+        first = [matcher.apply(entry) for entry in ENTRIES]
+        matcher.finish()
+        self.assertEqual(matcher.misses, len(ENTRIES))
+
+        matcher.begin(self.index, "v1")
+        second = [matcher.apply(entry) for entry in ENTRIES]
+        matcher.finish()
+        self.assertEqual(matcher.hits, len(ENTRIES))
+        self.assertEqual(first, second)
+        self.assertEqual(first, [self.index.apply(entry) for entry in ENTRIES])
+
+    def test_apply_many(self):
+        matcher = IncrementalMatcher()
+        matcher.begin(self.index, "v1")
+        matcher.apply(ENTRIES[0])
+        results = matcher.apply_many(ENTRIES)
+        self.assertEqual(matcher.hits, 1)
+        self.assertEqual(results, self.index.apply_many(ENTRIES))
+
+    def test_new_version(self):
+        matcher = IncrementalMatcher()
+        matcher.begin(self.index, "v1")
+        matcher.apply(ENTRIES[0])
+        matcher.begin(self.index, "v2")
+        matcher.apply(ENTRIES[0])
+        self.assertEqual(matcher.misses, 1)
+        self.assertEqual(matcher.hits, 0)
+
+    def test_profiled_reload(self):
+        # Replayed results would leave every rule at 0 evaluations in the report
+        with tempfile.TemporaryDirectory() as tmp:
+            output_file = pathlib.Path(tmp).joinpath('matched.bean')
+            entries, errors, _ = parser.parse_string(f"""
+2020-01-01 custom "coolbeans" "match-profile" "json"
+2020-01-01 custom "coolbeans" "match-incremental" "true"
+2020-01-01 custom "coolbeans" "output-file" "{output_file}"
+2020-01-01 custom "matcher" "rule" "
+match-narration: AMZN Mktp.*
+set-posting-account: Expenses:Shopping
+"
+""")
+            self.assertEqual(errors, [])
+            entries += ENTRIES
+            options_map = {}
+            apply_coolbean_settings(entries, options_map)
+            for _ in range(2):
+                match_directives(entries, options_map)
+                with output_file.with_name('matched.profile.json').open() as stream:
+                    report, = json.load(stream)['rules']
+                self.assertEqual(report['evaluations'], 1)
+                self.assertEqual(report['hits'], 1)
+
+
+class TestMatchStatistics(unittest.TestCase):
+
+    def test_counters(self):
+        rules = [Rule(r) for r in RULES]
+        stats = MatchStatistics(len(rules), near_miss_size=1)
+        index = RuleIndex(rules, stats=stats)
+        for entry in ENTRIES:
+            index.apply(entry)
+
+        self.assertEqual(len(stats), len(rules))
+        # The .*airbnb.* rule is filed on airbnb, so it's only tried once
+        self.assertEqual(stats.attempts[2], 1)
+        self.assertEqual(stats.hits[2], 1)
+        self.assertEqual(stats.hits[7], 1)
+        # The AMZN entry has the DEBIT meta, but no number in the narration
+        self.assertEqual(len(stats.near_misses), 1)
+        self.assertEqual(stats.near_misses[0].position, 7)
+
+    def test_near_miss_rate(self):
+        rules = [Rule(r) for r in RULES]
+        stats = MatchStatistics(len(rules), near_miss_size=10, near_miss_rate=2)
+        index = RuleIndex(rules, stats=stats)
+        for entry in ENTRIES + ENTRIES:
+            index.apply(entry)
+        # The same near miss twice, only the second one is kept
+        self.assertEqual(stats.near_miss_count, 2)
+        self.assertEqual([n.position for n in stats.near_misses], [7])
+
+    def test_profile_report(self):
+        rules = [Rule(r) for r in RULES + [{'match-narration': 'Never'}]]
+        stats = MatchProfiler(len(rules))
+        index = RuleIndex(rules, stats=stats)
+        for entry in ENTRIES:
+            index.apply(entry)
+
+        report = stats.report(rules)
+        self.assertEqual(len(report['rules']), len(rules))
+        dead = {r['position'] for r in report['rules'] if r['dead']}
+        self.assertEqual(dead, {len(RULES)})
+        self.assertIn('.*airbnb.*', {r['pattern'] for r in report['regexes']})
+
+        with tempfile.TemporaryDirectory() as tmp:
+            output_file = pathlib.Path(tmp).joinpath("matched.bean")
+            report_file = stats.write_report(rules, output_file, format='json')
+            self.assertEqual(report_file.name, "matched.profile.json")
+            with report_file.open() as stream:
+                self.assertEqual(json.load(stream)['rules'], report['rules'])
+
+
+class TestParallelMatcher(unittest.TestCase):
+
+    def test_same_as_serial(self):
+        index = RuleIndex(Rule(r) for r in RULES)
+        entries = list(ENTRIES) * 3
+        parallel = ParallelMatcher(index, workers=2, threshold=1, chunk_size=4)
+        self.assertTrue(parallel.use_pool(len(entries)))
+        self.assertEqual(
+            index.apply_many(entries, match_many=parallel.match_many),
+            index.apply_many(entries)
+        )
+
+    def test_threshold(self):
+        index = RuleIndex(Rule(r) for r in RULES)
+        parallel = ParallelMatcher(index, workers=2, threshold=100)
+        self.assertFalse(parallel.use_pool(len(ENTRIES)))
@@ -0,0 +1,85 @@
+import os
+import pathlib
+import tempfile
+import unittest
+from unittest import mock
+
+from coolbeans.rules.cache import RulesCache
+
+
+RULES_YAML = """
+- match-narration: AMZN Mktp.*
+  match-account: Liabilities:.*
+  set-posting-account: Expenses:Shopping
+- match:
+    narration: (?P<payee>AirBnB).*
+  set-transaction:
+    tags: travel
+"""
+
+
+class TestRulesCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = pathlib.Path(self.tmp.name)
+        self.rules_file = self.dir.joinpath("rules.yaml")
+        self.rules_file.write_text(RULES_YAML)
+        self.cache = RulesCache(self.dir.joinpath("cache"))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def assertSameRules(self, first, second):
+        self.assertEqual(len(first), len(second))
+        for a, b in zip(first, second):
+            self.assertEqual(a.match_requirements, b.match_requirements)
+            self.assertEqual(a.set_rules, b.set_rules)
+
+    def test_hit(self):
+        first = self.cache.load(self.rules_file)
+        cache = RulesCache(self.dir.joinpath("cache"))
+        second = cache.load(self.rules_file)
+        self.assertEqual(self.cache.misses, 1)
+        self.assertEqual(cache.hits, 1)
+        self.assertSameRules(first, second)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(first[1].set_rules), 1)
+
+    def test_invalidate(self):
+        self.cache.load(self.rules_file)
+        stat = self.rules_file.stat()
+
+        # Same mtime, different content
+        self.rules_file.write_text(RULES_YAML.replace("Shopping", "Books"))
+        os.utime(str(self.rules_file), ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        cache = RulesCache(self.dir.joinpath("cache"))
+        rules = cache.load(self.rules_file)
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(rules[0].set_rules[0].value, "Expenses:Books")
+
+    def test_disabled(self):
+        cache = RulesCache("off")
+        cache.load(self.rules_file)
+        cache.load(self.rules_file)
+        self.assertEqual(cache.misses, 2)
+
+    def test_mirror(self):
+        first = self.cache.load(self.rules_file)
+        mirror_file = self.cache.mirror_file(self.rules_file.absolute())
+        self.assertTrue(mirror_file.exists())
+
+        # Without the pickle we fall back to the mirror, not the YAML
+        self.cache.cache_file(self.rules_file.absolute()).unlink()
+        cache = RulesCache(self.dir.joinpath("cache"))
+        with mock.patch('coolbeans.rules.cache.yaml_load') as yaml_load:
+            second = cache.load(self.rules_file)
+        yaml_load.assert_not_called()
+        self.assertSameRules(first, second)
+
+        # A changed YAML file ignores the stale mirror
+        self.cache.cache_file(self.rules_file.absolute()).unlink()
+        self.rules_file.write_text(RULES_YAML.replace("Shopping", "Books"))
+        rules = RulesCache(self.dir.joinpath("cache")).load(self.rules_file)
+        self.assertEqual(rules[0].set_rules[0].value, "Expenses:Books")
@@ -0,0 +1,75 @@
+import unittest
+
+from beancount.parser import parser
+
+from coolbeans.tools.store import EntryStore
+
+
+ENTRIES = parser.parse_many("""
+2020-01-01 open Assets:Checking
+
+2020-01-02 ! "Pending"
+  Assets:Checking  -10 USD
+  Expenses:FIXME    10 USD
+
+2020-01-02 * "Booked"
+  Assets:Checking  -10 USD
+  Expenses:Food     10 USD
+""")
+
+
+class TestEntryStore(unittest.TestCase):
+
+    def test_add_once(self):
+        store = EntryStore(ENTRIES + ENTRIES)
+        self.assertEqual(len(store), 3)
+        self.assertEqual(store.to_list(), ENTRIES)
+        self.assertFalse(store.add(ENTRIES[0]))
+
+    def test_identity(self):
+        # An equal entry is still a different entry
+        copy = ENTRIES[1]._replace()
+        store = EntryStore(ENTRIES)
+        self.assertNotIn(copy, store)
+        self.assertFalse(store.discard(copy))
+        self.assertEqual(len(store), 3)
+
+    def test_discard(self):
+        store = EntryStore(ENTRIES)
+        self.assertTrue(store.discard(ENTRIES[1]))
+        self.assertNotIn(ENTRIES[1], store)
+        self.assertEqual(store.to_list(), [ENTRIES[0], ENTRIES[2]])
+        store.add(ENTRIES[1])
+        self.assertEqual(store.to_list(), [ENTRIES[0], ENTRIES[2], ENTRIES[1]])
+
+    def test_replace(self):
+        pending, booked = ENTRIES[1], ENTRIES[2]
+        store = EntryStore(ENTRIES[:2])
+        new = booked._replace(narration="New")
+        self.assertTrue(store.replace(pending, new))
+        self.assertEqual(store.to_list(), [ENTRIES[0], new])
+        self.assertFalse(store.add(new))
+        # Nothing to replace, so it's appended
+        store.replace(pending, booked)
+        self.assertEqual(store.to_list(), [ENTRIES[0], new, booked])
+        # Already in the store, so it moves
+        store.replace(ENTRIES[0], booked)
+        self.assertEqual(store.to_list(), [booked, new])
+
+    def test_position(self):
+        pending, booked = ENTRIES[1], ENTRIES[2]
+        store = EntryStore(ENTRIES[:2])
+        store.add(booked)
+        self.assertEqual([store.position(e) for e in store], [0, 1, 2])
+        new = pending._replace(flag='*')
+        store.replace(pending, new)
+        self.assertEqual(store.position(new), 1)
+        with self.assertRaises(KeyError):
+            store.position(pending)
+
+    def test_sort(self):
+        store = EntryStore(reversed(ENTRIES))
+        store.sort(key=lambda e: e.meta['lineno'])
+        self.assertEqual(store.to_list(), ENTRIES)
+        store.discard(ENTRIES[0])
+        self.assertEqual(len(store), 2)
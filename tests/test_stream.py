@@ -0,0 +1,82 @@
+import io
+import pathlib
+import tempfile
+import unittest
+
+import yaml
+
+from coolbeans.rule import Rule
+from coolbeans.rules.index import RuleIndex
+from coolbeans.rules.stream import iter_chunks, match_chunks, match_files
+
+
+RULES = yaml.full_load("""
+- match-narration: AMZN Mktp.*
+  set-posting-account: Expenses:Shopping
+- match-narration: (?P<payee>AirBnB).*
+  set-posting-account: Income:AirBnB
+""")
+
+STAGED = """option "operating_currency" "USD"
+
+2020-04-08 ! "AMZN Mktp US*L08746BB3"
+  * Liabilities:CreditCard  -39.98 USD
+  ! Expenses:FIXME           39.98 USD
+
+pushtag #import
+2020-04-09 ! "AirBnB Deposit"
+  * Assets:Checking   1039.80 USD
+  ! Income:Unmatched -1039.80 USD
+
+2020-04-10 ! "Corner Store"
+  * Assets:Checking  -5.00 USD
+  ! Expenses:FIXME    5.00 USD
+poptag #import
+
+2020-04-11 * "Already Done"
+  * Assets:Checking  -5.00 USD
+  * Expenses:Food     5.00 USD
+"""
+
+
+class TestStream(unittest.TestCase):
+
+    def setUp(self):
+        self.index = RuleIndex([Rule(r) for r in RULES])
+
+    def test_chunks(self):
+        chunks = list(iter_chunks(io.StringIO(STAGED), chunk_size=1))
+        self.assertEqual([c.lineno for c in chunks], [1, 8, 12, 17])
+        self.assertEqual([c.tags for c in chunks], [[], ['import'], ['import'], []])
+        self.assertEqual("".join(c.text() for c in chunks), STAGED)
+
+    def test_same_as_one_chunk(self):
+        def run(chunk_size):
+            chunks = iter_chunks(io.StringIO(STAGED), chunk_size=chunk_size)
+            return [
+                (entries, errors, matched)
+                for entries, errors, matched in match_chunks(chunks, self.index)
+            ]
+
+        whole = run(1000)
+        self.assertEqual(len(whole), 1)
+        entries, errors, matched = whole[0]
+        self.assertEqual(errors, [])
+        self.assertEqual(matched, 2)
+
+        chunked = run(1)
+        self.assertEqual(len(chunked), 4)
+        self.assertEqual(sum((r[0] for r in chunked), []), entries)
+        self.assertEqual(sum(r[2] for r in chunked), 2)
+        self.assertEqual(entries[2].tags, {'import'})
+        self.assertEqual(entries[2].meta['lineno'], 12)
+
+    def test_match_files(self):
+        output = io.StringIO()
+        with tempfile.TemporaryDirectory() as tmp:
+            staged = pathlib.Path(tmp).joinpath("staged.bean")
+            staged.write_text(STAGED)
+            totals = match_files([str(staged)], self.index, output, chunk_size=2)
+        self.assertEqual(totals, (4, 2, 0))
+        self.assertIn("Expenses:Shopping", output.getvalue())
+        self.assertIn("Income:AirBnB", output.getvalue())